@@ -1,7 +1,6 @@
 import streamlit as st
 import importlib.util
 import sys
-import sqlite3
 from PIL import Image
 import os
 
@@ -13,33 +12,7 @@ st.set_page_config(
 )
 
 
-# Create a database connection to the SQLite database: app_data.db
-def create_connection():
-    conn = None
-    try:
-        conn = sqlite3.connect('data/app_data.db')
-        print(sqlite3.version)
-    except sqlite3.Error as e:
-        print(e)
-    return conn
-
-
-# Function to close the connection
-def close_connection(conn):
-    if conn is not None:
-        conn.close()
-        print('Database connection closed successfully.')
-
-
-# Initialize session state
-# session_state = st.session_state
-
-# Check if database connection is already stored in session state
-# if 'conn' not in session_state:
-# If not, establish new connection and store in session state
-# session_state.conn = create_connection()
-# print('New database connection stored in session state')
-# This created some issues during runtime, so I am commenting it out.
+# The database connections are shared by all pages through the connection pool in util/database.py
 
 # Loading the modules
 @st.cache_data
@@ -0,0 +1,106 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from tag_papers import DATA_DIR, PAPER_EMBEDDINGS_PATH, TOPIC_EMBEDDINGS_PATH
+
+# The index is shared with the app, which lives in the util package one level up
+sys.path.insert(0, os.path.dirname(DATA_DIR))
+from util.ann_index import DEFAULT_NPROBE, KMEANS_ITERATIONS, IVFIndex, index_path
+from util.embedding_store import open_embedding_store
+
+# Number of papers used as queries to measure the recall and latency of an index
+EVALUATION_QUERIES = 200
+
+# Neighbours compared with the exact search for the recall
+EVALUATION_K = 10
+
+
+def evaluate_index(index, queries, nprobes, k=EVALUATION_K):
+    """
+    Measure the recall and latency of an index against the exact search, for several numbers of probed lists.
+
+    Parameters:
+    index (IVFIndex): Index to evaluate
+    queries (np.ndarray): Unit length query embeddings, queries x dimensions
+    nprobes (list): Numbers of lists to probe
+    k (int): Number of neighbours per query
+
+    Returns:
+    list: (nprobe, recall, milliseconds per query) tuples, with nprobe None for the exact search
+    """
+    start = time.perf_counter()
+    exact = [set(index.search(query, k, exact=True)[0].tolist()) for query in queries]
+    results = [(None, 1.0, (time.perf_counter() - start) * 1000 / len(queries))]
+    for nprobe in nprobes:
+        start = time.perf_counter()
+        found = [index.search(query, k, nprobe)[0] for query in queries]
+        elapsed = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = np.mean([len(expected.intersection(rows.tolist())) / max(len(expected), 1)
+                          for expected, rows in zip(exact, found)])
+        results.append((nprobe, recall, elapsed))
+    return results
+
+
+def build_ann_index(store_path, lists=None, iterations=KMEANS_ITERATIONS, queries=None, nprobes=(DEFAULT_NPROBE,)):
+    """
+    Build the IVF index of an embedding store, write it next to the store and report its recall and latency.
+
+    Parameters:
+    store_path (str): Path of the embedding store of build_embeddings.py
+    lists (int): Number of lists, about 4 x sqrt(embeddings) if None
+    iterations (int): k-means iterations
+    queries (np.ndarray): Query embeddings to evaluate the index with, the index is not evaluated if None
+    nprobes (list): Numbers of lists to probe in the evaluation
+
+    Returns:
+    IVFIndex: The index, or None if there is no store
+    """
+    store = open_embedding_store(store_path)
+    if store is None or not len(store):
+        print(f"Error! {store_path} is missing or empty, run build_embeddings.py first.")
+        return None
+    start = time.perf_counter()
+    index = IVFIndex.build(store, lists=lists, iterations=iterations)
+    index.save(index_path(store_path))
+    sizes = np.diff(index.list_start)
+    print(f"Indexed {len(store)} embeddings of {store_path} into {index.lists} lists (largest {sizes.max()}) in "
+          f"{time.perf_counter() - start:.2f} s.")
+    if queries is not None and len(queries):
+        for nprobe, recall, elapsed in evaluate_index(index, queries, nprobes):
+            name = 'exact search' if nprobe is None else f"nprobe {nprobe}"
+            print(f"  {name}: recall@{EVALUATION_K} {recall:.3f}, {elapsed:.2f} ms per query")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the approximate nearest neighbour indexes of the embedding "
+                                                 "stores.")
+    parser.add_argument('--papers', default=PAPER_EMBEDDINGS_PATH, help="path of the paper embedding store")
+    parser.add_argument('--topics', default=TOPIC_EMBEDDINGS_PATH, help="path of the topic embedding store")
+    parser.add_argument('--paper-lists', type=int,
+                        help="number of lists of the paper index, about 4 x sqrt(papers) by default")
+    parser.add_argument('--topic-lists', type=int,
+                        help="number of lists of the topic index, about 4 x sqrt(topics) by default")
+    parser.add_argument('--iterations', type=int, default=KMEANS_ITERATIONS, help="k-means iterations")
+    parser.add_argument('--nprobe', type=int, nargs='*', default=[1, 4, DEFAULT_NPROBE, 32],
+                        help="numbers of probed lists to report the recall and latency of")
+    args = parser.parse_args()
+
+    # Sampled papers serve as queries for both indexes: similar papers, and the topics of a paper when tagging
+    papers = open_embedding_store(args.papers)
+    queries = None
+    if papers is not None and len(papers):
+        sample = np.random.default_rng(0).choice(len(papers), min(len(papers), EVALUATION_QUERIES), replace=False)
+        queries = papers.vectors(np.sort(sample))
+        queries = queries[queries.any(axis=1)]
+    for store_path, lists in ((args.topics, args.topic_lists), (args.papers, args.paper_lists)):
+        build_ann_index(store_path, lists=lists, iterations=args.iterations, queries=queries,
+                        nprobes=args.nprobe)
+
+
+if __name__ == "__main__":
+    main()
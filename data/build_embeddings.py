@@ -0,0 +1,124 @@
+import sqlite3
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+from create_topic_descendants import create_connection
+from tag_papers import (DATA_DIR, DATABASE_PATH, DEFAULT_BATCH_SIZE, PAPER_EMBEDDINGS_PATH, TOPIC_EMBEDDINGS_PATH,
+                        SHARDS_IN_FLIGHT_PER_WORKER, embed_topics, embed_papers, shard_bounds, ordered_map)
+
+# The embedding store is shared with the app, which lives in the util package one level up
+sys.path.insert(0, os.path.dirname(DATA_DIR))
+from util.embedding_store import DTYPES, EmbeddingStoreWriter
+from util.text_vectorizer import HashingVectorizer
+
+# State of an embedding worker process, set up once by init_worker
+_worker = {}
+
+
+def init_worker(database, vectorizer_settings):
+    """ Set up an embedding worker: its own read-only database connection and the vectorizer """
+    _worker['conn'] = sqlite3.connect(f"file:{database}?mode=ro", uri=True)
+    _worker['vectorizer'] = HashingVectorizer.from_dict(vectorizer_settings)
+
+
+def embed_shard(bounds):
+    """
+    Embed the papers of one shard in a worker.
+
+    Parameters:
+    bounds (tuple): (first id, last id) of the shard
+
+    Returns:
+    tuple: (paper ids, float32 embeddings)
+    """
+    papers = _worker['conn'].execute("SELECT id, title, abstract FROM papers WHERE id BETWEEN ? AND ? ORDER BY id",
+                                     bounds).fetchall()
+    return np.array([paper[0] for paper in papers], dtype=np.int64), embed_papers(papers, _worker['vectorizer'])
+
+
+def build_embeddings(conn, database, papers_path, topics_path, dtype='float16', batch_size=DEFAULT_BATCH_SIZE,
+                     workers=1):
+    """
+    Write the embedding stores of the topics and the papers.
+
+    The vectorizer is fitted on the topics as in tag_papers.py, and its version is stored in the header of both
+    stores, so tagging and the app only use embeddings that match the current topics. The papers are embedded in
+    shards by a pool of worker processes and streamed into the store in id order.
+
+    Parameters:
+    conn (sqlite3.Connection): Connection to the database
+    database (str): Path to the database, opened read-only by the workers
+    papers_path (str): Path of the paper embedding store
+    topics_path (str): Path of the topic embedding store
+    dtype (str): Storage type of the embeddings, one of DTYPES
+    batch_size (int): Number of papers per shard
+    workers (int): Number of worker processes, the papers are embedded in this process if 1
+
+    Returns:
+    tuple: (number of topics, number of papers)
+    """
+    vectorizer, topic_ids, _, topic_embeddings = embed_topics(conn)
+    order = np.argsort(topic_ids)
+    with EmbeddingStoreWriter(topics_path, vectorizer, dtype) as writer:
+        writer.add(topic_ids[order], topic_embeddings[order])
+
+    start = time.perf_counter()
+    shards = shard_bounds(conn, 0, batch_size)
+    settings = (database, vectorizer.to_dict())
+    pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=settings) if workers > 1 else None
+    if pool is None:
+        init_worker(*settings)
+    papers = 0
+    try:
+        with EmbeddingStoreWriter(papers_path, vectorizer, dtype) as writer:
+            # The shards come back in order, so the ids are added in ascending order
+            for ids, embeddings in ordered_map(pool, embed_shard, shards, SHARDS_IN_FLIGHT_PER_WORKER * workers):
+                writer.add(ids, embeddings)
+                papers += len(ids)
+                print(f"Embedded {papers} papers, {papers / (time.perf_counter() - start):.0f} papers/s.")
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        else:
+            _worker.pop('conn').close()
+        _worker.clear()
+    return len(topic_ids), papers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed the topics and papers into memory-mapped embedding stores.")
+    parser.add_argument('--database', default=DATABASE_PATH, help="path to the SQLite database")
+    parser.add_argument('--papers-output', default=PAPER_EMBEDDINGS_PATH, help="path of the paper embedding store")
+    parser.add_argument('--topics-output', default=TOPIC_EMBEDDINGS_PATH, help="path of the topic embedding store")
+    parser.add_argument('--dtype', choices=list(DTYPES), default='float16',
+                        help="storage type of the embeddings, int8 takes half the space of float16 but is not "
+                             "used by tag_papers.py")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="number of papers per shard")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes embedding shards in parallel")
+    args = parser.parse_args()
+
+    conn = create_connection(args.database)
+    if conn is not None:
+        start = time.perf_counter()
+        try:
+            topics, papers = build_embeddings(conn, args.database, args.papers_output, args.topics_output,
+                                              dtype=args.dtype, batch_size=args.batch_size, workers=args.workers)
+            print(f"Embedded {topics} topics and {papers} papers as {args.dtype} in "
+                  f"{time.perf_counter() - start:.2f} s.")
+        except sqlite3.Error as e:
+            print(e)
+        finally:
+            conn.close()
+    else:
+        print("Error! cannot create the database connection.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import sqlite3
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+from create_topic_descendants import create_connection
+from db_meta import get_topics_version
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+DATABASE_PATH = os.path.join(DATA_DIR, 'app_data.db')
+ARTIFACT_PATH = os.path.join(DATA_DIR, 'artifacts', 'main_sunburst.json')
+
+# The chart is built with the same code as the app, which lives in the util package one level up
+sys.path.insert(0, os.path.dirname(DATA_DIR))
+from util.main_sunburst import build_main_tree, write_main_tree_artifact
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prebuild the main topic tree sunburst for the Topic Tree page.")
+    parser.add_argument('--database', default=DATABASE_PATH, help="path to the SQLite database")
+    parser.add_argument('--output', default=ARTIFACT_PATH, help="path of the artifact")
+    args = parser.parse_args()
+
+    conn = create_connection(args.database)
+    if conn is not None:
+        start = time.perf_counter()
+        try:
+            topics_version = get_topics_version(conn.cursor())
+            df = pd.read_sql("SELECT s, prefLabel, broader, level FROM topics", conn)
+            df_prepared, figure_json = build_main_tree(df)
+            if figure_json is None:
+                print("Error! The topic tree could not be built.")
+            else:
+                write_main_tree_artifact(args.output, topics_version, df_prepared, figure_json)
+                print(f"Built the topic tree of {len(df_prepared)} nodes for topics version {topics_version} "
+                      f"in {time.perf_counter() - start:.2f} s.")
+        except (sqlite3.Error, pd.io.sql.DatabaseError) as e:
+            print(e)
+        finally:
+            conn.close()
+    else:
+        print("Error! cannot create the database connection.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import sqlite3
+import argparse
+import os
+import sys
+import time
+
+from create_topic_descendants import create_connection
+from db_meta import get_meta, DATABASE_VERSION_KEY
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+DATABASE_PATH = os.path.join(DATA_DIR, 'app_data.db')
+ARTIFACT_PATH = os.path.join(DATA_DIR, 'artifacts', 'topic_incidence.npz')
+
+# The matrices are built with the same code as the app, which lives in the util package one level up
+sys.path.insert(0, os.path.dirname(DATA_DIR))
+from util.topic_cooccurrence import TopicCooccurrence, fetch_paper_topic_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prebuild the paper x topic incidence matrix and the topic "
+                                                 "co-occurrence counts for the Topic Search page.")
+    parser.add_argument('--database', default=DATABASE_PATH, help="path to the SQLite database")
+    parser.add_argument('--output', default=ARTIFACT_PATH, help="path of the artifact")
+    args = parser.parse_args()
+
+    conn = create_connection(args.database)
+    if conn is not None:
+        start = time.perf_counter()
+        try:
+            database_version = get_meta(conn.cursor(), DATABASE_VERSION_KEY)
+            rows = fetch_paper_topic_rows(conn)
+            if not rows:
+                print("Error! paper_topics is empty, run db_manager.py first.")
+            else:
+                cooccurrence = TopicCooccurrence.from_rows(rows)
+                cooccurrence.save(args.output, database_version)
+                print(f"Built the incidence matrix of {cooccurrence.incidence.shape[0]} papers x "
+                      f"{len(cooccurrence.topics)} topics with {cooccurrence.counts.nnz} topic pairs over "
+                      f"{len(cooccurrence.years)} years for data version {database_version} "
+                      f"in {time.perf_counter() - start:.2f} s.")
+        except sqlite3.Error as e:
+            print(e)
+        finally:
+            conn.close()
+    else:
+        print("Error! cannot create the database connection.")
+
+
+if __name__ == "__main__":
+    main()
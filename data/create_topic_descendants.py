@@ -1,6 +1,11 @@
 import sqlite3
-import csv
+import argparse
 import os
+import time
+
+from db_meta import bump_database_version
+
+DATABASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app_data.db')
 
 
 def create_connection(db_file):
@@ -14,47 +19,96 @@ def create_connection(db_file):
     return conn
 
 
-def find_and_store_descendants(cursor, conn, topic):
-    cursor.execute("SELECT s FROM topics WHERE prefLabel = ?", (topic,))
-    topic_url = cursor.fetchone()
-    if topic_url:
-        cursor.execute("SELECT prefLabel FROM topics WHERE broader = ?", (topic_url[0],))
-        children = cursor.fetchall()
-        for child in children:
-            child_topic = child[0]
-            # Check if the pair already exists
-            cursor.execute("SELECT COUNT(*) FROM topic_descendants WHERE topic = ? AND descendant = ?", (topic, child_topic))
-            if cursor.fetchone()[0] == 0:  # If no entry exists, insert new pair
-                cursor.execute("INSERT INTO topic_descendants (topic, descendant) VALUES (?, ?)", (topic, child_topic))
-            find_and_store_descendants(cursor, conn, child_topic)
+def compute_closure(topic_rows):
+    """
+    Compute the full ancestor/descendant closure of the topic tree in memory.
 
+    Every topic walks up its chain of broader topics, so the work is iterative (no recursion limit for deep
+    hierarchies) and proportional to the total depth of the tree. Cycles in the broader links are cut off.
+
+    Parameters:
+    topic_rows (list): (s, broader, prefLabel) tuples from the topics table
+
+    Returns:
+    dict: {(topic, descendant): depth} keyed on prefLabel, depth 1 for direct children
+    """
+    broader_of = {s: broader for s, broader, _ in topic_rows}
+    label_of = {s: label for s, _, label in topic_rows}
+
+    closure = {}
+    for s, _, label in topic_rows:
+        seen = {s}
+        depth = 1
+        ancestor = broader_of.get(s)
+        while ancestor in label_of and ancestor not in seen:
+            seen.add(ancestor)
+            pair = (label_of[ancestor], label)
+            # Duplicate labels can reach the same pair through different paths, keep the shortest one
+            if pair[0] != pair[1] and depth < closure.get(pair, depth + 1):
+                closure[pair] = depth
+            ancestor = broader_of.get(ancestor)
+            depth += 1
+    return closure
 
-def main():
-    # Direct path specification for clarity
-    database_path = '/Users/ahmetokur/Desktop/bachelor_app/data/app_data.db'
-    conn = create_connection(database_path)
-    if conn is not None:
-        cursor = conn.cursor()
 
+def rebuild_topic_descendants(conn):
+    """
+    Rebuild the topic_descendants closure table from the topics table.
+
+    The topics are loaded with a single query, the closure is computed in memory and bulk inserted into a new
+    table, which then replaces topic_descendants inside the same transaction.
+
+    Parameters:
+    conn (sqlite3.Connection): Connection to the database
+
+    Returns:
+    int: Number of (topic, descendant) rows written
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT s, broader, prefLabel FROM topics WHERE s IS NOT NULL AND prefLabel IS NOT NULL")
+    closure = compute_closure(cursor.fetchall())
+
+    try:
+        cursor.execute("BEGIN")
+        cursor.execute("DROP TABLE IF EXISTS topic_descendants_new")
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS topic_descendants (
+            CREATE TABLE topic_descendants_new (
                 topic TEXT NOT NULL,
                 descendant TEXT NOT NULL,
+                depth INTEGER NOT NULL,
                 PRIMARY KEY (topic, descendant)
-            );
+            ) WITHOUT ROWID;
         """)
+        cursor.executemany("INSERT INTO topic_descendants_new (topic, descendant, depth) VALUES (?, ?, ?)",
+                           ((topic, descendant, depth) for (topic, descendant), depth in sorted(closure.items())))
+        # Swap the new table in, readers see either the old or the new closure
+        cursor.execute("DROP TABLE IF EXISTS topic_descendants")
+        cursor.execute("ALTER TABLE topic_descendants_new RENAME TO topic_descendants")
+        cursor.execute("CREATE INDEX idx_topic_descendants_descendant ON topic_descendants(descendant, topic)")
+        bump_database_version(cursor)
         conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return len(closure)
 
-        cursor.execute("SELECT prefLabel FROM topics")
-        topics = cursor.fetchall()
 
-        for topic_tuple in topics:
-            topic = topic_tuple[0]
-            find_and_store_descendants(cursor, conn, topic)
-            conn.commit()
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the topic_descendants closure table.")
+    parser.add_argument('--database', default=DATABASE_PATH, help="path to the SQLite database")
+    args = parser.parse_args()
 
-        conn.close()  # Ensure the connection is closed after operations
-        print("Finished populating the topic_descendants table.")
+    conn = create_connection(args.database)
+    if conn is not None:
+        start = time.perf_counter()
+        try:
+            rows = rebuild_topic_descendants(conn)
+            print(f"Finished populating the topic_descendants table: {rows} rows "
+                  f"in {time.perf_counter() - start:.2f} s.")
+        except sqlite3.Error as e:
+            print(e)
+        finally:
+            conn.close()  # Ensure the connection is closed after operations
     else:
         print("Error! cannot create the database connection.")
 
@@ -0,0 +1,197 @@
+import sqlite3
+import argparse
+import os
+import time
+
+from create_topic_descendants import create_connection
+from db_meta import create_meta_table, get_meta, set_meta, bump_database_version
+
+DATABASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app_data.db')
+
+# Key in db_meta holding the last tagged_papers rowid that has been rolled up
+HIGH_WATER_MARK_KEY = 'topic_month_counts_last_rowid'
+
+
+def create_rollup_tables(cursor):
+    """ Create the topic_month_counts and topic_day_counts rollup tables and the db_meta table if they don't exist """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS topic_month_counts (
+            topic TEXT NOT NULL,
+            month TEXT NOT NULL,
+            direct_count INTEGER NOT NULL DEFAULT 0,
+            subtree_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (topic, month)
+        ) WITHOUT ROWID;
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_topic_month_counts_month ON topic_month_counts(month, topic);")
+    # cumulative_count is the prefix sum of day_count per topic, so any window is the difference of two rows
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS topic_day_counts (
+            topic TEXT NOT NULL,
+            day TEXT NOT NULL,
+            day_count INTEGER NOT NULL,
+            cumulative_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (topic, day)
+        ) WITHOUT ROWID;
+    """)
+    create_meta_table(cursor)
+
+
+def refresh_months(cursor, months):
+    """
+    Recompute the rollup rows of the given months from paper_topics.
+
+    direct_count is the number of papers tagged with the topic itself, subtree_count the number of distinct papers
+    tagged with the topic or any of its descendants in topic_descendants.
+
+    Parameters:
+    cursor (sqlite3.Cursor): Cursor of an open connection, the caller commits
+    months (iterable): Months as 'YYYY-MM' strings
+
+    Returns:
+    int: Number of rollup rows written
+    """
+    rows = 0
+    for month in sorted(set(months)):
+        # Each month is a range scan on the (date, topic_id) index of paper_topics
+        month_start = f"{month}-01"
+        params = (month, month_start, month_start)
+        cursor.execute("DELETE FROM topic_month_counts WHERE month = ?", (month,))
+        cursor.execute("""
+            INSERT INTO topic_month_counts (topic, month, direct_count)
+            SELECT t.prefLabel, ?, COUNT(DISTINCT pt.paper_id)
+            FROM paper_topics pt
+            JOIN topics t ON t.rowid = pt.topic_id
+            WHERE pt.date >= ? AND pt.date < date(?, '+1 month')
+            GROUP BY t.prefLabel
+        """, params)
+        # Every topic counts as part of its own subtree
+        cursor.execute("""
+            INSERT INTO topic_month_counts (topic, month, subtree_count)
+            SELECT td.topic, ?, COUNT(DISTINCT pt.paper_id)
+            FROM paper_topics pt
+            JOIN topics t ON t.rowid = pt.topic_id
+            JOIN (SELECT topic, descendant FROM topic_descendants
+                  UNION
+                  SELECT prefLabel, prefLabel FROM topics) td ON td.descendant = t.prefLabel
+            WHERE pt.date >= ? AND pt.date < date(?, '+1 month')
+            GROUP BY td.topic
+            ON CONFLICT(topic, month) DO UPDATE SET subtree_count = excluded.subtree_count
+        """, params)
+        rows += cursor.execute("SELECT COUNT(*) FROM topic_month_counts WHERE month = ?", (month,)).fetchone()[0]
+    refresh_day_counts(cursor, months)
+    return rows
+
+
+def refresh_day_counts(cursor, months):
+    """
+    Recompute the topic_day_counts rows of the given months and the prefix sums from the first of them onwards.
+
+    day_count is the number of papers tagged with the topic on that day. The cumulative counts of later days are
+    moved on from the last cumulative count before the first changed month, so appending recent papers only
+    rewrites the tail of each topic.
+
+    Parameters:
+    cursor (sqlite3.Cursor): Cursor of an open connection, the caller commits
+    months (iterable): Months as 'YYYY-MM' strings
+    """
+    months = sorted(set(months))
+    if not months:
+        return
+    for month in months:
+        month_start = f"{month}-01"
+        cursor.execute("DELETE FROM topic_day_counts WHERE day >= ? AND day < date(?, '+1 month')",
+                       (month_start, month_start))
+        cursor.execute("""
+            INSERT INTO topic_day_counts (topic, day, day_count)
+            SELECT t.prefLabel, pt.date, COUNT(DISTINCT pt.paper_id)
+            FROM paper_topics pt
+            JOIN topics t ON t.rowid = pt.topic_id
+            WHERE pt.date >= ? AND pt.date < date(?, '+1 month')
+            GROUP BY t.prefLabel, pt.date
+        """, (month_start, month_start))
+
+    first_day = f"{months[0]}-01"
+    cursor.execute("""
+        UPDATE topic_day_counts AS d
+        SET cumulative_count = running.cumulative_count
+        FROM (
+            SELECT topic, day,
+                   SUM(day_count) OVER (PARTITION BY topic ORDER BY day)
+                   + COALESCE((SELECT p.cumulative_count FROM topic_day_counts p
+                               WHERE p.topic = r.topic AND p.day < ?
+                               ORDER BY p.day DESC LIMIT 1), 0) AS cumulative_count
+            FROM topic_day_counts r
+            WHERE day >= ?
+        ) AS running
+        WHERE d.topic = running.topic AND d.day = running.day
+    """, (first_day, first_day))
+
+
+def refresh_topic_month_counts(conn, rebuild=False):
+    """
+    Bring topic_month_counts and topic_day_counts up to date with paper_topics, which the caller has refreshed for
+    the new tagged papers (db_manager.refresh_derived_tables does both).
+
+    Only the months of papers appended since the last run (rowid above the stored high-water mark) are recomputed.
+    A full rebuild is done when asked for, on the first run, or when tagged_papers has been reloaded from scratch.
+
+    Parameters:
+    conn (sqlite3.Connection): Connection to the database
+    rebuild (bool): Recompute every month instead of only the new ones
+
+    Returns:
+    tuple: (number of months refreshed, number of rollup rows written)
+    """
+    cursor = conn.cursor()
+    # Prefix sums can't be started halfway, so a database built before topic_day_counts is rebuilt once
+    has_day_counts = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'topic_day_counts'"
+                                    ).fetchone() is not None
+    create_rollup_tables(cursor)
+
+    last_rowid = get_meta(cursor, HIGH_WATER_MARK_KEY)
+    max_rowid = cursor.execute("SELECT COALESCE(MAX(rowid), 0) FROM tagged_papers").fetchone()[0]
+
+    rebuild = rebuild or not has_day_counts or last_rowid is None or max_rowid < int(last_rowid)
+    if rebuild:
+        cursor.execute("DELETE FROM topic_month_counts")
+        cursor.execute("DELETE FROM topic_day_counts")
+        last_rowid = 0
+
+    cursor.execute("SELECT DISTINCT strftime('%Y-%m', date) FROM tagged_papers WHERE rowid > ? AND date IS NOT NULL",
+                   (int(last_rowid),))
+    months = [row[0] for row in cursor.fetchall()]
+
+    # Recompute the affected months and move the high-water mark in one transaction
+    rows = refresh_months(cursor, months)
+    set_meta(cursor, HIGH_WATER_MARK_KEY, max_rowid)
+    if rebuild or months:
+        bump_database_version(cursor)
+    conn.commit()
+    return len(months), rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or refresh the topic_month_counts and topic_day_counts "
+                                                 "rollup tables.")
+    parser.add_argument('--rebuild', action='store_true', help="recompute all months instead of only new papers")
+    parser.add_argument('--database', default=DATABASE_PATH, help="path to the SQLite database")
+    args = parser.parse_args()
+
+    conn = create_connection(args.database)
+    if conn is not None:
+        start = time.perf_counter()
+        try:
+            months, rows = refresh_topic_month_counts(conn, rebuild=args.rebuild)
+            print(f"Refreshed {months} months ({rows} rows) of topic_month_counts "
+                  f"in {time.perf_counter() - start:.2f} s.")
+        except sqlite3.Error as e:
+            print(e)
+        finally:
+            conn.close()
+    else:
+        print("Error! cannot create the database connection.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,15 @@
 import pandas as pd
 import sqlite3
+import argparse
+import hashlib
+import json
 import os
+import time
+
+from create_topic_descendants import rebuild_topic_descendants
+from create_topic_month_counts import HIGH_WATER_MARK_KEY, refresh_months, refresh_topic_month_counts
+from db_meta import (create_meta_table, get_meta, set_meta, bump_database_version, bump_topics_version,
+                     TAG_PAPERS_RESUME_KEY)
 
 
 # Function to create a database connection
@@ -38,7 +47,7 @@ def create_tables(conn):
                     );"""
 
     tagged_papers_sql = """CREATE TABLE IF NOT EXISTS tagged_papers (
-                               url TEXT,
+                               url TEXT UNIQUE,
                                date DATE,
                                title TEXT,
                                abstract TEXT,
@@ -56,6 +65,8 @@ def create_tables(conn):
         c.execute(papers_sql)
         c.execute(topics_sql)
         c.execute(tagged_papers_sql)
+        # Key/value table for the state of the build steps (e.g. high-water marks of incremental refreshes)
+        create_meta_table(c)
         conn.commit()
     except sqlite3.Error as e:
         print(e)
@@ -70,46 +81,628 @@ def create_indexes(conn):
         c.execute("CREATE INDEX IF NOT EXISTS idx_topics_prefLabel ON topics(prefLabel);")
         c.execute("CREATE INDEX IF NOT EXISTS idx_topics_broader ON topics(broader);")
         c.execute("CREATE INDEX IF NOT EXISTS idx_topics_level ON topics(level);")
+        # Ordered (keyset) paging of the Paper Search results
+        c.execute("CREATE INDEX IF NOT EXISTS idx_tagged_papers_date_url ON tagged_papers(date, url);")
         conn.commit()
         print("Indexes created successfully.")
     except sqlite3.Error as e:
         print(e)
 
 
+# Maps the topic slots of tagged_papers to paper_topics rows, one SELECT per topic column. Each slot is mapped to the
+# rowid of its topic (prefLabel is not guaranteed unique). {where} optionally restricts the papers.
+PAPER_TOPICS_SLOT_SQL = """SELECT tp.rowid, t.id, {rank}, date(tp.date)
+                           FROM tagged_papers tp
+                           JOIN (SELECT prefLabel, MIN(rowid) AS id FROM topics GROUP BY prefLabel) t
+                               ON t.prefLabel = tp.topic{rank}
+                           {where}"""
+
+
+def insert_paper_topics(c, where=""):
+    """ Insert the paper_topics rows of the tagged papers matching the optional WHERE clause (on alias tp) """
+    c.execute("INSERT INTO paper_topics (paper_id, topic_id, rank, date) "
+              + " UNION ALL ".join(PAPER_TOPICS_SLOT_SQL.format(rank=rank, where=where) for rank in range(1, 6)))
+
+
+# Function to build the normalized paper_topics link table from the topic1..topic5 columns of tagged_papers
+def create_paper_topics(conn):
+    """
+    Builds the paper_topics(paper_id, topic_id, rank, date) table, one row per topic slot of a tagged paper.
+
+    paper_id is the rowid of the paper in tagged_papers, topic_id is the rowid of the topic in topics and rank is
+    the position (1-5) of the topic in the tagged paper. The covering indexes on (topic_id, date) and (date, topic_id)
+    turn the topic and date range lookups of the analytics pages into index range scans.
+
+    Parameters:
+    conn (sqlite3.Connection): Connection to the database
+    """
+    paper_topics_sql = """CREATE TABLE IF NOT EXISTS paper_topics (
+                              paper_id INTEGER NOT NULL,
+                              topic_id INTEGER NOT NULL,
+                              rank INTEGER NOT NULL,
+                              date DATE,
+                              PRIMARY KEY (paper_id, rank)
+                          ) WITHOUT ROWID;"""
+
+    try:
+        c = conn.cursor()
+        c.execute("DROP TABLE IF EXISTS paper_topics;")
+        c.execute(paper_topics_sql)
+        insert_paper_topics(c)
+        # The table is WITHOUT ROWID, so both indexes also carry paper_id and cover the page queries
+        c.execute("CREATE INDEX IF NOT EXISTS idx_paper_topics_topic_date ON paper_topics(topic_id, date);")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_paper_topics_date_topic ON paper_topics(date, topic_id);")
+        conn.commit()
+        print(f"paper_topics table created with {c.execute('SELECT COUNT(*) FROM paper_topics').fetchone()[0]} rows.")
+    except sqlite3.Error as e:
+        print(e)
+
+
+# Triggers keeping the external content full-text index in sync with inserts, deletes and updates of tagged_papers
+FTS_TRIGGERS_SQL = [
+    """CREATE TRIGGER IF NOT EXISTS tagged_papers_fts_insert AFTER INSERT ON tagged_papers BEGIN
+           INSERT INTO tagged_papers_fts (rowid, title, abstract) VALUES (new.rowid, new.title, new.abstract);
+       END;""",
+    """CREATE TRIGGER IF NOT EXISTS tagged_papers_fts_delete AFTER DELETE ON tagged_papers BEGIN
+           INSERT INTO tagged_papers_fts (tagged_papers_fts, rowid, title, abstract)
+           VALUES ('delete', old.rowid, old.title, old.abstract);
+       END;""",
+    """CREATE TRIGGER IF NOT EXISTS tagged_papers_fts_update AFTER UPDATE OF title, abstract ON tagged_papers BEGIN
+           INSERT INTO tagged_papers_fts (tagged_papers_fts, rowid, title, abstract)
+           VALUES ('delete', old.rowid, old.title, old.abstract);
+           INSERT INTO tagged_papers_fts (rowid, title, abstract) VALUES (new.rowid, new.title, new.abstract);
+       END;""",
+]
+
+
+# Function to drop the full-text index, so a full load of tagged_papers doesn't go through the triggers row by row
+def drop_full_text_index(conn):
+    try:
+        c = conn.cursor()
+        for trigger in ('tagged_papers_fts_insert', 'tagged_papers_fts_delete', 'tagged_papers_fts_update'):
+            c.execute(f"DROP TRIGGER IF EXISTS {trigger};")
+        c.execute("DROP TABLE IF EXISTS tagged_papers_fts;")
+        conn.commit()
+    except sqlite3.Error as e:
+        print(e)
+
+
+# Function to build the full-text index over the titles and abstracts of tagged_papers
+def create_full_text_index(conn):
+    """
+    Builds tagged_papers_fts, an FTS5 index over the title and abstract of tagged_papers, for the BM25 ranked
+    keyword search of the Paper Search page.
+
+    The index is an external content table (the text is only stored once, in tagged_papers) and is kept in sync
+    by triggers, so incremental updates of tagged_papers are indexed as they are upserted.
+
+    Parameters:
+    conn (sqlite3.Connection): Connection to the database
+    """
+    try:
+        drop_full_text_index(conn)
+        c = conn.cursor()
+        c.execute("""CREATE VIRTUAL TABLE tagged_papers_fts USING fts5(
+                         title, abstract,
+                         content='tagged_papers', content_rowid='rowid',
+                         tokenize='porter unicode61'
+                     );""")
+        c.execute("INSERT INTO tagged_papers_fts (tagged_papers_fts) VALUES ('rebuild');")
+        for trigger_sql in FTS_TRIGGERS_SQL:
+            c.execute(trigger_sql)
+        c.execute("INSERT INTO tagged_papers_fts (tagged_papers_fts) VALUES ('optimize');")
+        conn.commit()
+        print("Full-text index created successfully.")
+    except sqlite3.Error as e:
+        print(e)
+
+
+# Function to clear the state of the incremental build steps after the tables have been reloaded from scratch. The
+# source file marks, the rollup mark and an unfinished tagging run are dropped; the version stamps are kept.
+def reset_high_water_marks(conn):
+    try:
+        conn.execute("DELETE FROM db_meta WHERE key LIKE 'source:%' OR key IN (?, ?);",
+                     (HIGH_WATER_MARK_KEY, TAG_PAPERS_RESUME_KEY))
+        conn.commit()
+    except sqlite3.Error as e:
+        print(e)
+
+
+# Explicit column types for the CSV files, so pandas doesn't have to infer them chunk by chunk
+CSV_DTYPES = {
+    'papers': {'url': str, 'title': str, 'categories': str, 'abstract': str, 'submission_date': str,
+               'authors_parsed': str},
+    'topics': {'s': str, 'prefLabel': str, 'altLabel': str, 'description': str, 'broader': str, 'level': 'Int64'},
+    'tagged_papers': {'url': str, 'date': str, 'title': str, 'abstract': str, 'topic1': str, 'topic2': str,
+                      'topic3': str, 'topic4': str, 'topic5': str},
+}
+
+# Number of CSV rows read and inserted per transaction
+DEFAULT_CHUNKSIZE = 50000
+
+
+# Function to tune SQLite for a bulk load
+def set_bulk_load_pragmas(conn):
+    """
+    Trades durability for speed while the CSV files are loaded: the rollback journal is kept in memory, fsync is
+    turned off and the page cache is raised to ~256 MB. reset_pragmas restores the defaults afterwards.
+    """
+    c = conn.cursor()
+    c.execute("PRAGMA journal_mode = MEMORY;")
+    c.execute("PRAGMA synchronous = OFF;")
+    c.execute("PRAGMA cache_size = -262144;")
+    c.execute("PRAGMA temp_store = MEMORY;")
+
+
+# Function to restore the SQLite settings after a bulk load
+def reset_pragmas(conn):
+    c = conn.cursor()
+    c.execute("PRAGMA journal_mode = DELETE;")
+    c.execute("PRAGMA synchronous = FULL;")
+    c.execute("PRAGMA cache_size = -2000;")
+    c.execute("PRAGMA temp_store = DEFAULT;")
+
+
+# Function to drop the secondary indexes of a table, so they are built once after the load instead of row by row
+def drop_indexes(conn, table_name):
+    c = conn.cursor()
+    # Indexes without sql are the automatic indexes behind PRIMARY KEY/UNIQUE constraints, these and other
+    # UNIQUE indexes are kept so duplicates are still rejected during the load
+    c.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL "
+              "AND sql NOT LIKE 'CREATE UNIQUE%'", (table_name,))
+    for (index_name,) in c.fetchall():
+        c.execute(f'DROP INDEX IF EXISTS "{index_name}";')
+    conn.commit()
+
+
+# Function to find the CSV columns that can be imported into a table
+def get_import_columns(csv_file_path, table_name, conn):
+    c = conn.cursor()
+    c.execute(f"PRAGMA table_info({table_name});")
+    table_columns = [row[1] for row in c.fetchall()]
+    csv_columns = pd.read_csv(csv_file_path, nrows=0).columns
+    columns = [column for column in csv_columns if column in table_columns]
+    skipped = [column for column in csv_columns if column not in table_columns]
+    if skipped:
+        print(f"Columns not in {table_name}, not imported: {', '.join(skipped)}")
+    return columns
+
+
+# Function to read a CSV file chunk by chunk, with missing values as None so sqlite3 can bind them as NULL
+def read_csv_chunks(csv_file_path, table_name, columns, chunksize, skip_rows=0):
+    dtypes = {column: dtype for column, dtype in CSV_DTYPES.get(table_name, {}).items() if column in columns}
+    skiprows = range(1, skip_rows + 1) if skip_rows else None
+    for chunk in pd.read_csv(csv_file_path, usecols=columns, dtype=dtypes, chunksize=chunksize, skiprows=skiprows):
+        yield chunk[columns].astype(object).where(chunk[columns].notna(), None)
+
+
 # Function to import CSV data into the database
-def import_csv_to_db(csv_file_path, table_name, conn):
-    df = pd.read_csv(csv_file_path)
+def import_csv_to_db(csv_file_path, table_name, conn, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Streams a CSV file into one of the tables created by create_tables.
+
+    The file is read in chunks of chunksize rows, so memory use does not grow with the size of the file, and each
+    chunk is appended in its own transaction. Only the CSV columns that exist in the table are read; rows that
+    break a UNIQUE constraint (e.g. a duplicated url) are skipped.
+
+    Parameters:
+    csv_file_path (str): Path to the CSV file
+    table_name (str): Name of the table to load into, one of the keys of CSV_DTYPES
+    conn (sqlite3.Connection): Connection to the database
+    chunksize (int): Number of rows per chunk/transaction
+
+    Returns:
+    int: Number of rows inserted
+    """
+    c = conn.cursor()
+    columns = get_import_columns(csv_file_path, table_name, conn)
+    insert_sql = (f"INSERT OR IGNORE INTO {table_name} ({', '.join(columns)}) "
+                  f"VALUES ({', '.join(['?'] * len(columns))})")
+
+    # The file is fingerprinted as it is before reading, rows appended meanwhile are read by the next run
+    size = os.path.getsize(csv_file_path)
+    fingerprint = source_fingerprints(csv_file_path, [size])[size]
+    inserted = 0
+    rows_read = 0
+    try:
+        for chunk in read_csv_chunks(csv_file_path, table_name, columns, chunksize):
+            c.executemany(insert_sql, chunk.itertuples(index=False, name=None))
+            inserted += c.rowcount
+            rows_read += len(chunk)
+            conn.commit()
+        set_source_high_water_mark(conn, csv_file_path, rows_read, size, fingerprint)
+        conn.commit()
+        print(f"Data imported successfully into {table_name}: {inserted} rows.")
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(e)
+    return inserted
+
+
+# Column that identifies a row when new batches are upserted into a table
+UPSERT_KEYS = {
+    'papers': 'url',
+    'topics': 's',
+    'tagged_papers': 'url',
+}
+
+
+# Function to give tables created before their upsert key was UNIQUE (tagged_papers.url) the index the upsert needs
+def migrate_upsert_keys(conn):
+    """
+    Adds a UNIQUE index on the UPSERT_KEYS column to tables that have none, as ON CONFLICT requires one.
+
+    Databases created before the incremental mode have a tagged_papers.url without UNIQUE constraint, and CREATE
+    TABLE IF NOT EXISTS leaves them on that schema. Rows with a duplicated key are removed first, keeping the last
+    loaded row of each key. The derived tables then have to be rebuilt, as paper_topics points at the removed rows.
+
+    Parameters:
+    conn (sqlite3.Connection): Connection to the database
+
+    Returns:
+    int: Number of duplicated rows removed
+    """
+    c = conn.cursor()
+    removed = 0
+    try:
+        for table_name, key in UPSERT_KEYS.items():
+            indexes = c.execute(f"PRAGMA index_list('{table_name}')").fetchall()
+            unique_keys = [c.execute(f"PRAGMA index_info('{name}')").fetchall()
+                           for _, name, unique, _, partial in indexes if unique and not partial]
+            if any(len(columns) == 1 and columns[0][2] == key for columns in unique_keys):
+                continue
+            c.execute(f"""DELETE FROM {table_name}
+                          WHERE {key} IS NOT NULL
+                              AND rowid NOT IN (SELECT MAX(rowid) FROM {table_name}
+                                                WHERE {key} IS NOT NULL GROUP BY {key})""")
+            duplicates = c.rowcount
+            removed += duplicates
+            c.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table_name}_{key}_unique ON {table_name}({key});")
+            print(f"Added a UNIQUE index on {table_name}.{key}, removed {duplicates} duplicated rows.")
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(e)
+    return removed
+
+
+# Function to fingerprint the contents of a source file up to some sizes, so an appended file keeps the fingerprint
+# of its old size. All sizes are fingerprinted in one pass over the file, as the source files can be several GB
+def source_fingerprints(csv_file_path, sizes):
+    digest = hashlib.blake2b(digest_size=16)
+    fingerprints = {}
+    position = 0
+    with open(csv_file_path, 'rb') as f:
+        for size in sorted(set(sizes)):
+            while position < size:
+                block = f.read(min(size - position, 1 << 20))
+                if not block:
+                    break
+                digest.update(block)
+                position += len(block)
+            fingerprints[size] = digest.hexdigest()
+    return fingerprints
+
+
+# Functions to read and write the high-water mark of a source file: the number of its data rows already ingested.
+# The size and fingerprint of the file as it was read are stored with it. Rows are only skipped while the file
+# still starts with exactly those bytes, i.e. rows were only appended; a replaced or edited file is read from the
+# start again (the upsert leaves unchanged rows alone). The fingerprint of the file at its current size is returned
+# with the mark, taken in the same pass, to store with the next mark.
+def get_source_high_water_mark(conn, csv_file_path, size):
+    value = get_meta(conn.cursor(), f"source:{os.path.basename(csv_file_path)}")
+    mark = json.loads(value) if value is not None else {}
+    if 'fingerprint' not in mark or size < mark['size']:
+        return 0, source_fingerprints(csv_file_path, [size])[size]
+    fingerprints = source_fingerprints(csv_file_path, [mark['size'], size])
+    return mark['rows'] if fingerprints[mark['size']] == mark['fingerprint'] else 0, fingerprints[size]
+
+
+def set_source_high_water_mark(conn, csv_file_path, rows, size, fingerprint):
+    set_meta(conn.cursor(), f"source:{os.path.basename(csv_file_path)}",
+             json.dumps({'rows': rows, 'size': size, 'fingerprint': fingerprint}))
+
+
+# Temporary tables collecting the rows changed by upsert_csv_to_db during this connection
+def create_change_tables(c):
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS changed_keys (tbl TEXT, key TEXT, PRIMARY KEY (tbl, key));")
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS changed_months (month TEXT PRIMARY KEY);")
+
+
+# Function to set up the temporary staging table of an upsert
+def start_upsert(c, table_name, columns):
+    c.execute("DROP TABLE IF EXISTS temp.staging;")
+    c.execute(f"CREATE TEMP TABLE staging AS SELECT {', '.join(columns)} FROM {table_name} WHERE 0;")
+    create_change_tables(c)
+
+
+# Function to merge one chunk of rows into a table
+def upsert_chunk(c, table_name, columns, rows):
+    """
+    Merges a chunk of rows into a table through the staging table created by start_upsert, keyed on UPSERT_KEYS.
+
+    The chunk is merged with INSERT ... ON CONFLICT DO UPDATE, which only touches rows that are new or changed.
+    The keys of those rows are collected in temp.changed_keys and, for tagged_papers, the months they fall into
+    (before and after the change) in temp.changed_months, so the derived tables can be refreshed partially.
+    The caller commits.
+
+    Parameters:
+    c (sqlite3.Cursor): Cursor of an open connection
+    table_name (str): Name of the table to upsert into, one of the keys of UPSERT_KEYS
+    columns (list): Names of the columns of the rows, including the key
+    rows (iterable): Tuples of column values
+
+    Returns:
+    int: Number of new or changed rows
+    """
+    key = UPSERT_KEYS[table_name]
+    values = [column for column in columns if column != key]
+    # A row has changed when any of its columns differs (IS NOT also compares NULLs)
+    changed_sql = " OR ".join(f"t.{column} IS NOT s.{column}" for column in values) or "0"
+
+    # The WHERE true is needed by SQLite to parse ON CONFLICT after INSERT ... SELECT
+    upsert_sql = (f"INSERT INTO {table_name} ({', '.join(columns)}) "
+                  f"SELECT {', '.join(columns)} FROM staging WHERE true "
+                  f"ON CONFLICT({key}) DO UPDATE SET "
+                  + ", ".join(f"{column} = excluded.{column}" for column in values)
+                  + (" WHERE " + " OR ".join(f"{column} IS NOT excluded.{column}" for column in values)
+                     if values else ""))
+
+    c.execute("DELETE FROM staging;")
+    c.executemany(f"INSERT INTO staging ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})", rows)
+
+    # Remember which rows are new or changed before they are merged
+    c.execute(f"""INSERT OR IGNORE INTO changed_keys (tbl, key)
+                  SELECT ?, s.{key} FROM staging s LEFT JOIN {table_name} t ON t.{key} = s.{key}
+                  WHERE t.{key} IS NULL OR {changed_sql}""", (table_name,))
+    changed = c.rowcount
+    if table_name == 'tagged_papers':
+        c.execute(f"""INSERT OR IGNORE INTO changed_months (month)
+                      SELECT strftime('%Y-%m', t.date) FROM staging s JOIN tagged_papers t ON t.url = s.url
+                      WHERE t.date IS NOT NULL AND ({changed_sql})
+                      UNION
+                      SELECT strftime('%Y-%m', s.date) FROM staging s LEFT JOIN tagged_papers t ON t.url = s.url
+                      WHERE s.date IS NOT NULL AND (t.url IS NULL OR {changed_sql})""")
+
+    c.execute(upsert_sql)
+    return changed
+
+
+# Function to upsert the new or changed rows of a CSV file into a table
+def upsert_csv_to_db(csv_file_path, table_name, conn, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Upserts the rows of a CSV file that were not ingested before into a table, keyed on UPSERT_KEYS.
+
+    Only the rows after the high-water mark of the file are read, and each chunk is merged by upsert_chunk.
+
+    Parameters:
+    csv_file_path (str): Path to the CSV file
+    table_name (str): Name of the table to upsert into, one of the keys of UPSERT_KEYS
+    conn (sqlite3.Connection): Connection to the database
+    chunksize (int): Number of rows per chunk/transaction
+
+    Returns:
+    int: Number of new or changed rows
+    """
+    c = conn.cursor()
+    columns = get_import_columns(csv_file_path, table_name, conn)
+    start_upsert(c, table_name, columns)
+
+    # The file is fingerprinted as it is before reading, rows appended meanwhile are read by the next run
+    size = os.path.getsize(csv_file_path)
+    rows_read, fingerprint = get_source_high_water_mark(conn, csv_file_path, size)
+    changed = 0
+    try:
+        for chunk in read_csv_chunks(csv_file_path, table_name, columns, chunksize, skip_rows=rows_read):
+            changed += upsert_chunk(c, table_name, columns, chunk.itertuples(index=False, name=None))
+            rows_read += len(chunk)
+            # The chunk and the new high-water mark are committed together
+            set_source_high_water_mark(conn, csv_file_path, rows_read, size, fingerprint)
+            conn.commit()
+        print(f"Data upserted successfully into {table_name}: {changed} new or changed rows.")
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(e)
+    return changed
+
+
+def table_exists(conn, table_name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                        (table_name,)).fetchone() is not None
+
+
+# Function to refresh the derived tables after an incremental update
+def refresh_derived_tables(conn, rebuild=False):
+    """
+    Brings paper_topics, topic_descendants and the topic_month_counts and topic_day_counts rollups up to date with
+    the rows collected in temp.changed_keys and temp.changed_months by upsert_chunk.
+
+    Changed tagged papers only refresh their own paper_topics rows and the rollup rows of their months. A changed
+    topic tree rebuilds topic_descendants and paper_topics and then the whole rollup, since the subtree of any
+    topic may have changed; this is rare and the closure rebuild itself takes milliseconds.
+
+    Parameters:
+    conn (sqlite3.Connection): Connection to the database
+    rebuild (bool): Rebuild topic_descendants, paper_topics and the rollups in full (creating the rollup tables if
+    needed), after a full reload or for changes made in an earlier connection whose temporary tables are gone
+    """
+    c = conn.cursor()
+    create_change_tables(c)
+    topics_changed = c.execute("SELECT COUNT(*) FROM changed_keys WHERE tbl = 'topics'").fetchone()[0] > 0
     try:
-        df.to_sql(table_name, conn, if_exists='replace', index=False)
-        print(f"Data imported successfully into {table_name}.")
+        if topics_changed:
+            rebuild_topic_descendants(conn)
+            create_paper_topics(conn)
+            bump_topics_version(c)
+            conn.commit()
+        elif rebuild:
+            rebuild_topic_descendants(conn)
+            create_paper_topics(conn)
+        else:
+            c.execute("""DELETE FROM paper_topics WHERE paper_id IN (
+                             SELECT rowid FROM tagged_papers
+                             WHERE url IN (SELECT key FROM changed_keys WHERE tbl = 'tagged_papers'))""")
+            insert_paper_topics(c, "WHERE tp.url IN (SELECT key FROM changed_keys WHERE tbl = 'tagged_papers')")
+            conn.commit()
+
+        if rebuild or table_exists(conn, 'topic_month_counts'):
+            # Prefix sums can't be started halfway, so a database built before topic_day_counts is rebuilt once
+            if topics_changed or rebuild or not table_exists(conn, 'topic_day_counts'):
+                months, rows = refresh_topic_month_counts(conn, rebuild=True)
+            else:
+                months = [row[0] for row in c.execute("SELECT month FROM changed_months").fetchall()]
+                rows = refresh_months(c, months)
+                months = len(months)
+                set_meta(c, HIGH_WATER_MARK_KEY,
+                         c.execute("SELECT COALESCE(MAX(rowid), 0) FROM tagged_papers").fetchone()[0])
+                conn.commit()
+            print(f"Refreshed {months} months ({rows} rows) of topic_month_counts.")
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(e)
+
+
+# Statistics shown on the Datasets page for each table: columns to count distinct values of, columns to store the
+# distribution of, and date columns to store the range of
+DATASET_STATS = {
+    'papers': {'distinct': ['categories'], 'distribution': ['categories'], 'date_range': ['submission_date']},
+    'topics': {'distinct': ['level'], 'distribution': ['level'], 'date_range': []},
+    'tagged_papers': {'distinct': ['title'], 'distribution': [], 'date_range': ['date']},
+}
+
+# Number of rows stored as a sample of each table
+DATASET_SAMPLE_ROWS = 10
+
+
+# Function to precompute the statistics of the Datasets page
+def create_dataset_stats(conn):
+    """
+    Recomputes the dataset_stats table: one JSON value per (dataset, stat), with the row count, the column names,
+    the distinct counts, the value distributions, the date ranges and a sample of the first rows of each table.
+
+    The Datasets page reads only this table, so it renders in the same time whatever the size of the tables.
+
+    Parameters:
+    conn (sqlite3.Connection): Connection to the database
+    """
+    try:
+        c = conn.cursor()
+        c.execute("""CREATE TABLE IF NOT EXISTS dataset_stats (
+                         dataset TEXT NOT NULL,
+                         stat TEXT NOT NULL,
+                         value TEXT NOT NULL,
+                         PRIMARY KEY (dataset, stat)
+                     ) WITHOUT ROWID;""")
+        c.execute("DELETE FROM dataset_stats;")
+
+        for table, settings in DATASET_STATS.items():
+            if not table_exists(conn, table):
+                continue
+            stats = {'row_count': c.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]}
+
+            c.execute(f"SELECT * FROM {table} ORDER BY rowid LIMIT ?", (DATASET_SAMPLE_ROWS,))
+            stats['columns'] = [column[0] for column in c.description]
+            stats['sample'] = c.fetchall()
+
+            for column in settings['distinct']:
+                stats[f'distinct:{column}'] = c.execute(f"SELECT COUNT(DISTINCT {column}) FROM {table}").fetchone()[0]
+            for column in settings['distribution']:
+                stats[f'distribution:{column}'] = c.execute(
+                    f"SELECT {column}, COUNT(*) FROM {table} GROUP BY {column} ORDER BY {column}").fetchall()
+            for column in settings['date_range']:
+                stats[f'date_range:{column}'] = c.execute(f"SELECT MIN({column}), MAX({column}) FROM {table}").fetchone()
+
+            c.executemany("INSERT INTO dataset_stats (dataset, stat, value) VALUES (?, ?, ?)",
+                          [(table, stat, json.dumps(value)) for stat, value in stats.items()])
+        conn.commit()
+        print("Dataset statistics created successfully.")
     except sqlite3.Error as e:
+        conn.rollback()
         print(e)
 
 
 # Main function to create and populate the database
 def main():
+    parser = argparse.ArgumentParser(description="Create and populate the database from the CSV files.")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE,
+                        help="number of CSV rows read and inserted per transaction")
+    parser.add_argument('--incremental', action='store_true',
+                        help="upsert only new or changed rows and refresh the derived tables, "
+                             "instead of reloading everything")
+    parser.add_argument('--papers-csv', default='kaggle_dump_full.csv')
+    parser.add_argument('--topics-csv', default='topic_tree_with_levels.csv')
+    parser.add_argument('--tagged-papers-csv', default='tagged_papers_full.csv')
+    args = parser.parse_args()
+
     database = 'app_data.db'
     conn = create_connection(database)
     if conn is not None:
+        start = time.perf_counter()
         create_tables(conn)
+        migrated = migrate_upsert_keys(conn)
 
         # List of CSV files to populate the database tables
         csv_files = [
-            ('kaggle_dump_full.csv', 'papers'),
-            ('topic_tree_with_levels.csv', 'topics'),
-            ('tagged_papers_full.csv', 'tagged_papers')
+            (args.papers_csv, 'papers'),
+            (args.topics_csv, 'topics'),
+            (args.tagged_papers_csv, 'tagged_papers')
         ]
 
-        # Checking each CSV file exists in the location before importing
-        for csv_file_path, table_name in csv_files:
-            if not os.path.isfile(csv_file_path):
-                print(f"The file {csv_file_path} does not exist. Skipping import for {table_name}.")
-            else:
-                # If the file exists, import it into the corresponding table
-                import_csv_to_db(csv_file_path, table_name, conn)
+        if args.incremental:
+            # Databases built before the current indexes, or by tag_papers.py, get them now (IF NOT EXISTS)
+            create_indexes(conn)
+
+            # Merge the new batches into the existing tables and refresh what depends on them
+            for csv_file_path, table_name in csv_files:
+                if not os.path.isfile(csv_file_path):
+                    print(f"The file {csv_file_path} does not exist. Skipping update for {table_name}.")
+                else:
+                    upsert_csv_to_db(csv_file_path, table_name, conn, chunksize=args.chunksize)
+            # Duplicates removed by the migration leave paper_topics rows behind, which only a rebuild drops
+            refresh_derived_tables(conn, rebuild=migrated > 0)
+
+            # Databases built before the full-text index existed get it now, later updates go through the triggers
+            if not table_exists(conn, 'tagged_papers_fts'):
+                create_full_text_index(conn)
+        else:
+            set_bulk_load_pragmas(conn)
+
+            # The tables are reloaded from scratch, so incremental steps have to start over
+            reset_high_water_marks(conn)
+            drop_full_text_index(conn)
+
+            # Checking each CSV file exists in the location before importing
+            for csv_file_path, table_name in csv_files:
+                if not os.path.isfile(csv_file_path):
+                    print(f"The file {csv_file_path} does not exist. Skipping import for {table_name}.")
+                else:
+                    # If the file exists, empty the table and stream the file into it
+                    drop_indexes(conn, table_name)
+                    conn.execute(f"DELETE FROM {table_name};")
+                    conn.commit()
+                    import_csv_to_db(csv_file_path, table_name, conn, chunksize=args.chunksize)
+                    if table_name == 'topics':
+                        bump_topics_version(conn.cursor())
+
+            # Create indexes after tables are populated
+            create_indexes(conn)
+
+            # Build the normalized topic link table used by the analytics pages, the topic closure and the rollups
+            refresh_derived_tables(conn, rebuild=True)
+
+            # Build the keyword search index of Paper Search
+            create_full_text_index(conn)
+
+            reset_pragmas(conn)
+
+        # Precompute what the Datasets page shows from the loaded tables
+        create_dataset_stats(conn)
+
+        # Stamp a new data version, so the app doesn't serve query results cached before this run
+        bump_database_version(conn.cursor())
+        conn.commit()
 
-        # Create indexes after tables are populated
-        create_indexes(conn)
+        print(f"Database {'updated' if args.incremental else 'created'} in {time.perf_counter() - start:.2f} s.")
 
         # Close the connection to the database
         conn.close()
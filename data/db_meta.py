@@ -0,0 +1,55 @@
+import time
+
+# Key in db_meta holding the version stamp of the data, read by the query cache of the app (util/query_cache.py)
+DATABASE_VERSION_KEY = 'db_version'
+
+# Key in db_meta holding the version stamp of the topics table, read by the topic tree charts (util/main_sunburst.py)
+TOPICS_VERSION_KEY = 'topics_version'
+
+# Key in db_meta holding the last shard written by an unfinished run of tag_papers.py, so the next run resumes after it
+TAG_PAPERS_RESUME_KEY = 'tag_papers_resume'
+
+
+def create_meta_table(cursor):
+    """ Create the db_meta key/value table holding the state of the build steps, if it doesn't exist """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS db_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """)
+
+
+def get_meta(cursor, key):
+    cursor.execute("SELECT value FROM db_meta WHERE key = ?", (key,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def set_meta(cursor, key, value):
+    cursor.execute("INSERT INTO db_meta (key, value) VALUES (?, ?) "
+                   "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, str(value)))
+
+
+def delete_meta(cursor, key):
+    cursor.execute("DELETE FROM db_meta WHERE key = ?", (key,))
+
+
+def bump_database_version(cursor):
+    """
+    Write a new version stamp after the data has changed, so cached query results of the app are not reused.
+    A timestamp is used rather than a counter, so a reloaded database never repeats an earlier version.
+    """
+    create_meta_table(cursor)
+    set_meta(cursor, DATABASE_VERSION_KEY, f"{time.time():.6f}")
+
+
+def bump_topics_version(cursor):
+    """ Write a new version stamp of the topics table after it has changed, so prebuilt topic tree charts are rebuilt """
+    create_meta_table(cursor)
+    set_meta(cursor, TOPICS_VERSION_KEY, f"{time.time():.6f}")
+
+
+def get_topics_version(cursor):
+    """ Return the version stamp of the topics table, falling back to the data version for older databases """
+    return get_meta(cursor, TOPICS_VERSION_KEY) or get_meta(cursor, DATABASE_VERSION_KEY)
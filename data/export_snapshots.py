@@ -0,0 +1,115 @@
+import sqlite3
+import argparse
+import json
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from create_topic_descendants import create_connection
+
+DATABASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app_data.db')
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots')
+
+# Rows per Parquet row group, also the number of rows fetched from the database at a time
+ROW_GROUP_SIZE = 65536
+
+# Key of the schema metadata holding the statistics computed at export time
+STATS_METADATA_KEY = b'dataset_stats'
+
+# Tables shown on the Datasets page: columns with few distinct values are dictionary encoded, and the distinct
+# counts are computed once here and stored in the file metadata
+SNAPSHOT_TABLES = {
+    'papers': {
+        'dictionary': ['categories'],
+        'distinct': ['categories'],
+    },
+    'topics': {
+        'dictionary': ['broader', 'level'],
+        'distinct': ['level'],
+    },
+    'tagged_papers': {
+        'dictionary': ['topic1', 'topic2', 'topic3', 'topic4', 'topic5'],
+        'distinct': ['title'],
+    },
+}
+
+
+def arrow_schema(cursor, table):
+    """ Map the declared column types of a table to an Arrow schema (INTEGER columns to int64, the rest to strings) """
+    cursor.execute(f"PRAGMA table_info({table})")
+    return pa.schema([(name, pa.int64() if col_type.upper() == 'INTEGER' else pa.string())
+                      for _, name, col_type, *_ in cursor.fetchall()])
+
+
+def export_table(conn, table, snapshot_dir, row_group_size=ROW_GROUP_SIZE):
+    """
+    Write a table to a Parquet snapshot, streaming it from the database one row group at a time.
+
+    The columns listed in SNAPSHOT_TABLES are dictionary encoded, every column gets min/max statistics, and the
+    distinct counts and the names of the dictionary columns are stored in the schema metadata, so readers get
+    the summary numbers without scanning the data.
+
+    Parameters:
+    conn (sqlite3.Connection): Connection to the database
+    table (str): Name of the table to export
+    snapshot_dir (str): Directory of the snapshot files
+
+    Returns:
+    int: Number of rows written
+    """
+    settings = SNAPSHOT_TABLES[table]
+    cursor = conn.cursor()
+    schema = arrow_schema(cursor, table)
+
+    stats = {
+        'dictionary_columns': settings['dictionary'],
+        'distinct_counts': {column: cursor.execute(f"SELECT COUNT(DISTINCT {column}) FROM {table}").fetchone()[0]
+                            for column in settings['distinct']},
+    }
+    schema = schema.with_metadata({STATS_METADATA_KEY: json.dumps(stats).encode()})
+
+    # Write to a temporary file and swap it in, so nothing ever reads a half written snapshot
+    path = os.path.join(snapshot_dir, f"{table}.parquet")
+    rows = 0
+    with pq.ParquetWriter(path + '.tmp', schema, use_dictionary=settings['dictionary'],
+                          write_statistics=True, compression='zstd') as writer:
+        cursor.execute(f"SELECT {', '.join(schema.names)} FROM {table} ORDER BY rowid")
+        while True:
+            batch = cursor.fetchmany(row_group_size)
+            if not batch:
+                break
+            columns = list(zip(*batch))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema),
+                row_group_size=row_group_size)
+            rows += len(batch)
+    os.replace(path + '.tmp', path)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export Parquet snapshots of the datasets shown on the Datasets page.")
+    parser.add_argument('--database', default=DATABASE_PATH, help="path to the SQLite database")
+    parser.add_argument('--output', default=SNAPSHOT_DIR, help="directory of the snapshot files")
+    args = parser.parse_args()
+
+    conn = create_connection(args.database)
+    if conn is not None:
+        os.makedirs(args.output, exist_ok=True)
+        try:
+            for table in SNAPSHOT_TABLES:
+                start = time.perf_counter()
+                rows = export_table(conn, table, args.output)
+                print(f"Exported {rows} rows of {table} in {time.perf_counter() - start:.2f} s.")
+        except sqlite3.Error as e:
+            print(e)
+        finally:
+            conn.close()
+    else:
+        print("Error! cannot create the database connection.")
+
+
+if __name__ == "__main__":
+    main()
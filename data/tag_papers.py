@@ -0,0 +1,445 @@
+import sqlite3
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from create_topic_descendants import create_connection
+from db_manager import (create_tables, migrate_upsert_keys, create_indexes, start_upsert, upsert_chunk,
+                        refresh_derived_tables, table_exists, create_full_text_index, create_dataset_stats)
+from db_meta import (create_meta_table, get_meta, set_meta, delete_meta, bump_database_version,
+                     TAG_PAPERS_RESUME_KEY as RESUME_KEY)
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+DATABASE_PATH = os.path.join(DATA_DIR, 'app_data.db')
+
+# The vectorizer is shared with the app, which lives in the util package one level up
+sys.path.insert(0, os.path.dirname(DATA_DIR))
+from util.ann_index import DEFAULT_NPROBE, IVFIndex, index_path
+from util.embedding_store import open_embedding_store
+from util.text_vectorizer import HashingVectorizer, topic_text, paper_text
+
+# Paper embeddings written by build_embeddings.py, used instead of embedding the papers again while they were made
+# with the same vectorizer
+PAPER_EMBEDDINGS_PATH = os.path.join(DATA_DIR, 'artifacts', 'paper_embeddings.emb')
+TOPIC_EMBEDDINGS_PATH = os.path.join(DATA_DIR, 'artifacts', 'topic_embeddings.emb')
+
+# Number of topics each paper is tagged with (the topic1..topic5 columns of tagged_papers)
+TOPICS_PER_PAPER = 5
+
+# Papers per shard: embedded and scored by one worker, and written in one transaction
+DEFAULT_BATCH_SIZE = 4096
+
+# Shards handed to the worker pool ahead of the writer, per worker: enough to keep the workers busy while the writer
+# commits, few enough that finished shards don't pile up in memory when the writer is the slower side
+SHARDS_IN_FLIGHT_PER_WORKER = 2
+
+# Topics scored per matrix multiply, bounds the papers x topics score block to batch size x block size floats
+TOPIC_BLOCK_SIZE = 8192
+
+# Columns written to tagged_papers, in the order of the rows of tag_rows
+TAGGED_PAPERS_COLUMNS = ['url', 'date', 'title', 'abstract'] + [f'topic{i}' for i in range(1, TOPICS_PER_PAPER + 1)]
+
+
+def fetch_topic_texts(conn):
+    """
+    Fetch the text of every topic label.
+
+    A label used by more than one topic is represented by its first row, as in paper_topics.
+
+    Parameters:
+    conn (sqlite3.Connection): Connection to the database
+
+    Returns:
+    tuple: (list of topic ids, list of labels, list of texts)
+    """
+    rows = conn.execute("""
+        SELECT id, prefLabel, altLabel, description FROM topics
+        WHERE rowid IN (SELECT MIN(rowid) FROM topics WHERE prefLabel IS NOT NULL GROUP BY prefLabel)
+        ORDER BY rowid
+    """).fetchall()
+    return [row[0] for row in rows], [row[1] for row in rows], [topic_text(*row[1:]) for row in rows]
+
+
+def embed_topics(conn):
+    """
+    Fit the vectorizer on the topic texts and embed the topics.
+
+    Parameters:
+    conn (sqlite3.Connection): Connection to the database
+
+    Returns:
+    tuple: (HashingVectorizer, np.ndarray of topic ids, np.ndarray of labels, float32 topic embeddings,
+    topics x dimensions)
+    """
+    ids, labels, texts = fetch_topic_texts(conn)
+    vectorizer = HashingVectorizer().fit(texts)
+    return vectorizer, np.array(ids, dtype=np.int64), np.array(labels, dtype=object), vectorizer.transform(texts)
+
+
+def embed_papers(papers, vectorizer, store=None):
+    """
+    Embed a batch of papers, taking the embeddings that are in the embedding store from there.
+
+    New embeddings are rounded to float16, the precision of the store, so papers get the same tags whether their
+    embeddings come from the store or not.
+
+    Parameters:
+    papers (list): (id, title, abstract) rows of the papers table
+    vectorizer (HashingVectorizer): Vectorizer fitted on the topics
+    store (EmbeddingStore): float16 paper embeddings made with the same vectorizer, or None
+
+    Returns:
+    np.ndarray: float32 paper embeddings, papers x dimensions
+    """
+    embeddings = np.empty((len(papers), vectorizer.dim), dtype=np.float32)
+    rows = store.rows_of([paper[0] for paper in papers]) if store is not None else np.full(len(papers), -1)
+    stored = rows >= 0
+    if stored.any():
+        embeddings[stored] = store.vectors(rows[stored])
+    missing = np.flatnonzero(~stored)
+    if len(missing):
+        embeddings[missing] = vectorizer.transform([paper_text(*papers[i][1:]) for i in missing]).astype(np.float16)
+    return embeddings
+
+
+def top_topics(paper_embeddings, topic_embeddings, k=TOPICS_PER_PAPER, block_size=TOPIC_BLOCK_SIZE):
+    """
+    Find the k topics with the highest cosine similarity to each paper.
+
+    The topics are scored one block at a time with a matrix multiply, and the best k of each block are merged with
+    the best k so far, so memory stays at papers x block_size scores however many topics there are.
+
+    Parameters:
+    paper_embeddings (np.ndarray): Unit length paper embeddings, papers x dimensions
+    topic_embeddings (np.ndarray): Unit length topic embeddings, topics x dimensions
+    k (int): Number of topics per paper
+    block_size (int): Number of topics per matrix multiply
+
+    Returns:
+    tuple: (topic indexes, similarities), both papers x k, most similar first
+    """
+    rows = np.arange(len(paper_embeddings))[:, None]
+    best_scores = np.zeros((len(rows), 0), dtype=np.float32)
+    best_topics = np.zeros((len(rows), 0), dtype=np.int64)
+    for start in range(0, len(topic_embeddings), block_size):
+        scores = paper_embeddings @ topic_embeddings[start:start + block_size].T
+        # k passes of argmax, each masking the topic it found, are several times faster than argpartition for
+        # small k, and take the lowest topic index among equal scores
+        block_topics = np.empty((len(rows), min(k, scores.shape[1])), dtype=np.int64)
+        block_scores = np.empty(block_topics.shape, dtype=np.float32)
+        for i in range(block_topics.shape[1]):
+            block_topics[:, i] = scores.argmax(axis=1)
+            block_scores[:, i] = scores[rows[:, 0], block_topics[:, i]]
+            scores[rows[:, 0], block_topics[:, i]] = -np.inf
+        best_scores = np.concatenate([best_scores, block_scores], axis=1)
+        best_topics = np.concatenate([best_topics, block_topics + start], axis=1)
+        # Most similar first, ties broken by topic order so the result doesn't depend on the block size
+        order = np.lexsort((best_topics, -best_scores), axis=1)[:, :k]
+        best_scores, best_topics = best_scores[rows, order], best_topics[rows, order]
+    return best_topics, best_scores
+
+
+def tag_rows(papers, embeddings, labels, topic_embeddings, topic_index=None, nprobe=DEFAULT_NPROBE):
+    """
+    Tag a batch of papers with their most similar topics.
+
+    Parameters:
+    papers (list): (url, submission_date, title, abstract) rows of the papers table
+    embeddings (np.ndarray): Unit length paper embeddings from embed_papers
+    labels (np.ndarray): Topic labels, in the order of topic_embeddings, or of the store rows of topic_index
+    topic_embeddings (np.ndarray): Unit length topic embeddings, scored exactly if there is no topic_index
+    topic_index (IVFIndex): ANN index of the topic embedding store, to only score the topics of nprobe lists
+    nprobe (int): Lists of topic_index probed per paper
+
+    Returns:
+    list: Rows of tagged_papers in the order of TAGGED_PAPERS_COLUMNS; papers without any words get no topics
+    """
+    if topic_index is None:
+        topics, _ = top_topics(embeddings, topic_embeddings)
+    else:
+        # -1 only where there are fewer than TOPICS_PER_PAPER topics, as top_topics returns fewer columns then
+        topics, _ = topic_index.search_batch(embeddings, TOPICS_PER_PAPER, nprobe)
+    has_words = embeddings.any(axis=1)
+    rows = []
+    for paper, paper_topics, found, tagged in zip(papers, labels[topics].tolist(), (topics >= 0).tolist(), has_words):
+        slots = [label for label, ok in zip(paper_topics, found) if ok] if tagged else []
+        rows.append((*paper, *slots, *[None] * (TOPICS_PER_PAPER - len(slots))))
+    return rows
+
+
+def shard_bounds(conn, after_id, shard_size):
+    """
+    Split the papers after a paper id into shards of consecutive ids.
+
+    Parameters:
+    conn (sqlite3.Connection): Connection to the database
+    after_id (int): Only papers with a higher id are included
+    shard_size (int): Number of papers per shard
+
+    Returns:
+    list: (first id, last id) of every shard, in id order
+    """
+    ids = np.fromiter((row[0] for row in conn.execute("SELECT id FROM papers WHERE id > ? ORDER BY id", (after_id,))),
+                      dtype=np.int64)
+    return [(int(ids[start]), int(ids[min(start + shard_size, len(ids)) - 1]))
+            for start in range(0, len(ids), shard_size)]
+
+
+def ordered_map(pool, func, items, in_flight):
+    """
+    Apply func to the items in a worker pool and yield the results in order, like Pool.imap, but with at most
+    in_flight items handed to the pool at a time, so results wait in the pool's queue for the consumer instead of
+    all of them being computed ahead. Runs func in this process if there is no pool.
+
+    Parameters:
+    pool (multiprocessing.Pool): Worker pool, or None
+    func (function): Function of one item
+    items (iterable): Items
+    in_flight (int): Items submitted to the pool but not yet consumed
+
+    Returns:
+    generator: func(item) of every item, in the order of items
+    """
+    if pool is None:
+        yield from map(func, items)
+        return
+    items = iter(items)
+    pending = collections.deque(pool.apply_async(func, (item,)) for item in itertools.islice(items, in_flight))
+    while pending:
+        result = pending.popleft().get()
+        # The next item is submitted before the result is consumed, so the workers stay busy meanwhile
+        pending.extend(pool.apply_async(func, (item,)) for item in itertools.islice(items, 1))
+        yield result
+
+
+def open_paper_store(path, vectorizer_version):
+    """ Open the paper embedding store if it is float16 and made with the given vectorizer, None otherwise """
+    store = open_embedding_store(path, vectorizer_version) if path else None
+    return store if store is not None and store.header['dtype'] == 'float16' else None
+
+
+def open_topic_index(path, vectorizer_version, topic_ids, labels):
+    """
+    Open the ANN index of the topic embedding store of build_ann_index.py, if it matches the vectorizer.
+
+    Parameters:
+    path (str): Path of the topic embedding store, the index is next to it
+    vectorizer_version (str): Version of the vectorizer fitted on the topics
+    topic_ids (np.ndarray): Topic ids, in the order of labels
+    labels (np.ndarray): Topic labels
+
+    Returns:
+    tuple: (IVFIndex, labels in the order of the store rows), or None if there is no matching index
+    """
+    store = open_embedding_store(path, vectorizer_version) if path else None
+    index = IVFIndex.load(index_path(path), store) if store is not None else None
+    if index is None:
+        return None
+    rows = store.rows_of(topic_ids)
+    if len(store) != len(topic_ids) or (rows < 0).any():
+        return None
+    store_labels = np.empty(len(store), dtype=object)
+    store_labels[rows] = labels
+    return index, store_labels
+
+
+# State of a tagging worker process, set up once by init_worker
+_worker = {}
+
+
+def init_worker(database, topics_path, labels, vectorizer_settings, only_new, embeddings_path=None,
+                topic_ids=None, topic_store_path=None, nprobe=None):
+    """
+    Set up a tagging worker: its own read-only database connection, the vectorizer and the topic embeddings.
+
+    The topic embeddings are memory-mapped from the file written by tag_papers, and the paper embedding store from
+    build_embeddings.py, so all workers share the same pages of the page cache instead of each holding a copy. With
+    nprobe, the topics are searched through the ANN index of the topic embedding store instead.
+    """
+    _worker['conn'] = sqlite3.connect(f"file:{database}?mode=ro", uri=True)
+    _worker['topic_embeddings'] = np.load(topics_path, mmap_mode='r')
+    _worker['labels'] = labels
+    _worker['vectorizer'] = HashingVectorizer.from_dict(vectorizer_settings)
+    _worker['only_new'] = only_new
+    _worker['store'] = open_paper_store(embeddings_path, _worker['vectorizer'].version)
+    _worker['topic_index'] = None
+    if nprobe:
+        _worker['topic_index'] = open_topic_index(topic_store_path, _worker['vectorizer'].version, topic_ids, labels)
+    _worker['nprobe'] = nprobe
+
+
+def tag_shard(bounds):
+    """
+    Tag the papers of one shard in a worker.
+
+    Parameters:
+    bounds (tuple): (first id, last id) of the shard
+
+    Returns:
+    tuple: (last id, rows of tagged_papers from tag_rows)
+    """
+    first_id, last_id = bounds
+    papers = _worker['conn'].execute(f"""
+        SELECT p.id, p.url, p.submission_date, p.title, p.abstract FROM papers p
+        WHERE p.id BETWEEN ? AND ?
+        {'AND NOT EXISTS (SELECT 1 FROM tagged_papers t WHERE t.url = p.url)' if _worker['only_new'] else ''}
+        ORDER BY p.id
+    """, (first_id, last_id)).fetchall()
+    embeddings = embed_papers([(paper_id, title, abstract) for paper_id, _, _, title, abstract in papers],
+                              _worker['vectorizer'], _worker['store'])
+    if _worker['topic_index'] is not None:
+        topic_index, labels = _worker['topic_index']
+        return last_id, tag_rows([paper[1:] for paper in papers], embeddings, labels, None, topic_index,
+                                 _worker['nprobe'])
+    return last_id, tag_rows([paper[1:] for paper in papers], embeddings, _worker['labels'],
+                             _worker['topic_embeddings'])
+
+
+def tag_papers(conn, database, only_new=False, batch_size=DEFAULT_BATCH_SIZE, workers=1, embeddings_path=None,
+               nprobe=None, topic_store_path=TOPIC_EMBEDDINGS_PATH):
+    """
+    Tag the papers with their most similar topics and upsert the results into tagged_papers.
+
+    Topics are embedded from prefLabel, altLabel and description, papers from title and abstract, with a
+    HashingVectorizer fitted on the topics, so the same tables always give the same tags. The papers are split
+    into shards of consecutive ids, which a pool of worker processes embed and score against all topics. This
+    process is the only writer: it merges the shards into tagged_papers in id order, one transaction each, through
+    upsert_chunk, which only rewrites papers whose tags changed and records them for refresh_derived_tables.
+
+    Each transaction also stores the last id written under RESUME_KEY, so a run that was stopped resumes after its
+    last committed shard, as long as the topics (and so the vectorizer) are unchanged.
+
+    Parameters:
+    conn (sqlite3.Connection): Connection to the database
+    database (str): Path to the database, opened read-only by the workers
+    only_new (bool): Only tag the papers that are not in tagged_papers yet
+    batch_size (int): Number of papers per shard/transaction
+    workers (int): Number of worker processes, the papers are tagged in this process if 1
+    embeddings_path (str): Paper embedding store to take the paper embeddings from, when it was made with the
+    same vectorizer
+    nprobe (int): Search the topics through the ANN index of build_ann_index.py, probing this many lists per paper,
+    instead of scoring every topic; the topics are scored exactly if None or if the index doesn't match the topics
+    topic_store_path (str): Topic embedding store of build_embeddings.py, the index is next to it
+
+    Returns:
+    tuple: (papers tagged, papers whose tags changed, whether an earlier run was resumed)
+    """
+    start = time.perf_counter()
+    vectorizer, topic_ids, labels, topic_embeddings = embed_topics(conn)
+    if not len(labels):
+        print("Error! The topics table is empty.")
+        return 0, 0, False
+    print(f"Embedded {len(labels)} topics with {vectorizer.version} in {time.perf_counter() - start:.2f} s.")
+    if open_paper_store(embeddings_path, vectorizer.version) is not None:
+        print(f"Taking the paper embeddings from {embeddings_path}.")
+    if nprobe:
+        if open_topic_index(topic_store_path, vectorizer.version, topic_ids, labels) is not None:
+            print(f"Searching the topics through {index_path(topic_store_path)}, {nprobe} lists per paper.")
+        else:
+            print(f"No index of {topic_store_path} matches the topics, scoring every topic.")
+
+    c = conn.cursor()
+    create_meta_table(c)
+    resume = json.loads(get_meta(c, RESUME_KEY) or 'null')
+    resumed = resume is not None and resume['vectorizer'] == vectorizer.version and resume['only_new'] == only_new
+    after_id = resume['last_id'] if resumed else 0
+    if resumed:
+        print(f"Resuming the run stopped after paper id {after_id}.")
+    shards = shard_bounds(conn, after_id, batch_size)
+
+    # In WAL mode the workers keep reading while this process commits shard after shard, instead of readers and
+    # the writer waiting for each other (or failing with "database is locked") on the rollback journal
+    journal_mode = conn.execute("PRAGMA journal_mode;").fetchone()[0]
+    if workers > 1:
+        conn.execute("PRAGMA journal_mode=WAL;")
+
+    start_upsert(c, 'tagged_papers', TAGGED_PAPERS_COLUMNS)
+    tagged = changed = 0
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as directory:
+        topics_path = os.path.join(directory, 'topic_embeddings.npy')
+        np.save(topics_path, topic_embeddings)
+        settings = (database, topics_path, labels, vectorizer.to_dict(), only_new, embeddings_path, topic_ids,
+                    topic_store_path, nprobe)
+        pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=settings) if workers > 1 else None
+        if pool is None:
+            init_worker(*settings)
+        try:
+            # The shards come back in order, so everything up to the resume mark has been written
+            for last_id, rows in ordered_map(pool, tag_shard, shards, SHARDS_IN_FLIGHT_PER_WORKER * workers):
+                changed += upsert_chunk(c, 'tagged_papers', TAGGED_PAPERS_COLUMNS, rows)
+                set_meta(c, RESUME_KEY, json.dumps({'vectorizer': vectorizer.version, 'only_new': only_new,
+                                                    'last_id': last_id}))
+                conn.commit()
+                tagged += len(rows)
+                print(f"Tagged {tagged} papers up to id {last_id}, {tagged / (time.perf_counter() - start):.0f} "
+                      f"papers/s.")
+            delete_meta(c, RESUME_KEY)
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(e)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            else:
+                _worker.pop('conn').close()
+            _worker.clear()
+            # Back to the journal mode the app reads the database with, once no worker holds it open
+            if workers > 1 and not conn.in_transaction:
+                conn.execute(f"PRAGMA journal_mode={journal_mode};")
+    return tagged, changed, resumed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tag the papers with their most similar topics into tagged_papers.")
+    parser.add_argument('--database', default=DATABASE_PATH, help="path to the SQLite database")
+    parser.add_argument('--only-new', action='store_true', help="only tag the papers that are not tagged yet")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="number of papers per shard, tagged by one worker and written in one transaction")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes tagging shards in parallel")
+    parser.add_argument('--embeddings', default=PAPER_EMBEDDINGS_PATH,
+                        help="paper embedding store of build_embeddings.py, used if it matches the topics")
+    parser.add_argument('--nprobe', type=int,
+                        help="search the topics through the index of build_ann_index.py, probing this many lists "
+                             "per paper (more is slower but closer to scoring every topic)")
+    args = parser.parse_args()
+
+    conn = create_connection(args.database)
+    if conn is not None:
+        start = time.perf_counter()
+        create_tables(conn)
+        migrated = migrate_upsert_keys(conn)
+        create_indexes(conn)
+        tagged, changed, resumed = tag_papers(conn, args.database, only_new=args.only_new,
+                                              batch_size=args.batch_size, workers=args.workers,
+                                              embeddings_path=args.embeddings, nprobe=args.nprobe)
+        elapsed = time.perf_counter() - start
+        print(f"Tagged {tagged} papers ({changed} new or changed) with {args.workers} workers in {elapsed:.2f} s, "
+              f"{tagged / max(elapsed, 1e-9):.0f} papers/s.")
+
+        # Bring the tables derived from tagged_papers up to date, as after db_manager.py --incremental. The changes
+        # of the shards written before a resume are not known any more, so their derived rows are rebuilt in full.
+        refresh_derived_tables(conn, rebuild=resumed or migrated > 0)
+        if not table_exists(conn, 'tagged_papers_fts'):
+            create_full_text_index(conn)
+        create_dataset_stats(conn)
+        bump_database_version(conn.cursor())
+        conn.commit()
+        conn.close()
+    else:
+        print("Error! cannot create the database connection.")
+
+
+if __name__ == "__main__":
+    main()
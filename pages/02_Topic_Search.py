@@ -2,18 +2,24 @@ import streamlit as st
 import pandas as pd
 import datetime
 import plotly.express as px
-from Home import create_connection, close_connection
+from util.analytics_core import get_topic_month_matrix
+from util.database import get_connection_pool
+from util.query_cache import get_database_version
+from util.topic_cooccurrence import get_topic_cooccurrence
 
-# Establish connection and get cursor
-conn = create_connection()
-cursor = conn.cursor()
+# Number of related topics listed per selected topic
+RELATED_TOPICS = 10
 
-# Fetch topics and date range
-cursor.execute("SELECT prefLabel FROM topics")
-topics = [topic[0] for topic in cursor.fetchall()]
+# Borrow a connection from the shared pool for the queries, it goes back to the pool even if the run is stopped
+with get_connection_pool().connection() as conn:
+    cursor = conn.cursor()
 
-cursor.execute("SELECT date(min(date)), date(max(date)) FROM tagged_papers")
-start_date_str, end_date_str = cursor.fetchone()
+    # Fetch topics and date range
+    cursor.execute("SELECT prefLabel FROM topics")
+    topics = [topic[0] for topic in cursor.fetchall()]
+
+    cursor.execute("SELECT date(min(date)), date(max(date)) FROM tagged_papers")
+    start_date_str, end_date_str = cursor.fetchone()
 start_date = datetime.datetime.strptime(start_date_str, "%Y-%m-%d")
 end_date = datetime.datetime.strptime(end_date_str, "%Y-%m-%d")
 
@@ -44,7 +50,7 @@ selected_topics = st.sidebar.multiselect(
 
 def get_data_for_topic(selected_topics, start_date_str, end_date_str):
     """
-    SQL query to fetch data from database
+    Monthly paper counts of the selected topics, sliced from the shared topics x months matrix
 
     Parameters:
     selected_topics (list): Values of the user input from the topic multiselect widget
@@ -52,32 +58,26 @@ def get_data_for_topic(selected_topics, start_date_str, end_date_str):
     end_date_str (str): End date from slider converted to string
 
     Returns:
-    data: Values returned by the SQL query
+    pd.DataFrame: One column per topic with papers in the range, indexed by month, from the first to the
+    last month with papers
     
     """
     
-    # Join with the topic_descendants table to fetch data for selected topics and their descendants
-    placeholders = ','.join(['?' for _ in selected_topics])
-    query = f"""
-        SELECT strftime('%Y-%m', tp.date) AS month, COUNT(*)
-        FROM tagged_papers tp
-        JOIN topic_descendants td ON td.descendant IN (tp.topic1, tp.topic2, tp.topic3, tp.topic4, tp.topic5)
-        WHERE tp.date BETWEEN ? AND ?
-            AND td.topic IN ({placeholders})
-        GROUP BY month
-        ORDER BY month
-    """
-
-    # Parameters include the start date, end date, and selected topics
-    params = [start_date_str, end_date_str] + list(selected_topics)
-
-    print("Query:", query)
-    print("Parameters:", params)
-
-    cursor.execute(query, params)
-    data = cursor.fetchall()
-
-    return data
+    # The subtree counts (topic and all its descendants) of data/create_topic_month_counts.py are held in memory
+    # once per data version by util/analytics_core.py. Only whole months are stored, so the slider dates are
+    # cut down to their months.
+    matrix = get_topic_month_matrix(get_database_version())
+    if matrix is None:
+        return pd.DataFrame()
+    months, series = matrix.time_series(selected_topics, start_date_str[:7], end_date_str[:7], subtree=True)
+    df_months = pd.DataFrame({topic: counts for topic, counts in series.items() if counts.any()},
+                             index=pd.to_datetime(months, format="%Y-%m"))
+    if df_months.empty:
+        return df_months
+
+    # Months before the first and after the last paper of the selected topics are left out
+    with_papers = df_months.to_numpy().any(axis=1).nonzero()[0]
+    return df_months.iloc[with_papers[0]:with_papers[-1] + 1]
 
 # Only show the slider if at least one topic has been selected
 if selected_topics:
@@ -97,28 +97,39 @@ if selected_topics:
     placeholder = st.empty()
     fig = px.line()
 
-    # Fetch and plot data for each selected topic
+    # Fetch the data for all selected topics at once, one column per topic over a shared index of all months
+    df_months = get_data_for_topic(selected_topics, start_date_str, end_date_str)
+
+    # Plot data for each selected topic
     for topic in selected_topics:
-        data = get_data_for_topic([topic], start_date_str, end_date_str)  # Make sure to pass list of one topic
-        if not data:
+        if topic not in df_months.columns:
             st.info(f"No data available for topic: {topic}")
         else:
-            df = pd.DataFrame(data, columns=['month', 'count'])
-            df['month'] = pd.to_datetime(df['month'], format="%Y-%m")
-            df.set_index('month', inplace=True)
-            all_months = pd.date_range(start=df.index.min().replace(day=1), end=df.index.max().replace(day=1),
-                                       freq='MS')
-            df_all_months = pd.DataFrame(index=all_months)
-            df_merged = df_all_months.merge(df, how='left', left_index=True, right_index=True)
-            df_merged['count'].fillna(0, inplace=True)
-            fig.add_scatter(x=df_merged.index, y=df_merged['count'], mode='lines+markers', name=topic)
+            fig.add_scatter(x=df_months.index, y=df_months[topic], mode='lines+markers', name=topic)
 
     # Update and show plot
     fig.update_layout(title='Tracking the trends of your selected topics...')
     placeholder.plotly_chart(fig)
 
-# Close connection
-close_connection(conn)
+    # RELATED TOPICS
+
+    # Topics most often tagged on the same papers, counted per year from the precomputed co-occurrence matrices
+    # (data/build_topic_incidence.py), so the date range is widened to whole years
+    st.subheader('Related topics')
+    st.markdown(f'Topics most often tagged on the same papers as the selected topics, '
+                f'{start_date.year}-{end_date.year}.')
+    cooccurrence = get_topic_cooccurrence(get_database_version())
+    for topic in selected_topics:
+        related = [] if cooccurrence is None else cooccurrence.related(
+            topic, k=RELATED_TOPICS, first_year=start_date.year, last_year=end_date.year)
+        with st.expander(topic, expanded=len(selected_topics) == 1):
+            if not related:
+                st.info(f"No related topics for: {topic}")
+            else:
+                st.dataframe(pd.DataFrame(related, columns=['Related topic', 'Papers together', 'Share of papers']),
+                             hide_index=True, use_container_width=True,
+                             column_config={'Share of papers': st.column_config.ProgressColumn(
+                                 format='%.2f', min_value=0, max_value=1)})
 
 # FOOTER with logo at the bottom
 with st.container():
@@ -1,22 +1,25 @@
 import streamlit as st
 import datetime
 import pandas as pd
-from Home import create_connection, close_connection
+from util.database import get_connection_pool
+from util.query_cache import cached_query, normalize_topics, get_database_version, show_query_cache_stats
+from util.similar_papers import get_similar_papers
 
 st.header('PAPER SEARCH')
 st.subheader('Search for papers submitted to arXiv.org using various search criteria.')
-st.markdown('Use the sidebar to filter papers by topics and date range.')
+st.markdown('Use the sidebar to filter papers by topics, keywords and date range.')
 
-conn = create_connection()
-cursor = conn.cursor()
+# Borrow a connection from the shared pool for the queries, it goes back to the pool even if the run is stopped
+with get_connection_pool().connection() as conn:
+    cursor = conn.cursor()
 
-# Fetch topics and date range
-cursor.execute("SELECT prefLabel FROM topics")
-topics = cursor.fetchall()
-topic_list = [topic[0] for topic in topics]
+    # Fetch topics and date range
+    cursor.execute("SELECT prefLabel FROM topics")
+    topics = cursor.fetchall()
+    topic_list = [topic[0] for topic in topics]
 
-cursor.execute("SELECT MIN(date), MAX(date) FROM tagged_papers")
-min_date, max_date = cursor.fetchone()
+    cursor.execute("SELECT MIN(date), MAX(date) FROM tagged_papers")
+    min_date, max_date = cursor.fetchone()
 start_date = datetime.datetime.strptime(min_date, "%Y-%m-%d")
 end_date = datetime.datetime.strptime(max_date, "%Y-%m-%d")
 
@@ -31,10 +34,30 @@ selected_topic = st.sidebar.multiselect(
     placeholder='Choose a topic',
 )
 
+keywords = st.sidebar.text_input(
+    'Search titles and abstracts',
+    help='Papers containing all the words, best matches first',
+    key='keywords',
+    placeholder='Enter keywords',
+).strip()
+
+
+# Number of papers shown per page of results
+PAGE_SIZE = 100
+
+# Share of the papers in the date range above which a walk over the date index finds a page of matches quickly
+DENSE_MATCH_SHARE = 0.02
+
+# Number of similar papers listed per selected paper
+SIMILAR_PAPERS = 10
+
 
-def get_data_for_papers(descendants, start_date_str, end_date_str):
+# Results are cached per set of topics and date range
+@cached_query(lambda descendants, start_date_str, end_date_str:
+              (normalize_topics(descendants), start_date_str, end_date_str))
+def count_papers(descendants, start_date_str, end_date_str):
     """
-    SQL query to fetch data from database
+    SQL query to count the matching papers, without fetching them
 
     Parameters:
     descendants (list): List of topics that are subtopics of the topic input by the user in the multiselect widget
@@ -42,81 +65,330 @@ def get_data_for_papers(descendants, start_date_str, end_date_str):
     end_date_str (str): End date from slider converted to string
 
     Returns:
-    data: Values returned by the SQL query
-    len(data): Length of the data list
+    number_papers_found: Number of distinct papers tagged with one of the topics in the date range
+    number_papers_in_range: Number of papers in the date range
     
     """
-    
-    conn = create_connection()
-    cursor = conn.cursor()
 
-    # Prepare the query with the correct number of placeholders for descendants
-    # Since we are checking five topic columns, we need to repeat the list of placeholders for each topic column.
+    # Both counts are answered from covering indexes (paper_topics on topic_id, date and tagged_papers on date)
     placeholders = ','.join(['?'] * len(descendants))
-    all_placeholders = ', '.join([placeholders] * 5)  # Repeat placeholders for each of the five topic columns
-    query = f"""
-    SELECT DISTINCT title, url, strftime('%Y-%m-%d', date) as date
-    FROM tagged_papers
-    WHERE (topic1 IN ({placeholders}) OR
-           topic2 IN ({placeholders}) OR
-           topic3 IN ({placeholders}) OR
-           topic4 IN ({placeholders}) OR
-           topic5 IN ({placeholders}))
-          AND date BETWEEN ? AND ?
+    cursor.execute(f"""
+    SELECT COUNT(DISTINCT pt.paper_id)
+    FROM topics t
+    JOIN paper_topics pt ON pt.topic_id = t.rowid
+    WHERE t.prefLabel IN ({placeholders})
+        AND pt.date BETWEEN ? AND ?
+    """, tuple(descendants + [start_date_str, end_date_str]))
+    number_papers_found = cursor.fetchone()[0]
+
+    cursor.execute("SELECT COUNT(*) FROM tagged_papers WHERE date BETWEEN ? AND ?", (start_date_str, end_date_str))
+    number_papers_in_range = cursor.fetchone()[0]
+
+    return number_papers_found, number_papers_in_range
+
+
+# Results are cached per set of topics, date range and page
+@cached_query(lambda descendants, start_date_str, end_date_str, after, dense:
+              (normalize_topics(descendants), start_date_str, end_date_str, after, dense))
+def get_data_for_papers(descendants, start_date_str, end_date_str, after, dense):
     """
+    SQL query to fetch one page of papers from database, ordered by date and url
 
-    # Parameters include the descendants repeated for each topic column and the date range
-    params = descendants * 5 + [start_date_str, end_date_str]  # Repeat the list of descendants for each topic column
+    Parameters:
+    descendants (list): List of topics that are subtopics of the topic input by the user in the multiselect widget
+    start_date_str (str): Start date from slider converted to string
+    end_date_str (str): End date from slider converted to string
+    after (tuple): (date, url) of the last paper on the previous page, or None for the first page
+    dense (bool): Whether the topics match a large share of the papers in the date range
+
+    Returns:
+    data: Values returned by the SQL query, at most PAGE_SIZE rows
+    
+    """
+
+    # Keyset pagination: the page starts right after the (date, url) of the previous page, so no rows are skipped
+    # with OFFSET and every page costs the same to fetch
+    placeholders = ','.join(['?'] * len(descendants))
+    after_date, after_url = after if after else ('', '')
+    topic_ids = f"SELECT rowid FROM topics WHERE prefLabel IN ({placeholders})"
+    if dense:
+        # Many matches: walk the papers in (date, url) order and keep the tagged ones until the page is full
+        query = f"""
+        SELECT tp.title, tp.url, strftime('%Y-%m-%d', tp.date) as date, tp.date
+        FROM tagged_papers tp
+        WHERE tp.date BETWEEN ? AND ?
+            AND (tp.date, tp.url) > (?, ?)
+            AND EXISTS (SELECT 1 FROM paper_topics pt
+                        WHERE pt.paper_id = tp.rowid AND pt.topic_id IN ({topic_ids}))
+        ORDER BY tp.date, tp.url
+        LIMIT ?
+        """
+        params = [start_date_str, end_date_str, after_date, after_url] + descendants + [PAGE_SIZE]
+    else:
+        # Few matches: look them up in paper_topics (indexed on topic_id, date) and sort only those
+        query = f"""
+        SELECT tp.title, tp.url, strftime('%Y-%m-%d', tp.date) as date, tp.date
+        FROM tagged_papers tp
+        WHERE tp.rowid IN (
+            SELECT pt.paper_id
+            FROM paper_topics pt
+            WHERE pt.topic_id IN ({topic_ids})
+                AND pt.date BETWEEN ? AND ?
+        )
+            AND (tp.date, tp.url) > (?, ?)
+        ORDER BY tp.date, tp.url
+        LIMIT ?
+        """
+        params = descendants + [start_date_str, end_date_str, after_date, after_url, PAGE_SIZE]
 
     # Execute the query
     cursor.execute(query, tuple(params))
     data = cursor.fetchall()
 
-    close_connection(conn)
+    return data
 
-    return data, len(data)
 
+def to_match_query(keywords):
+    """
+    Turn the keywords input by the user into an FTS5 MATCH expression
 
-if selected_topic:
-    # Fetch precomputed descendants for the selected topics
-    placeholders = ','.join(['?'] * len(selected_topic))
-    cursor.execute(f"SELECT DISTINCT descendant FROM topic_descendants WHERE topic IN ({placeholders})", tuple(selected_topic))
-    descendants = [desc[0] for desc in cursor.fetchall()]
-    descendants.extend(selected_topic)  # Include the main topics themselves
+    Every word is quoted, so the input can't be read as FTS5 query syntax, and the words are combined with AND
 
-    date_interval = st.sidebar.slider(
-        'Do you want to narrow down the search by date range (MM-YYYY)?',
-        value=(start_date, end_date),
-        min_value=start_date,
-        max_value=end_date,
-        format='MM-YYYY',
-        key='date_interval',
-    )
-    start_date, end_date = date_interval
-    start_date_str = start_date.strftime('%Y-%m-%d')
-    end_date_str = end_date.strftime('%Y-%m-%d')
+    Parameters:
+    keywords (str): Keywords from the text input
 
-    data, number_papers_found = get_data_for_papers(descendants, start_date_str, end_date_str)
+    Returns:
+    match_query: MATCH expression for tagged_papers_fts
+    
+    """
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in keywords.split())
 
-    if not data:
-        st.write('No papers found.')
-    else:
-        # Convert search output into dataframe for display
-        df = pd.DataFrame(data, columns=['Title', 'URL', 'Submission date'])
-
-        # Display results
-        st.write('Number of papers found:', str(number_papers_found))
-        st.dataframe(
-            df,
-            column_config={
-                "URL": st.column_config.LinkColumn(
-                )
-            },
-            use_container_width=True,
-            hide_index=True,
+
+def keyword_filters(descendants, start_date_str, end_date_str):
+    """
+    SQL conditions restricting the keyword matches to the date range and, if any are selected, the topics
+
+    Returns:
+    conditions: SQL to append to the WHERE clause
+    params: Values of the placeholders in conditions
+    
+    """
+    conditions = "AND tp.date BETWEEN ? AND ?"
+    params = [start_date_str, end_date_str]
+    if descendants:
+        placeholders = ','.join(['?'] * len(descendants))
+        conditions += f"""
+            AND EXISTS (SELECT 1 FROM paper_topics pt
+                        WHERE pt.paper_id = tp.rowid
+                            AND pt.topic_id IN (SELECT rowid FROM topics WHERE prefLabel IN ({placeholders})))"""
+        params += descendants
+    return conditions, params
+
+
+# Results are cached per keywords, set of topics and date range
+@cached_query(lambda match_query, descendants, start_date_str, end_date_str:
+              (match_query, normalize_topics(descendants), start_date_str, end_date_str))
+def count_keyword_papers(match_query, descendants, start_date_str, end_date_str):
+    """
+    SQL query to count the papers matching the keywords and filters, without fetching them
+
+    Returns:
+    number_papers_found: Number of papers matching the keywords, topics and date range
+    
+    """
+    conditions, params = keyword_filters(descendants, start_date_str, end_date_str)
+    cursor.execute(f"""
+    SELECT COUNT(*)
+    FROM tagged_papers_fts
+    JOIN tagged_papers tp ON tp.rowid = tagged_papers_fts.rowid
+    WHERE tagged_papers_fts MATCH ?
+        {conditions}
+    """, tuple([match_query] + params))
+    return cursor.fetchone()[0]
+
+
+# Results are cached per keywords, set of topics, date range and page
+@cached_query(lambda match_query, descendants, start_date_str, end_date_str, offset:
+              (match_query, normalize_topics(descendants), start_date_str, end_date_str, offset))
+def get_data_for_keywords(match_query, descendants, start_date_str, end_date_str, offset):
+    """
+    SQL query to fetch one page of the papers matching the keywords, best matches first
+
+    Parameters:
+    match_query (str): MATCH expression built from the keywords
+    descendants (list): Selected topics and their subtopics, or an empty list to search all papers
+    start_date_str (str): Start date from slider converted to string
+    end_date_str (str): End date from slider converted to string
+    offset (int): Number of papers on the previous pages
+
+    Returns:
+    data: Values returned by the SQL query, at most PAGE_SIZE rows
+    
+    """
+
+    # The matches are ranked by BM25 (title hits weigh more than abstract hits), the ranking has to see every match
+    # anyway, so the pages are cut from it with OFFSET
+    conditions, params = keyword_filters(descendants, start_date_str, end_date_str)
+    cursor.execute(f"""
+    SELECT tp.title, tp.url, strftime('%Y-%m-%d', tp.date) as date, tp.date
+    FROM tagged_papers_fts
+    JOIN tagged_papers tp ON tp.rowid = tagged_papers_fts.rowid
+    WHERE tagged_papers_fts MATCH ?
+        {conditions}
+    ORDER BY bm25(tagged_papers_fts, 2.0, 1.0), tp.rowid
+    LIMIT ? OFFSET ?
+    """, tuple([match_query] + params + [PAGE_SIZE, offset]))
+    return cursor.fetchall()
+
+
+def get_paper_id(url):
+    """
+    SQL query to look up the id of a paper in the papers table, the key of its embedding
+
+    Parameters:
+    url (str): URL of the paper
+
+    Returns:
+    paper_id: papers.id of the paper, or None if it is not in the papers table
+    
+    """
+    cursor.execute("SELECT id FROM papers WHERE url = ?", (url,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def get_data_for_similar_papers(similar):
+    """
+    SQL query to fetch the similar papers found in the embeddings
+
+    Parameters:
+    similar (list): (rowid in tagged_papers, similarity) tuples, most similar first
+
+    Returns:
+    data: (title, url, date, similarity) rows, in the order of similar
+    
+    """
+    placeholders = ','.join(['?'] * len(similar))
+    cursor.execute(f"""
+    SELECT rowid, title, url, strftime('%Y-%m-%d', date) as date
+    FROM tagged_papers
+    WHERE rowid IN ({placeholders})
+    """, tuple(rowid for rowid, _ in similar))
+    papers = {row[0]: row[1:] for row in cursor.fetchall()}
+    return [(*papers[rowid], similarity) for rowid, similarity in similar if rowid in papers]
+
+
+if selected_topic or keywords:
+    # The queries of the search share one connection from the pool, the functions above use its cursor
+    with get_connection_pool().connection() as conn:
+        cursor = conn.cursor()
+
+        # Fetch precomputed descendants for the selected topics
+        descendants = []
+        if selected_topic:
+            placeholders = ','.join(['?'] * len(selected_topic))
+            cursor.execute(f"SELECT DISTINCT descendant FROM topic_descendants WHERE topic IN ({placeholders})",
+                           tuple(selected_topic))
+            descendants = [desc[0] for desc in cursor.fetchall()]
+            descendants.extend(selected_topic)  # Include the main topics themselves
+
+        date_interval = st.sidebar.slider(
+            'Do you want to narrow down the search by date range (MM-YYYY)?',
+            value=(start_date, end_date),
+            min_value=start_date,
+            max_value=end_date,
+            format='MM-YYYY',
+            key='date_interval',
         )
+        start_date, end_date = date_interval
+        start_date_str = start_date.strftime('%Y-%m-%d')
+        end_date_str = end_date.strftime('%Y-%m-%d')
+
+        match_query = to_match_query(keywords)
+        if match_query:
+            number_papers_found = count_keyword_papers(match_query, descendants, start_date_str, end_date_str)
+        else:
+            number_papers_found, number_papers_in_range = count_papers(descendants, start_date_str, end_date_str)
+            dense = number_papers_found > DENSE_MATCH_SHARE * number_papers_in_range
+
+        # The session only keeps the keys where the visited pages start (the offset for keyword searches, the
+        # (date, url) of the previous page otherwise), the pages start over when the search changes
+        search = (tuple(sorted(selected_topic)), match_query, start_date_str, end_date_str)
+        if st.session_state.get('paper_search') != search:
+            st.session_state['paper_search'] = search
+            st.session_state['paper_page_keys'] = [None]
+        page_keys = st.session_state['paper_page_keys']
+
+        if match_query:
+            data = get_data_for_keywords(match_query, descendants, start_date_str, end_date_str, page_keys[-1] or 0)
+        else:
+            data = get_data_for_papers(descendants, start_date_str, end_date_str, page_keys[-1], dense)
+
+        if not data:
+            st.write('No papers found.')
+        else:
+            # Convert search output into dataframe for display
+            df = pd.DataFrame([row[:3] for row in data], columns=['Title', 'URL', 'Submission date'])
+
+            # Display results
+            page_number = len(page_keys)
+            first_paper = (page_number - 1) * PAGE_SIZE + 1
+            st.write('Number of papers found:', str(number_papers_found))
+            st.caption(f'Showing papers {first_paper}-{first_paper + len(data) - 1}')
+            # Ticking a paper lists its most similar papers below the results
+            df['Similar'] = False
+            edited_df = st.data_editor(
+                df,
+                column_config={
+                    "URL": st.column_config.LinkColumn(
+                    ),
+                    "Similar": st.column_config.CheckboxColumn(
+                        help='Show the papers most similar to this one',
+                    ),
+                },
+                disabled=['Title', 'URL', 'Submission date'],
+                use_container_width=True,
+                hide_index=True,
+            )
+
+            # Page navigation, the next page starts after the last paper on this page
+            last_paper = data[-1]
+            next_key = first_paper - 1 + len(data) if match_query else (last_paper[3], last_paper[1])
+            col1, col2 = st.columns([1, 8])
+            with col1:
+                st.button('Previous', disabled=page_number == 1, key='previous_page', on_click=page_keys.pop)
+            with col2:
+                st.button('Next', disabled=first_paper + len(data) > number_papers_found, key='next_page',
+                          on_click=page_keys.append, args=(next_key,))
+
+            # Similar papers, found in the precomputed paper embeddings instead of the abstracts
+            selected_papers = edited_df[edited_df['Similar']]
+            if not selected_papers.empty:
+                st.subheader('Similar papers')
+                similar_papers = get_similar_papers(get_database_version())
+                if similar_papers is None:
+                    st.info('Similar papers need the paper embeddings: run data/build_embeddings.py and '
+                            'data/build_ann_index.py.')
+                else:
+                    filtered = st.checkbox('Only papers in the selected date range and topics', value=True,
+                                           key='similar_filtered')
+                    allowed = similar_papers.allowed(start_date_str, end_date_str, descendants) if filtered else None
+                    for title, url in zip(selected_papers['Title'], selected_papers['URL']):
+                        paper_id = get_paper_id(url)
+                        similar = [] if paper_id is None else similar_papers.similar(paper_id, SIMILAR_PAPERS, allowed)
+                        with st.expander(title, expanded=len(selected_papers) == 1):
+                            if not similar:
+                                st.info(f"No similar papers for: {title}")
+                            else:
+                                st.dataframe(pd.DataFrame(get_data_for_similar_papers(similar),
+                                                          columns=['Title', 'URL', 'Submission date', 'Similarity']),
+                                             hide_index=True, use_container_width=True,
+                                             column_config={'URL': st.column_config.LinkColumn(),
+                                                            'Similarity': st.column_config.ProgressColumn(
+                                                                format='%.2f', min_value=0, max_value=1)})
 
-close_connection(conn)
+# Hit/miss counters of the query result cache, including the queries of this run
+show_query_cache_stats()
 
 # FOOTER with logo at the bottom
 with st.container():
@@ -2,17 +2,21 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import datetime
+import heapq
 from datetime import date, timedelta
-from Home import create_connection, close_connection
-
-conn = create_connection()  # connect to the database
-cursor = conn.cursor()  # get a cursor
-
-# SQL query to return start and end dates from database (in string format)
-cursor.execute("SELECT date(min(date)) date FROM tagged_papers")
-start_date_str = cursor.fetchone()[0]
-cursor.execute("SELECT date(max(date)) date FROM tagged_papers")
-end_date_str = cursor.fetchone()[0]
+from util.database import get_connection_pool
+from util.query_cache import cached_query, get_database_version, show_query_cache_stats
+from util.trend_engine import TREND_MODES, load_topic_levels, rank_topics
+
+# Borrow a connection from the shared pool for the queries, it goes back to the pool even if the run is stopped
+with get_connection_pool().connection() as conn:
+    cursor = conn.cursor()  # get a cursor
+
+    # SQL query to return start and end dates from database (in string format)
+    cursor.execute("SELECT date(min(date)) date FROM tagged_papers")
+    start_date_str = cursor.fetchone()[0]
+    cursor.execute("SELECT date(max(date)) date FROM tagged_papers")
+    end_date_str = cursor.fetchone()[0]
 # Convert string dates to datetime objects for use in widgets
 start_date = datetime.datetime.strptime(start_date_str, "%Y-%m-%d")
 end_date = datetime.datetime.strptime(end_date_str, "%Y-%m-%d")
@@ -23,7 +27,8 @@ end_date = datetime.datetime.strptime(end_date_str, "%Y-%m-%d")
 st.header('TOP TRENDS')
 st.subheader('Discover which AI topics were the top trending over the last week, month, year or the time interval of '
              'your choice.')
-st.markdown('You can choose up to 10 top trends to show.')
+st.markdown('You can choose up to 10 top trends to show, ranked by number of papers or by how fast they are '
+            'trending.')
 
 
 # WIDGET
@@ -36,7 +41,24 @@ number_topics = st.sidebar.number_input(
 )
 
 timeframe = 0
+ranking = 'Most papers'
+rollup_level = None
 if number_topics > 0:
+    ranking = st.sidebar.selectbox(
+        'Rank topics by',
+        ['Most papers'] + list(TREND_MODES),
+        help='Fastest growing: papers in the interval against the interval before. Momentum: smoothed growth from '
+             'month to month. Breakout: papers per month in the interval against the two years before.',
+        key='ranking',
+    )
+    rollup_levels = {'No rollup': None}
+    rollup_levels.update({f'Level {level}': level for level in sorted(load_topic_levels(get_database_version()))})
+    rollup_level = rollup_levels[st.sidebar.selectbox(
+        'Roll up to hierarchy level',
+        list(rollup_levels),
+        help='Rank only the topics of this level of the topic tree, each counting the papers of all its subtopics',
+        key='rollup_level',
+    )]
     timeframe = st.sidebar.radio(
         'Select time interval',
         ['Last 7 days', 'Last month', 'Last year', 'Custom'],
@@ -75,6 +97,8 @@ end_date_str = end_date.strftime('%Y-%m-%d')
 
 # VISUALIZATION 
 
+# Results are cached per date range and number of topics
+@cached_query(lambda start_date_str, end_date_str, number_topics: (start_date_str, end_date_str, int(number_topics)))
 def get_data_for_timeframe(start_date_str, end_date_str, number_topics):
     """
     SQL query to fetch data from database
@@ -88,39 +112,25 @@ def get_data_for_timeframe(start_date_str, end_date_str, number_topics):
     data: Values returned by the SQL query
         
     """
-    params = []
-
-    # Append start and end date parameters for each topic column
-    for _ in range(5):
-        params.extend([start_date_str, end_date_str])
-
-    # Append the number_topics parameter for the LIMIT clause
-    params.append(number_topics)
-
-    # SQL query template for each topic column
-    query = f"""
-        SELECT topic, COUNT(*) AS topic_count 
-        FROM (
-            SELECT topic1 AS topic FROM tagged_papers WHERE topic1 IS NOT NULL AND date BETWEEN ? AND ?
-            UNION ALL
-            SELECT topic2 AS topic FROM tagged_papers WHERE topic2 IS NOT NULL AND date BETWEEN ? AND ?
-            UNION ALL
-            SELECT topic3 AS topic FROM tagged_papers WHERE topic3 IS NOT NULL AND date BETWEEN ? AND ?
-            UNION ALL
-            SELECT topic4 AS topic FROM tagged_papers WHERE topic4 IS NOT NULL AND date BETWEEN ? AND ?
-            UNION ALL
-            SELECT topic5 AS topic FROM tagged_papers WHERE topic5 IS NOT NULL AND date BETWEEN ? AND ?
-        ) AS subquery
-        GROUP BY topic
-        ORDER BY topic_count DESC
-        LIMIT ?
+    # The count of a topic in the window is the difference of two prefix sums of the topic_day_counts rollup table
+    # (data/create_topic_month_counts.py): the last cumulative count up to the end date minus the last one before the
+    # start date. Both are index lookups, so the query costs the same for any window, and a heap keeps the top ones.
+    query = """
+        SELECT t.topic,
+               COALESCE((SELECT cumulative_count FROM topic_day_counts
+                         WHERE topic = t.topic AND day <= ? ORDER BY day DESC LIMIT 1), 0)
+             - COALESCE((SELECT cumulative_count FROM topic_day_counts
+                         WHERE topic = t.topic AND day < ? ORDER BY day DESC LIMIT 1), 0) AS topic_count
+        FROM (SELECT DISTINCT prefLabel AS topic FROM topics) AS t
     """
+    params = [end_date_str, start_date_str]
 
     print("Query:", query)
     print("Parameters:", params)
 
-    cursor.execute(query, params)
-    data = cursor.fetchall()
+    with get_connection_pool().connection() as conn:
+        cursor = conn.execute(query, params)
+        data = heapq.nlargest(number_topics, (row for row in cursor if row[1] > 0), key=lambda row: row[1])
 
     return data
 
@@ -130,7 +140,17 @@ if number_topics:
     placeholder = st.empty()
 
     # Get data for the given date interval and number of trends
-    data = get_data_for_timeframe(start_date_str, end_date_str, number_topics)
+    if ranking == 'Most papers' and rollup_level is None:
+        data = get_data_for_timeframe(start_date_str, end_date_str, number_topics)
+        axis_title = 'Number of tagged papers'
+    else:
+        # Trend scores and rollups are computed for whole months, over the topics x months matrix of the trend
+        # engine (subtree counts for rollups)
+        mode = 'papers' if ranking == 'Most papers' else ranking
+        data = [(topic, score) for topic, score, _ in
+                rank_topics(mode, start_date_str[:7], end_date_str[:7], number_topics, get_database_version(),
+                            level=rollup_level)]
+        axis_title = 'Number of tagged papers in the subtree' if mode == 'papers' else TREND_MODES[ranking]
     print("Fetched data:", data)
 
     # Extract topics and counts from the data
@@ -162,7 +182,7 @@ if number_topics:
 
         fig.update_layout(
             title=f'Top {number_topics} AI topics from {start_date_str} to {end_date_str}',
-            xaxis_title='Number of tagged papers',
+            xaxis_title=axis_title,
             xaxis=dict(
                 tickfont=dict(size=14),
                 titlefont=dict(size=16),
@@ -181,7 +201,8 @@ if number_topics:
         # Show plot
         placeholder.plotly_chart(fig)
 
-close_connection(conn)
+# Hit/miss counters of the query result cache, including the queries of this run
+show_query_cache_stats()
 
 # FOOTER with logo at the bottom
 with st.container():
@@ -12,6 +12,19 @@ def load_module(module_name, file_path):
     return module
 
 
+# Topics at the center of the subtree charts, one tab each
+SUBTREE_TOPICS = [
+    "Natural language processing",
+    "Artificial intelligence",
+    "Machine translation",
+    "Knowledge representation",
+    "Computational linguistics",
+    "Data mining",
+    "Data analysis",
+    "Data science",
+]
+
+
 # TOPIC TREE PAGE FUNCTION
 def tree_page():
     # Page Title
@@ -24,41 +37,24 @@ def tree_page():
         hierarchy. This is ideal for visualizing the broad spectrum of AI topics and their subdivisions. This 
         visualization stands out for its ability to reveal complex relationships at a glance, making it easier to 
         discern the overarching structure of AI research.
-        
-        :red[Data is loading ... Please wait.]
-        
-        We are working on performance issues of the app to improve the rendering/loading time.
-        Thank you for being patient! 
         """, unsafe_allow_html=True)
 
     # TAB LAYOUT:
     # Page layout with TABS
-    tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9 = (
-        st.tabs(["| The Main Tree |",
-                 "| Subplot 1 |",
-                 "| Subplot 2 |",
-                 "| Subplot 3 |",
-                 "| Subplot 4 |",
-                 "| Subplot 5 |",
-                 "| Subplot 6 |",
-                 "| Subplot 7 |",
-                 "| Subplot 8 |"
-                 ]))
+    tab1, *subtree_tabs = st.tabs(["| The Main Tree |"] + [f"| {topic} |" for topic in SUBTREE_TOPICS])
 
     # Dynamically load and display charts for each tab
+    main_tree_module = load_module("main_tree_module", "util/main_sunburst.py")
+
     # TAB1
     with tab1:
-        main_tree_module = load_module("main_tree_module", "util/main_sunburst.py")
         main_tree_module.main()
 
-    tab2.write("Sunburst for Natural language processing ...")
-    tab3.write("Sunburst Artificial intelligence")
-    tab4.write("Sunburst for Machine translation ...")
-    tab5.write("Sunburst for Knowledge representation ...")
-    tab6.write("Sunburst for Computational linguistics ...")
-    tab7.write("Sunburst for Data mining ...")
-    tab8.write("Sunburst for Data analysis ...")
-    tab9.write("Sunburst for Data science ...")
+    # TAB2-9: the subtree of each topic
+    for tab, topic in zip(subtree_tabs, SUBTREE_TOPICS):
+        with tab:
+            st.subheader(f"Sunburst for {topic}")
+            main_tree_module.subtree_main(topic)
 
     # FOOTER with logo at the bottom
     with st.container():
@@ -0,0 +1,64 @@
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'data'))
+
+from util.ann_index import IVFIndex
+from util.embedding_store import EmbeddingStoreWriter, open_embedding_store
+from util.text_vectorizer import HashingVectorizer
+from tag_papers import TOPICS_PER_PAPER, tag_rows
+
+
+def make_store(path, rows, dim=16, seed=0):
+    """Write a store of random unit length embeddings and open it."""
+    vectors = np.random.default_rng(seed).normal(size=(rows, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    with EmbeddingStoreWriter(path, HashingVectorizer(dim=dim)) as writer:
+        writer.add(np.arange(1, rows + 1), vectors)
+    return open_embedding_store(path)
+
+
+def make_queries(count, dim=16, seed=1):
+    queries = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def test_search_batch_falls_back_to_exact_when_probed_lists_are_short(tmp_path):
+    # One topic per list, so probing 2 lists finds 2 of the 5 topics a paper is tagged with
+    store = make_store(str(tmp_path / 'topics.emb'), 7)
+    index = IVFIndex.build(store, lists=7)
+    queries = make_queries(50)
+
+    rows, scores = index.search_batch(queries, TOPICS_PER_PAPER, nprobe=2)
+
+    assert (rows >= 0).all()
+    for query, found in zip(queries, rows):
+        assert found.tolist() == store.search(query, TOPICS_PER_PAPER)[0].tolist()
+
+
+def test_search_batch_pads_only_when_the_store_is_smaller_than_k(tmp_path):
+    store = make_store(str(tmp_path / 'topics.emb'), 3)
+    index = IVFIndex.build(store, lists=3)
+
+    rows, _ = index.search_batch(make_queries(10), TOPICS_PER_PAPER, nprobe=1)
+
+    assert ((rows >= 0).sum(axis=1) == 3).all()
+    assert (rows[:, 3:] == -1).all()
+
+
+def test_tag_rows_fills_every_topic_slot_through_a_short_index(tmp_path):
+    store = make_store(str(tmp_path / 'topics.emb'), 7)
+    index = IVFIndex.build(store, lists=7)
+    labels = np.array([f'topic {i}' for i in range(7)], dtype=object)
+    papers = [(f'url{i}', '2024-01-01', 'title', 'abstract') for i in range(20)]
+    embeddings = make_queries(len(papers))
+
+    exact = tag_rows(papers, embeddings, labels, store.vectors(slice(None)))
+    approximate = tag_rows(papers, embeddings, labels, None, topic_index=index, nprobe=2)
+
+    assert approximate == exact
+    assert all(None not in row for row in approximate)
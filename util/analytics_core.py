@@ -0,0 +1,144 @@
+import streamlit as st
+import sqlite3
+import numpy as np
+from util.database import get_connection, release_connection
+
+# Papers per topic and month held in memory once per data version and shared by the analytics pages
+# (Topic Search, Top Trends and the topic tree sunburst)
+
+
+def month_range(first, last):
+    """Return every month from first to last ('YYYY-MM', both included) as an array of strings."""
+    return np.arange(np.datetime64(first, 'M'), np.datetime64(last, 'M') + 1).astype(str)
+
+
+class TopicMonthMatrix:
+    """Dense int32 matrices of topics x months, with the maps from topic labels and months to their indexes.
+
+    direct holds the papers tagged with each topic, subtree the distinct papers tagged with the topic or any of its
+    descendants. The months run without gaps from the first to the last month with papers, so a range of months is
+    a slice, and every query is a vectorized operation over the slice.
+    """
+
+    def __init__(self, rows):
+        """Build the matrices.
+
+        Args:
+            rows (list): (topic, month, direct_count, subtree_count) rows of the topic_month_counts table.
+        """
+        row_topics, row_months, direct_counts, subtree_counts = zip(*rows)
+        self.topics, topic_rows = np.unique(np.array(row_topics, dtype=object), return_inverse=True)
+        self.months = month_range(min(row_months), max(row_months))
+        month_columns = np.searchsorted(self.months, np.array(row_months))
+        self.direct = np.zeros((len(self.topics), len(self.months)), dtype=np.int32)
+        self.subtree = np.zeros_like(self.direct)
+        self.direct[topic_rows, month_columns] = direct_counts
+        self.subtree[topic_rows, month_columns] = subtree_counts
+        self.topic_index = {topic: i for i, topic in enumerate(self.topics)}
+
+    @property
+    def nbytes(self):
+        return self.direct.nbytes + self.subtree.nbytes
+
+    def counts(self, subtree=False):
+        """Return the matrix of subtree or direct counts."""
+        return self.subtree if subtree else self.direct
+
+    def month_slice(self, start_month, end_month):
+        """Return the slice of the months from start_month to end_month ('YYYY-MM', both included).
+
+        Months outside the data are cut off, so the slice may be empty.
+        """
+        first = np.datetime64(self.months[0], 'M')
+        start = int((np.datetime64(start_month, 'M') - first).astype(int))
+        end = int((np.datetime64(end_month, 'M') - first).astype(int)) + 1
+        start, end = (min(max(offset, 0), len(self.months)) for offset in (start, end))
+        return slice(start, max(start, end))
+
+    def topic_rows(self, topics):
+        """Return the rows of the given topic labels, -1 for labels without papers."""
+        return np.array([self.topic_index.get(topic, -1) for topic in topics], dtype=np.int64)
+
+    def time_series(self, topics, start_month, end_month, subtree=False):
+        """Return the monthly counts of some topics.
+
+        Args:
+            topics (list): Topic labels.
+            start_month (str): First month ('YYYY-MM').
+            end_month (str): Last month ('YYYY-MM').
+            subtree (bool): Count the papers of the descendants too.
+
+        Returns:
+            tuple: (months array, {topic: counts array}) for the topics that have papers.
+        """
+        months = self.month_slice(start_month, end_month)
+        rows = self.topic_rows(topics)
+        counts = self.counts(subtree)
+        return self.months[months], {topic: counts[row, months] for topic, row in zip(topics, rows) if row >= 0}
+
+    def window_sums(self, start_month, end_month, subtree=False):
+        """Return the papers of every topic from start_month to end_month, as an array over the topics."""
+        return self.counts(subtree)[:, self.month_slice(start_month, end_month)].sum(axis=1, dtype=np.int64)
+
+    def top_k(self, start_month, end_month, k, subtree=False, candidates=None):
+        """Return the k topics with most papers from start_month to end_month.
+
+        Args:
+            start_month (str): First month ('YYYY-MM').
+            end_month (str): Last month ('YYYY-MM').
+            k (int): Number of topics.
+            subtree (bool): Count the papers of the descendants too.
+            candidates (iterable): Only rank these topic labels, all topics if None.
+
+        Returns:
+            list: (topic, papers) tuples, most papers first, without topics that have no papers.
+        """
+        sums = self.window_sums(start_month, end_month, subtree)
+        ranked = np.where(sums > 0, sums, -np.inf)
+        if candidates is not None:
+            ranked = np.where(self.candidate_mask(candidates), ranked, -np.inf)
+        return [(self.topics[i], int(sums[i])) for i in top_k(ranked, k)]
+
+    def candidate_mask(self, topics):
+        """Return a boolean array over the topics, True for the given topic labels."""
+        rows = self.topic_rows(topics)
+        mask = np.zeros(len(self.topics), dtype=bool)
+        mask[rows[rows >= 0]] = True
+        return mask
+
+
+def top_k(scores, k):
+    """Return the indexes of the k highest finite scores, highest first (-inf marks topics left out)."""
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    candidates = np.flatnonzero(np.isfinite(scores))
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(scores[candidates], -k)[-k:]]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+# Loaded once per data version and shared by all sessions, read-only; a new version evicts the previous one
+@st.cache_resource(max_entries=1)
+def get_topic_month_matrix(database_version=None):
+    """Load the topic_month_counts rollup table (data/create_topic_month_counts.py) into a TopicMonthMatrix.
+
+    Args:
+        database_version (str): Version of the data, only used as cache key so a reload is picked up.
+
+    Returns:
+        TopicMonthMatrix: The matrices, or None if there is no data.
+    """
+    conn = get_connection()
+    if conn is None:
+        return None
+    try:
+        rows = conn.execute("SELECT topic, month, direct_count, subtree_count FROM topic_month_counts "
+                            "WHERE subtree_count > 0").fetchall()
+    except sqlite3.Error as e:
+        st.error(f"Error fetching data from database: {e}")
+        return None
+    finally:
+        release_connection(conn)
+    if not rows:
+        return None
+    return TopicMonthMatrix(rows)
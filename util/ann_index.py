@@ -0,0 +1,196 @@
+import math
+import os
+import numpy as np
+
+# Approximate nearest neighbour search over an embedding store (util/embedding_store.py), an inverted file (IVF)
+# index: the embeddings are clustered around centroids, and a query only scores the embeddings of the lists of its
+# nprobe nearest centroids, so the work per query grows with the list size instead of the number of embeddings
+
+# Lists probed per query by default: more lists find more of the exact neighbours (recall) but take longer
+DEFAULT_NPROBE = 8
+
+# k-means training: iterations, and training embeddings sampled per list
+KMEANS_ITERATIONS = 10
+TRAINING_ROWS_PER_LIST = 64
+
+# Embeddings assigned to their list per matrix multiply
+ASSIGN_BLOCK_SIZE = 65536
+
+
+def index_path(store_path):
+    """Path of the index of an embedding store: next to the store, as data/build_ann_index.py writes it."""
+    return store_path + '.ivf.npz'
+
+
+def default_lists(rows):
+    """Number of lists for a number of embeddings: about 4 x sqrt(rows), so lists hold about sqrt(rows) / 4 each."""
+    return max(1, min(rows, int(round(4 * math.sqrt(rows)))))
+
+
+def top_k_rows(scores, k):
+    """Return the column indexes of the k highest scores of every row, highest first, ties by lowest index."""
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.lexsort((candidates, -candidate_scores), axis=1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+class IVFIndex:
+    """Inverted file index of the rows of an embedding store.
+
+    The rows of list i are list_rows[list_start[i]:list_start[i + 1]], sorted, so the embeddings of a list are read
+    from the memory-mapped store in file order. The index is tied to the vectorizer version and row count of the
+    store it was built from.
+    """
+
+    def __init__(self, store, centroids, list_start, list_rows):
+        """Create the index.
+
+        Args:
+            store (EmbeddingStore): Store of the embeddings.
+            centroids (np.ndarray): Unit length centroid of each list, lists x dim.
+            list_start (np.ndarray): Start of each list in list_rows, lists + 1 offsets.
+            list_rows (np.ndarray): Store rows grouped by list.
+        """
+        self.store = store
+        self.centroids = centroids
+        self.list_start = list_start
+        self.list_rows = list_rows
+
+    @property
+    def lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, store, lists=None, iterations=KMEANS_ITERATIONS, seed=0):
+        """Cluster the store with spherical k-means (cosine similarity) and assign every row to its nearest centroid.
+
+        Args:
+            store (EmbeddingStore): Store to index.
+            lists (int): Number of lists, default_lists if None.
+            iterations (int): k-means iterations.
+            seed (int): Seed of the training sample, the same seed and store give the same index.
+
+        Returns:
+            IVFIndex: The index.
+        """
+        lists = lists or default_lists(len(store))
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(len(store), min(len(store), lists * TRAINING_ROWS_PER_LIST), replace=False))
+        training = store.vectors(sample)
+        centroids = training[rng.choice(len(training), lists, replace=False)]
+        for _ in range(iterations):
+            assignment = (training @ centroids.T).argmax(axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, training)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # A list that lost all its training rows keeps its centroid
+            centroids = np.where(norms > 0, sums / np.where(norms > 0, norms, 1), centroids)
+
+        assignment = np.concatenate([
+            (store.vectors(slice(start, start + ASSIGN_BLOCK_SIZE)) @ centroids.T).argmax(axis=1)
+            for start in range(0, len(store), ASSIGN_BLOCK_SIZE)]) if len(store) else np.zeros(0, dtype=np.int64)
+        list_rows = np.argsort(assignment, kind='stable')
+        list_start = np.searchsorted(assignment[list_rows], np.arange(lists + 1))
+        return cls(store, centroids.astype(np.float32), list_start, list_rows)
+
+    def save(self, path):
+        """Write the index to an .npz file, stamped with the vectorizer version and row count of the store."""
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, vectorizer=np.array(self.store.vectorizer_version), rows=np.array(len(self.store)),
+                     centroids=self.centroids, list_start=self.list_start, list_rows=self.list_rows)
+        # Swapped in, so the app never reads a half written index
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, store):
+        """Read an index, or return None if it is missing or was built from another version of the store."""
+        try:
+            with np.load(path, allow_pickle=False) as index:
+                if str(index['vectorizer']) != store.vectorizer_version or int(index['rows']) != len(store):
+                    return None
+                return cls(store, index['centroids'], index['list_start'], index['list_rows'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def probe(self, queries, nprobe=DEFAULT_NPROBE):
+        """Return the nprobe lists nearest to each query, queries x nprobe."""
+        return top_k_rows(np.asarray(queries, dtype=np.float32) @ self.centroids.T, nprobe)
+
+    def candidates(self, lists):
+        """Return the sorted store rows of the given lists."""
+        return np.sort(np.concatenate([self.list_rows[self.list_start[i]:self.list_start[i + 1]] for i in lists]))
+
+    def search(self, query, k, nprobe=DEFAULT_NPROBE, allowed=None, exact=False):
+        """Find the k rows most similar to a query.
+
+        Args:
+            query (np.ndarray): Unit length query embedding.
+            k (int): Number of results.
+            nprobe (int): Lists to search, the recall/latency knob; all lists is an exact search.
+            allowed (np.ndarray): Boolean mask over the store rows, only these rows are returned if given.
+            exact (bool): Score every (allowed) row instead, to validate the approximate results.
+
+        Returns:
+            tuple: (store rows, similarities), most similar first. When the probed lists hold fewer than k allowed
+                rows (a narrow filter), the allowed rows are searched exactly, so a filter never loses results.
+        """
+        if allowed is not None:
+            # A filter keeps only its share of the rows of each list, so as many more lists are probed to score as
+            # many candidates, and find as many of the exact neighbours, as without it
+            share = np.count_nonzero(allowed) / max(len(allowed), 1)
+            nprobe = math.ceil(nprobe / share) if share > 0 else self.lists
+        if exact or nprobe >= self.lists:
+            rows = None if allowed is None else np.flatnonzero(allowed)
+            return self.store.search(query, k, rows)
+        rows = self.candidates(self.probe(query[None, :], nprobe)[0])
+        if allowed is not None:
+            rows = rows[allowed[rows]]
+            if len(rows) < k:
+                return self.store.search(query, k, np.flatnonzero(allowed))
+        return self.store.search(query, k, rows)
+
+    def search_batch(self, queries, k, nprobe=DEFAULT_NPROBE):
+        """Find the k rows most similar to each of a batch of queries.
+
+        The queries are grouped by the lists they probe, so each list is read and scored once per batch with one
+        matrix multiply against all the queries probing it.
+
+        Args:
+            queries (np.ndarray): Unit length query embeddings, queries x dim.
+            k (int): Number of results per query.
+            nprobe (int): Lists to search per query.
+
+        Returns:
+            tuple: (store rows, similarities), both queries x k, most similar first. When the probed lists of a
+                query hold fewer than k rows, the query is searched exactly, as in search, so rows are -1 only where
+                the store itself holds fewer than k rows.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        probes = self.probe(queries, nprobe)
+        probing = np.argsort(probes.ravel(), kind='stable')
+        probe_start = np.searchsorted(probes.ravel()[probing], np.arange(self.lists + 1))
+        for i in np.flatnonzero(np.diff(probe_start)):
+            members = probing[probe_start[i]:probe_start[i + 1]] // probes.shape[1]
+            rows = self.list_rows[self.list_start[i]:self.list_start[i + 1]]
+            if not len(rows):
+                continue
+            scores = np.concatenate([best_scores[members], queries[members] @ self.store.vectors(rows).T], axis=1)
+            all_rows = np.concatenate([best_rows[members], np.broadcast_to(rows, (len(members), len(rows)))], axis=1)
+            keep = top_k_rows(scores, k)
+            best_scores[members] = np.take_along_axis(scores, keep, axis=1)
+            best_rows[members] = np.take_along_axis(all_rows, keep, axis=1)
+        short = np.flatnonzero(np.count_nonzero(best_rows < 0, axis=1) > max(k - len(self.store), 0))
+        if len(short):
+            scores = self.store.similarities(queries[short]).T
+            keep = top_k_rows(scores, k)
+            best_rows[short, :keep.shape[1]] = keep
+            best_scores[short, :keep.shape[1]] = np.take_along_axis(scores, keep, axis=1)
+        # Ties between lists are broken by row, as in the exact search
+        order = np.lexsort((np.where(best_rows < 0, np.iinfo(np.int64).max, best_rows), -best_scores), axis=1)
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
@@ -0,0 +1,84 @@
+import streamlit as st
+import sqlite3
+import queue
+import pathlib
+from contextlib import contextmanager
+
+# Shared data access for all pages: one process-wide pool of read-only connections to app_data.db
+DATABASE_PATH = 'data/app_data.db'
+
+
+class ReadOnlyConnectionPool:
+    """A thread-safe pool of read-only SQLite connections.
+
+    A connection is lent to one thread at a time (the script run of one session) and returned afterwards, so
+    connection setup and the warm page cache are shared between reruns and users instead of paid on every
+    interaction.
+    """
+
+    def __init__(self, database_path, max_idle=8, mmap_size=256 * 1024 * 1024, cache_size_kib=32 * 1024):
+        self.database_path = database_path
+        self.max_idle = max_idle
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        # Last in, first out: the most recently used connection has the warmest cache
+        self._idle = queue.LifoQueue()
+
+    def _connect(self):
+        """Open a new read-only connection with the tuned PRAGMAs."""
+        uri = pathlib.Path(self.database_path).resolve().as_uri() + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON;")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)};")
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kib)};")
+        conn.execute("PRAGMA temp_store = MEMORY;")
+        return conn
+
+    def acquire(self):
+        """Borrow a connection, opening a new one if none is idle."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        """Give a borrowed connection back to the pool, or close it if the pool is full."""
+        if conn is None:
+            return
+        if self._idle.qsize() < self.max_idle:
+            self._idle.put(conn)
+        else:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with-block."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+
+@st.cache_resource
+def get_connection_pool():
+    """Return the process-wide connection pool, created once per Streamlit server process."""
+    return ReadOnlyConnectionPool(DATABASE_PATH)
+
+
+def get_connection():
+    """Borrow a read-only connection from the shared pool.
+
+    Returns:
+        sqlite3.Connection: The connection, or None if the database could not be opened.
+    """
+    try:
+        return get_connection_pool().acquire()
+    except sqlite3.Error as e:
+        st.error(f"Error connecting to database: {e}")
+        return None
+
+
+def release_connection(conn):
+    """Return a connection borrowed with get_connection to the shared pool."""
+    get_connection_pool().release(conn)
@@ -1,18 +1,16 @@
 import streamlit as st
-import pandas as pd
-from sqlalchemy import create_engine
+from util.dataset_stats import get_dataset_stats, sample_frame, distribution_series, missing_stats_error
 
 # DATASET1: arXiv papers from "papers" table in the database
 st.subheader("Dataset 1: The arXiv database with selected categories")
 
 
 def main():
-    # Create a database connection
-    engine = create_engine('sqlite:///data/app_data.db')
-
-    # Load the dataset from the database
-    query = "SELECT * FROM papers"
-    df = pd.read_sql_query(query, engine)
+    # Everything shown is read from the statistics precomputed when the database was built
+    stats = get_dataset_stats('papers')
+    if stats is None:
+        missing_stats_error('papers')
+        return
 
     st.markdown("""
     1. **Description**:
@@ -27,7 +25,7 @@ def main():
     """)
 
     # Print the names of the columns and the total papers in the dataset
-    st.write(f"**Total papers in the dataset**: {len(df)}")
+    st.write(f"**Total papers in the dataset**: {stats['row_count']}")
 
     st.write("#### Name of the List")
     st.markdown(":blue_book: **Database Table**: papers")
@@ -39,7 +37,7 @@ def main():
 
         with col1:
             # Print the shape of the dataset (number of rows and columns)
-            st.write("Shape of the dataset (row, col):", df.shape)
+            st.write("Shape of the dataset (row, col):", (stats['row_count'], len(stats['columns'])))
 
             # Print the names of the columns
             st.write("##### Column Names:")
@@ -54,8 +52,8 @@ def main():
             st.write(column_descriptions)
 
             # Analyzing the data for presentation
-            category_count = df['categories'].nunique()
-            category_distribution = df['categories'].value_counts().sort_index()
+            category_count = stats['distinct:categories']
+            category_distribution = distribution_series(stats, 'categories')
 
         with col2:
             st.write(f"##### Number of Categories: {category_count}")
@@ -78,7 +76,7 @@ def main():
             category_distribution_df = category_distribution_df.set_index('Papers')  # Set 'Papers' as index
 
     st.subheader("Dataframe: the arXiv dataset")
-    st.dataframe(df.head(10))
+    st.dataframe(sample_frame(stats))
 
 
 if __name__ == '__main__':
@@ -1,29 +1,20 @@
 import streamlit as st
-import pandas as pd
-from sqlalchemy import create_engine
+from util.dataset_stats import get_dataset_stats, sample_frame, distribution_series, missing_stats_error
 
 # DATASET2: AI topics list from "topics" table in the database
 st.subheader("Dataset 2: AI Topics")
 
 
-@st.cache_resource
-def load_data():
-    # Create a database connection
-    engine = create_engine('sqlite:///data/app_data.db')  # Adjust the path if necessary
-
-    # Load the dataset from the database
-    query = "SELECT * FROM topics"
-    data = pd.read_sql_query(query, engine)
-    return data
-
-
 def main():
-    # Call the load_data function
-    data = load_data()
+    # Everything shown is read from the statistics precomputed when the database was built
+    stats = get_dataset_stats('topics')
+    if stats is None:
+        missing_stats_error('topics')
+        return
 
     # Analyzing the data for presentation
-    levels_count = data['level'].nunique()
-    levels_distribution = data['level'].value_counts().sort_index()
+    levels_count = stats['distinct:level']
+    levels_distribution = distribution_series(stats, 'level')
 
     # Streamlit page setup
     # Create a container for structured layout
@@ -35,11 +26,9 @@ def main():
             st.markdown(":blue_book: **Database Table**: topics")
             st.write("#### Column Names and Descriptions")
             st.markdown("""
-            - **Unnamed: 0**: Numerical index.
+            - **id**: Numerical index.
             - **s**: Unique identifier/URL from DBpedia.
             - **prefLabel**: Preferred name of the topic.
-            - **wdEntity**: Corresponding Wikidata entity URL.
-            - **wdType**: Type of Wikidata entity.
             - **broader**: Broader topic category.
             - **altLabel**: Alternative labels/names.
             - **description**: Brief description of the topic.
@@ -52,7 +41,7 @@ def main():
             st.bar_chart(levels_distribution)
 
     st.subheader("AI Topics List with Levels:")
-    st.dataframe(data.head(10))
+    st.dataframe(sample_frame(stats))
 
 
 if __name__ == "__main__":
@@ -1,37 +1,28 @@
 import streamlit as st
-import pandas as pd
-from sqlalchemy import create_engine
+from util.dataset_stats import get_dataset_stats, sample_frame, missing_stats_error
 
 # DATASET3: The result of our work after tagging arXiv papers with AI topics
 # The "tagged_papers" dataset is fetched from "tagged_papers" table in the database
 st.subheader("Dataset 3: Tagged Papers")
 
 
-def load_data():
-    # Create a database connection
-    engine = create_engine('sqlite:///data/app_data.db')
-
-    # Load the dataset from the database
-    query = "SELECT * FROM tagged_papers"
-    data = pd.read_sql_query(query, engine)
-    return data
-
-
 # MAIN
 def main():
-    # Call the load_data function
-    df = load_data()
-    df.shape
+    # Everything shown is read from the statistics precomputed when the database was built
+    stats = get_dataset_stats('tagged_papers')
+    if stats is None:
+        missing_stats_error('tagged_papers')
+        return
 
     st.markdown("""
     #### Name of the List: 
     :blue_book: **Database Table**: tagged_papers """, unsafe_allow_html=True)
 
     # Print the shape of the dataset (number of rows and columns)
-    st.write("Shape of the dataset (row, col):", df.shape)
+    st.write("Shape of the dataset (row, col):", (stats['row_count'], len(stats['columns'])))
 
     # Count and print the number of unique topics
-    st.write("Number of unique titles:", df['title'].nunique())
+    st.write("Number of unique titles:", stats['distinct:title'])
 
     # Organizing in containers and columns
     with st.container():
@@ -58,7 +49,7 @@ def main():
 
     # Display the dataframe on the page
     st.write("Sample Data from CSV File:")
-    st.dataframe(df.head())
+    st.dataframe(sample_frame(stats).head())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,49 @@
+import streamlit as st
+import sqlite3
+import json
+import pandas as pd
+from util.database import get_connection, release_connection
+from util.query_cache import cached_query
+
+# Statistics of the Datasets page, precomputed into the dataset_stats table by data/db_manager.py
+
+
+# Results are cached per dataset and data version, the statistics only change when the database is rebuilt
+@cached_query(lambda dataset: (dataset,))
+def get_dataset_stats(dataset):
+    """Read the precomputed statistics of a table.
+
+    Args:
+        dataset (str): Name of the table.
+
+    Returns:
+        dict: {stat: value} with row_count, columns, sample and the distinct:, distribution: and date_range:
+            entries of the table, or None if the statistics haven't been computed.
+    """
+    conn = get_connection()
+    if conn is None:
+        return None
+    try:
+        rows = conn.execute("SELECT stat, value FROM dataset_stats WHERE dataset = ?", (dataset,)).fetchall()
+    except sqlite3.Error:
+        rows = []
+    finally:
+        release_connection(conn)
+    return {stat: json.loads(value) for stat, value in rows} or None
+
+
+def sample_frame(stats):
+    """Return the stored sample rows of a table as a DataFrame."""
+    return pd.DataFrame(stats['sample'], columns=stats['columns'])
+
+
+def distribution_series(stats, column):
+    """Return the stored distribution of a column as a Series of counts indexed by value."""
+    values = stats[f'distribution:{column}']
+    return pd.Series([count for _, count in values], index=[value for value, _ in values], name='count')
+
+
+def missing_stats_error(dataset):
+    """Tell the user how to compute statistics that are missing from the database."""
+    st.error(f"No statistics found for the {dataset} table. "
+             f"Run `python db_manager.py` in the data folder to compute them.")
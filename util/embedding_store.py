@@ -0,0 +1,237 @@
+import json
+import os
+import numpy as np
+from util.text_vectorizer import HashingVectorizer
+
+# Embeddings on disk in one file, memory-mapped read-only so every process shares the same pages of the page cache
+
+# The file starts with MAGIC and a JSON header padded to HEADER_SIZE bytes, followed by the sections it points to:
+# the embedding matrix (rows x dim), the per-row scales of int8 matrices, the row ids and the vectorizer settings
+MAGIC = b'EMBSTORE'
+FORMAT_VERSION = 1
+HEADER_SIZE = 4096
+
+# Storage types of the matrix: float16 halves the size of float32, int8 quarters it with one scale per row
+DTYPES = {'float16': np.float16, 'int8': np.int8}
+
+# Rows converted to float32 and scored per matrix multiply
+SEARCH_BLOCK_SIZE = 65536
+
+
+def quantize_int8(vectors):
+    """Quantize float vectors to int8 with one symmetric scale per row.
+
+    Returns:
+        tuple: (int8 matrix, float32 scales), vectors ~= matrix * scales[:, None].
+    """
+    scales = np.abs(vectors).max(axis=1) / 127
+    matrix = np.round(vectors / np.where(scales > 0, scales, 1)[:, None]).astype(np.int8)
+    return matrix, scales.astype(np.float32)
+
+
+class EmbeddingStoreWriter:
+    """Stream embeddings into a new store file, batch by batch, in ascending id order.
+
+    The file is written next to its final path and swapped in by close, so readers never see half a store. Use it
+    as a context manager to remove the partial file when writing fails.
+    """
+
+    def __init__(self, path, vectorizer, dtype='float16'):
+        """Start a store.
+
+        Args:
+            path (str): Path of the store file.
+            vectorizer (HashingVectorizer): Vectorizer of the embeddings, its version is stored in the header.
+            dtype (str): One of DTYPES.
+        """
+        self.path = path
+        self.vectorizer = vectorizer
+        self.dtype = dtype
+        self.rows = 0
+        self._ids, self._scales = [], []
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file = open(path + '.tmp', 'wb')
+        self._file.write(b'\0' * HEADER_SIZE)
+
+    def add(self, ids, vectors):
+        """Append a batch of embeddings.
+
+        Args:
+            ids (array-like): Row ids (papers.id or topics.id), higher than all ids added before.
+            vectors (np.ndarray): Embeddings, len(ids) x vectorizer.dim.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dtype == 'int8':
+            matrix, scales = quantize_int8(vectors)
+            self._scales.append(scales)
+        else:
+            matrix = vectors.astype(DTYPES[self.dtype])
+        self._file.write(np.ascontiguousarray(matrix).tobytes())
+        self._ids.append(np.asarray(ids, dtype=np.int64))
+        self.rows += len(vectors)
+
+    def _write_section(self, data):
+        """Append a section at the next 64 byte boundary and return its offset."""
+        offset = -(-self._file.tell() // 64) * 64
+        self._file.write(b'\0' * (offset - self._file.tell()))
+        self._file.write(data)
+        return offset
+
+    def close(self):
+        """Write the sections after the matrix and the header, and swap the file in."""
+        ids = np.concatenate(self._ids) if self._ids else np.zeros(0, dtype=np.int64)
+        if np.any(np.diff(ids) <= 0):
+            self.abort()
+            raise ValueError("Embedding store ids must be added in ascending order without duplicates.")
+        offsets = {'matrix': HEADER_SIZE}
+        if self.dtype == 'int8':
+            offsets['scales'] = self._write_section(np.concatenate(self._scales or [np.zeros(0, np.float32)])
+                                                    .tobytes())
+        offsets['ids'] = self._write_section(ids.tobytes())
+        settings = json.dumps(self.vectorizer.to_dict()).encode()
+        offsets['vectorizer_settings'] = self._write_section(settings)
+
+        header = json.dumps({
+            'format': FORMAT_VERSION,
+            'dtype': self.dtype,
+            'rows': self.rows,
+            'dim': self.vectorizer.dim,
+            'vectorizer': self.vectorizer.version,
+            'offsets': offsets,
+            'vectorizer_settings_size': len(settings),
+        }).encode()
+        self._file.seek(0)
+        self._file.write(MAGIC + header)
+        self._file.close()
+        os.replace(self.path + '.tmp', self.path)
+
+    def abort(self):
+        """Drop the partial file."""
+        self._file.close()
+        os.remove(self.path + '.tmp')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif not self._file.closed:
+            self.abort()
+
+
+class EmbeddingStore:
+    """Read-only view of a store file, memory-mapped so opening it only reads the header.
+
+    Rows are in ascending id order, so the row of an id is a binary search in ids.
+    """
+
+    def __init__(self, path):
+        """Open a store.
+
+        Args:
+            path (str): Path of the store file.
+
+        Raises:
+            ValueError: If the file is not an embedding store of a supported format.
+        """
+        with open(path, 'rb') as f:
+            head = f.read(HEADER_SIZE)
+        if not head.startswith(MAGIC):
+            raise ValueError(f"{path} is not an embedding store.")
+        self.header = json.loads(head[len(MAGIC):].rstrip(b'\0'))
+        if self.header['format'] != FORMAT_VERSION:
+            raise ValueError(f"{path} has unsupported format {self.header['format']}.")
+        self.path = path
+        rows, dim, offsets = self.header['rows'], self.header['dim'], self.header['offsets']
+        self.matrix = self._map(DTYPES[self.header['dtype']], offsets['matrix'], (rows, dim))
+        self.scales = self._map(np.float32, offsets['scales'], (rows,)) if 'scales' in offsets else None
+        self.ids = self._map(np.int64, offsets['ids'], (rows,))
+
+    def _map(self, dtype, offset, shape):
+        # np.memmap can't map zero bytes
+        if not np.prod(shape):
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self.path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+    def __len__(self):
+        return self.header['rows']
+
+    @property
+    def dim(self):
+        return self.header['dim']
+
+    @property
+    def vectorizer_version(self):
+        return self.header['vectorizer']
+
+    def vectorizer(self):
+        """Recreate the vectorizer the embeddings were made with, to embed queries the same way."""
+        with open(self.path, 'rb') as f:
+            f.seek(self.header['offsets']['vectorizer_settings'])
+            return HashingVectorizer.from_dict(json.loads(f.read(self.header['vectorizer_settings_size'])))
+
+    def rows_of(self, ids):
+        """Return the rows of the given ids, -1 for ids that are not in the store."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self):
+            return np.full(len(ids), -1, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.ids, ids), len(self) - 1)
+        return np.where(self.ids[rows] == ids, rows, -1)
+
+    def vectors(self, rows):
+        """Return the embeddings of the given rows as float32."""
+        vectors = np.asarray(self.matrix[rows], dtype=np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[rows][:, None]
+        return vectors
+
+    def similarities(self, queries, rows=None, block_size=SEARCH_BLOCK_SIZE):
+        """Score queries against stored embeddings with an exact matrix multiply, block by block.
+
+        Args:
+            queries (np.ndarray): Unit length query embeddings, queries x dim.
+            rows (np.ndarray): Rows to score, all rows if None.
+            block_size (int): Rows converted to float32 per matrix multiply.
+
+        Returns:
+            np.ndarray: Cosine similarities, rows x queries.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        count = len(self) if rows is None else len(rows)
+        scores = np.empty((count, len(queries)), dtype=np.float32)
+        for start in range(0, count, block_size):
+            block = slice(start, start + block_size) if rows is None else rows[start:start + block_size]
+            scores[start:start + block_size] = self.vectors(block) @ queries.T
+        return scores
+
+    def search(self, query, k, rows=None):
+        """Find the k stored embeddings most similar to a query, by exact search.
+
+        Args:
+            query (np.ndarray): Unit length query embedding.
+            k (int): Number of results.
+            rows (np.ndarray): Rows to search, all rows if None.
+
+        Returns:
+            tuple: (rows, similarities), most similar first.
+        """
+        scores = self.similarities(query[None, :], rows)[:, 0]
+        if k >= len(scores):
+            candidates = np.arange(len(scores))
+        else:
+            candidates = np.argpartition(-scores, k - 1)[:k] if k > 0 else np.zeros(0, dtype=np.int64)
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+        found = np.arange(len(self))[candidates] if rows is None else np.asarray(rows)[candidates]
+        return found, scores[candidates]
+
+
+def open_embedding_store(path, vectorizer_version=None):
+    """Open a store, or return None if it is missing, unreadable, or made with another vectorizer version."""
+    try:
+        store = EmbeddingStore(path)
+    except (OSError, ValueError, KeyError):
+        return None
+    if vectorizer_version is not None and store.vectorizer_version != vectorizer_version:
+        return None
+    return store
@@ -1,29 +1,39 @@
 import streamlit as st
+import json
+import os
+import numpy as np
 import pandas as pd
 import plotly.express as px
-import sqlite3
+import plotly.graph_objects as go
+import plotly.io as pio
+from util.analytics_core import get_topic_month_matrix
+from util.database import get_connection, release_connection
+from util.query_cache import get_database_version, get_topics_version
+from util.topic_hierarchy import TopicHierarchy, ROOT_LABEL
 
+# Subtree charts: levels shown below the center topic by default, and the most nodes sent to the browser
+SUBTREE_MAX_DEPTH = 3
+SUBTREE_NODE_BUDGET = 400
 
-# Database connection
-def create_connection():
-    """Create and return a database connection."""
-    try:
-        conn = sqlite3.connect('data/app_data.db')
-        return conn
-    except sqlite3.Error as e:
-        st.error(f"Error connecting to database: {e}")
-        return None
+# Main tree prebuilt by data/build_sunburst_artifact.py, used while it matches the version of the topics table
+ARTIFACT_PATH = 'data/artifacts/main_sunburst.json'
+
+# Growth rate of a topic: its papers in the last GROWTH_WINDOW_MONTHS up to the latest paper against the window before
+GROWTH_WINDOW_MONTHS = 12
 
 
-# Fetching data from the "topics" table in the database
-@st.cache_data
-def fetch_topics():
+# Fetching data from the "topics" table in the database, only the current version of the table is kept
+@st.cache_data(max_entries=1)
+def fetch_topics(topics_version=None):
     """Fetch topics from the database and return as DataFrame.
 
+    Args:
+        topics_version (str): Version of the topics table, only used as cache key so a changed table is refetched.
+
     Returns:
         pd.DataFrame: DataFrame containing the topics data.
     """
-    conn = create_connection()
+    conn = get_connection()
     if conn is None:
         return pd.DataFrame()  # Return an empty DataFrame on connection error
 
@@ -34,49 +44,204 @@ def fetch_topics():
         st.error(f"Error fetching data from database: {e}")
         return pd.DataFrame()  # Return an empty DataFrame on query error
     finally:
-        conn.close()
+        release_connection(conn)
     return df
 
 
+def topic_paper_counts(database_version=None):
+    """Count the tagged papers of every topic, in total and in the last two growth windows.
+
+    The counts are summed from the shared topics x months matrix of util/analytics_core.py, the growth windows are
+    the last GROWTH_WINDOW_MONTHS months with papers and the months before them.
+
+    Args:
+        database_version (str): Version of the data.
+
+    Returns:
+        tuple: (topic labels, papers x {'papers', 'recent', 'previous'} array), None if there is no data.
+    """
+    matrix = get_topic_month_matrix(database_version)
+    if matrix is None:
+        return None
+    direct = matrix.counts()
+    months = direct.shape[1]
+    counts = np.stack([
+        direct.sum(axis=1, dtype=np.int64),
+        direct[:, max(months - GROWTH_WINDOW_MONTHS, 0):].sum(axis=1, dtype=np.int64),
+        direct[:, max(months - 2 * GROWTH_WINDOW_MONTHS, 0):max(months - GROWTH_WINDOW_MONTHS, 0)].sum(
+            axis=1, dtype=np.int64),
+    ], axis=1)
+    return matrix.topics, counts
+
+
+def topic_volume_measures(hierarchy, counts):
+    """Papers per topic including all its descendants, with the growth windows, from one bottom-up aggregation.
+
+    A paper tagged with several topics of a subtree counts once per topic, so every topic is at least the sum of
+    its subtopics, as the sunburst needs for sizing by value.
+
+    Args:
+        hierarchy (TopicHierarchy): Parent index of the topic tree.
+        counts (tuple): Paper counts per topic label from topic_paper_counts.
+
+    Returns:
+        dict: {'papers', 'recent', 'previous': array of subtree totals per node}, see TopicHierarchy.subtree.
+    """
+    columns = ['papers', 'recent', 'previous']
+    direct = np.zeros((len(hierarchy), len(columns)), dtype=np.int64)
+    if counts is not None:
+        labels, values = counts
+        nodes = hierarchy.label_positions(labels)
+        found = nodes >= 0
+        direct[nodes[found]] = values[found]
+    totals = hierarchy.aggregate(direct)
+    return {column: totals[:, i] for i, column in enumerate(columns)}
+
+
+def add_growth(df):
+    """Add the growth rate column from the recent and previous windows (relative change, new topics count from 1)."""
+    df['growth'] = (df['recent'] - df['previous']) / df['previous'].clip(lower=1)
+    return df
+
+
+# The parent index is built once per version of the topics table and shared by all sessions, only the current
+# version is kept
+@st.cache_resource(max_entries=1)
+def get_topic_hierarchy(topics_version=None):
+    """Build the parent index of the topic tree.
+
+    Args:
+        topics_version (str): Version of the topics table.
+
+    Returns:
+        TopicHierarchy: The index, or None if the topics could not be fetched.
+    """
+    df = fetch_topics(topics_version)
+    if df.empty:
+        return None
+    return TopicHierarchy(df)
+
+
 def prepare_data(df):
     """Prepare data for the sunburst chart.
 
+    The topic list has no root, so the Innovation root node is added above the top-level topics. Topics are
+    identified by their s URI, since labels are not unique.
+
     Args:
         df (pd.DataFrame): DataFrame containing the original topics data.
 
     Returns:
-        pd.DataFrame: DataFrame prepared for the sunburst chart visualization.
+        pd.DataFrame: DataFrame prepared for the sunburst chart visualization (id, topic and parent id).
     """
     try:
-        # Adding the root node manually because our dataset (AI Topic List) didn't have a root-node,
-        # so it doesn't exist in the dataset
-        ai_root = pd.DataFrame([{
-            's': 'AI_Root',
-            'prefLabel': 'Innovation',
-            'broader': pd.NA,  # Set the broader field to NA for the root
-            'level': 0  # Root level 0 (the center of the sunburst)
-        }])
-        # Concatenate the root node with the existing DataFrame
-        df = pd.concat([ai_root, df], ignore_index=True)
-        # Update the 'broader' field of top-level nodes to point to the AI root node
-        df.loc[df['level'] == 1, 'broader'] = 'AI_Root'
-        # Rename 'prefLabel' to 'topic'
-        df = df.rename(columns={'prefLabel': 'topic'})
-        # Map broader to topic to create parent column
-        broader_map = df.set_index('s')['topic'].to_dict()
-        df['parent'] = df['broader'].map(broader_map).fillna('')
-        return df[['topic', 'parent']]
+        return TopicHierarchy(df).subtree(ROOT_LABEL)[['id', 'topic', 'parent']]
     except Exception as e:
         st.error(f"Error preparing data: {e}")
         return pd.DataFrame()  # Return an empty DataFrame on preparation error
 
 
+def build_main_tree(df):
+    """Prepare the hierarchy of the main tree and serialize its figure.
+
+    Args:
+        df (pd.DataFrame): DataFrame containing the original topics data.
+
+    Returns:
+        tuple: (prepared DataFrame, figure JSON), or (empty DataFrame, None) if either step failed.
+    """
+    df_prepared = prepare_data(df)
+    if df_prepared.empty:
+        return df_prepared, None
+    fig = create_sunburst_chart(df_prepared)
+    if fig is None:
+        return df_prepared, None
+    return df_prepared, pio.to_json(fig, validate=False)
+
+
+def write_main_tree_artifact(path, topics_version, df_prepared, figure_json):
+    """Write the prebuilt main tree to a JSON file, stamped with the version of the topics table it was built from.
+
+    Args:
+        path (str): Path of the artifact.
+        topics_version (str): Version of the topics table.
+        df_prepared (pd.DataFrame): Prepared hierarchy.
+        figure_json (str): Serialized figure.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    artifact = {
+        'topics_version': topics_version,
+        'hierarchy': df_prepared.to_dict(orient='list'),
+        'figure': figure_json,
+    }
+    # Write to a temporary file and swap it in, so the app never reads a half written artifact
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(artifact, f)
+    os.replace(path + '.tmp', path)
+
+
+def read_main_tree_artifact(path, topics_version):
+    """Read the prebuilt main tree if it was built from the given version of the topics table.
+
+    Returns:
+        tuple: (prepared DataFrame, figure JSON), or None if there is no artifact for this version.
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            artifact = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if topics_version is None or artifact.get('topics_version') != topics_version:
+        return None
+    return pd.DataFrame(artifact['hierarchy']), artifact['figure']
+
+
+# The main tree is prepared and serialized once per version of the topics table, only the current version is kept
+@st.cache_data(max_entries=1)
+def load_main_tree(topics_version):
+    """Return the prepared hierarchy and the figure JSON of the main tree.
+
+    The prebuilt artifact is used when it matches the topics table, otherwise the tree is built from the database.
+
+    Args:
+        topics_version (str): Version of the topics table.
+
+    Returns:
+        tuple: (prepared DataFrame, figure JSON); the figure JSON is None if there is no data.
+    """
+    prebuilt = read_main_tree_artifact(ARTIFACT_PATH, topics_version)
+    if prebuilt is not None:
+        return prebuilt
+
+    df = fetch_topics(topics_version)
+    if df.empty:
+        return pd.DataFrame(), None
+    return build_main_tree(df)
+
+
+# The volume view of the main tree is built once per version of the data, only the current version is kept
+@st.cache_data(max_entries=1)
+def load_main_tree_volume(topics_version, database_version):
+    """Return the figure JSON of the main tree sized by papers and colored by growth, None if there is no data."""
+    hierarchy = get_topic_hierarchy(topics_version)
+    if hierarchy is None:
+        return None
+    measures = topic_volume_measures(hierarchy, topic_paper_counts(database_version))
+    df = add_growth(hierarchy.subtree(ROOT_LABEL, measures=measures))
+    fig = create_sunburst_chart(df, values='papers', color='growth')
+    return pio.to_json(fig, validate=False) if fig else None
+
+
 # MAIN SUNBURST CHART - The Topic Tree
-def create_sunburst_chart(df):
+def create_sunburst_chart(df, values=None, color=None):
     """Create and return a sunburst chart.
 
     Args:
-        df (pd.DataFrame): DataFrame containing the prepared data.
+        df (pd.DataFrame): DataFrame containing the prepared data, with an optional id column when topic labels
+            are not unique (the parent column then holds ids).
+        values (str): Column sizing the segments, holding the total of each node including its descendants.
+            Every topic gets the same weight if None.
+        color (str): Column of growth rates coloring the segments, red for shrinking and green for growing topics.
 
     Returns:
         plotly.graph_objects.Figure: Sunburst chart figure.
@@ -84,8 +249,15 @@ def create_sunburst_chart(df):
     try:
         fig = px.sunburst(
             df,
+            ids='id' if 'id' in df.columns else None,
             names='topic',
             parents='parent',
+            values=values,
+            branchvalues='total' if values else None,
+            color=color,
+            color_continuous_scale='RdYlGn' if color else None,
+            range_color=[-1, 1] if color else None,
+            hover_data=[column for column in ['recent', 'previous'] if color and column in df.columns] or None,
             width=800,
             height=800
         )
@@ -103,25 +275,61 @@ def main():
     st.write("Note: This chart fetches data from the topics-table from our database. "
              "The topics-table is created based on the CSV file (AI Topic List).")
 
-    # Fetch the dataset from the database
-    df = fetch_topics()
+    by_volume = st.toggle('Size by number of papers and color by growth', key='main_tree_volume',
+                          help=f'Growth compares the papers of the last {GROWTH_WINDOW_MONTHS} months with the '
+                               f'{GROWTH_WINDOW_MONTHS} months before')
 
-    if df.empty:
+    # Fetch the prepared tree and its figure, built once per version of the topics table (and of the data for the
+    # volume view)
+    if by_volume:
+        figure_json = load_main_tree_volume(get_topics_version(), get_database_version())
+    else:
+        df_prepared, figure_json = load_main_tree(get_topics_version())
+
+    if figure_json is None:
         st.warning("No data available to display.")
         return
 
-    # Prepare the data for visualization
-    df_prepared = prepare_data(df)
+    # The figure was validated when it was built, so it is loaded without validating it again
+    fig = go.Figure(json.loads(figure_json), _validate=False)
 
-    if df_prepared.empty:
-        st.warning("Data preparation failed.")
+    # Display the chart
+    st.plotly_chart(fig, use_container_width=True)
+
+
+# SUBTREE SUNBURST CHARTS - One topic and its subtopics
+def subtree_main(root_topic):
+    """Display the sunburst chart of the subtree of one topic.
+
+    Only the chosen number of levels is extracted, and above SUBTREE_NODE_BUDGET nodes the smallest branches are
+    collapsed into "Other" nodes, so the chart stays quick to build and to send whatever the size of the subtree.
+
+    Args:
+        root_topic (str): Label of the topic at the center of the chart.
+    """
+    hierarchy = get_topic_hierarchy(get_topics_version())
+    if hierarchy is None:
+        st.warning("No data available to display.")
         return
 
-    # Create the sunburst chart
-    fig = create_sunburst_chart(df_prepared)
+    max_depth = st.slider('Levels below the topic', min_value=1, max_value=8, value=SUBTREE_MAX_DEPTH,
+                          key=f'subtree_depth_{root_topic}')
+    by_volume = st.toggle('Size by number of papers and color by growth', key=f'subtree_volume_{root_topic}')
+
+    measures = None
+    if by_volume:
+        measures = topic_volume_measures(hierarchy, topic_paper_counts(get_database_version()))
+    df_subtree = hierarchy.subtree(root_topic, max_depth=max_depth, node_budget=SUBTREE_NODE_BUDGET,
+                                   measures=measures)
+    if df_subtree is None:
+        st.info(f"The topic '{root_topic}' is not in the topic list.")
+        return
 
+    if by_volume:
+        fig = create_sunburst_chart(add_growth(df_subtree), values='papers', color='growth')
+    else:
+        fig = create_sunburst_chart(df_subtree)
     if fig:
-        # Display the chart
         st.plotly_chart(fig, use_container_width=True)
 
 
@@ -0,0 +1,136 @@
+import streamlit as st
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from util.database import get_connection, release_connection
+
+# Result cache shared by the query functions of the analytics pages (Topic Search, Paper Search, Top Trends)
+
+_MISSING = object()
+
+
+class QueryResultCache:
+    """A thread-safe LRU cache with a time-to-live for query results.
+
+    The keys include the data version stamped by the ingest steps (db_meta.db_version), so results cached before a
+    reload or incremental update are never served; they simply age out of the LRU order.
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expiry time, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or _MISSING if it is absent or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entries above max_entries."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return the hit/miss counters and the fill level, for sizing the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+            }
+
+
+@st.cache_resource
+def get_query_cache():
+    """Return the process-wide query result cache."""
+    return QueryResultCache()
+
+
+def show_query_cache_stats():
+    """Show the hit/miss counters of the shared result cache in a collapsed sidebar expander."""
+    stats = get_query_cache().stats()
+    with st.sidebar.expander("Query cache"):
+        st.caption(f"{stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+                   f"{stats['entries']} of {stats['max_entries']} entries")
+
+
+def get_database_version():
+    """Read the data version stamp written by the ingest steps (None for a database built without one)."""
+    conn = get_connection()
+    if conn is None:
+        return None
+    try:
+        row = conn.execute("SELECT value FROM db_meta WHERE key = 'db_version'").fetchone()
+    except sqlite3.Error:
+        row = None
+    finally:
+        release_connection(conn)
+    return row[0] if row else None
+
+
+def get_topics_version():
+    """Read the version stamp of the topics table, falling back to the data version for older databases."""
+    conn = get_connection()
+    if conn is None:
+        return None
+    try:
+        row = conn.execute("SELECT value FROM db_meta WHERE key IN ('topics_version', 'db_version') "
+                           "ORDER BY key = 'topics_version' DESC LIMIT 1").fetchone()
+    except sqlite3.Error:
+        row = None
+    finally:
+        release_connection(conn)
+    return row[0] if row else None
+
+
+def normalize_topics(topics):
+    """Order-independent key for a selection of topics."""
+    return tuple(sorted(set(topics)))
+
+
+def cached_query(make_key):
+    """Decorator caching a query function in the shared result cache.
+
+    Args:
+        make_key (callable): Called with the arguments of the query function, returns the normalized parameters
+            (e.g. sorted topics, month-aligned dates) that determine the result.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args):
+            cache = get_query_cache()
+            key = (func.__name__, get_database_version()) + tuple(make_key(*args))
+            value = cache.get(key)
+            if value is _MISSING:
+                value = func(*args)
+                cache.put(key, value)
+            return value
+        return wrapper
+    return decorator
@@ -0,0 +1,141 @@
+import streamlit as st
+import sqlite3
+import numpy as np
+from util.ann_index import DEFAULT_NPROBE, IVFIndex, index_path
+from util.database import get_connection, release_connection
+from util.embedding_store import open_embedding_store
+from util.topic_cooccurrence import get_topic_cooccurrence
+
+# Papers most similar to a paper, by the embeddings of data/build_embeddings.py and the index of
+# data/build_ann_index.py, among the tagged papers in a date range and with a set of topics
+
+# Paper embedding store, the index is next to it
+PAPER_EMBEDDINGS_PATH = 'data/artifacts/paper_embeddings.emb'
+
+
+class SimilarPapers:
+    """Nearest neighbour search over the paper embeddings, restricted to the tagged papers.
+
+    The tagged papers are the rows of the papers x topics incidence matrix of TopicCooccurrence, sorted by date, so
+    a date range is a slice of its rows and the papers of a set of topics are a union of its columns. Both are
+    turned into a mask over the store rows for the search, without reading any paper from the database.
+    """
+
+    def __init__(self, store, index, cooccurrence, store_rows):
+        """Create the search.
+
+        Args:
+            store (EmbeddingStore): Paper embeddings, one row per papers.id.
+            index (IVFIndex): Index of the store, or None to search the store exactly.
+            cooccurrence (TopicCooccurrence): Incidence matrix of the tagged papers.
+            store_rows (np.ndarray): Store row of every incidence row, -1 for papers without an embedding.
+        """
+        self.store = store
+        self.index = index
+        self.cooccurrence = cooccurrence
+        self.store_rows = store_rows
+        # Column-wise copy of the incidence matrix, the papers of topic j are by_topic.indices[indptr[j]:indptr[j + 1]]
+        self.by_topic = cooccurrence.incidence.tocsc()
+        # Incidence row of every store row, -1 for papers that are not tagged
+        embedded = np.flatnonzero(store_rows >= 0)
+        self.incidence_rows = np.full(len(store), -1, dtype=np.int64)
+        self.incidence_rows[store_rows[embedded]] = embedded
+
+    def allowed(self, start_date=None, end_date=None, topics=None):
+        """Return the mask of the store rows of the tagged papers in a date range and with one of a set of topics.
+
+        Args:
+            start_date (str): First date 'YYYY-MM-DD', from the first paper if None.
+            end_date (str): Last date 'YYYY-MM-DD', up to the last paper if None.
+            topics (list): Topic labels, any topic if None or empty.
+
+        Returns:
+            np.ndarray: Boolean mask over the store rows.
+        """
+        days = self.cooccurrence.days
+        start = 0 if start_date is None else np.searchsorted(days, np.datetime64(start_date, 'D'))
+        end = len(days) if end_date is None else np.searchsorted(days, np.datetime64(end_date, 'D'), side='right')
+        if topics:
+            topic_index = self.cooccurrence.topic_index
+            columns = [topic_index[topic] for topic in topics if topic in topic_index]
+            rows = np.concatenate([self.by_topic.indices[self.by_topic.indptr[j]:self.by_topic.indptr[j + 1]]
+                                   for j in columns] or [np.zeros(0, dtype=np.int64)])
+            rows = rows[(rows >= start) & (rows < end)]
+        else:
+            rows = np.arange(start, end)
+        rows = self.store_rows[rows]
+        mask = np.zeros(len(self.store), dtype=bool)
+        mask[rows[rows >= 0]] = True
+        return mask
+
+    def similar(self, paper_id, k, allowed=None, nprobe=DEFAULT_NPROBE):
+        """Find the papers most similar to a paper.
+
+        Args:
+            paper_id (int): papers.id of the paper.
+            k (int): Number of papers.
+            allowed (np.ndarray): Mask of the store rows to search (see allowed), all tagged papers if None.
+            nprobe (int): Lists of the index searched, see IVFIndex.search.
+
+        Returns:
+            list: (rowid in tagged_papers, similarity) tuples, most similar first; empty if the paper has no
+                embedding.
+        """
+        row = self.store.rows_of([paper_id])[0]
+        if row < 0:
+            return []
+        allowed = (self.incidence_rows >= 0) if allowed is None else allowed.copy()
+        # The paper itself is not one of its similar papers
+        allowed[row] = False
+        query = self.store.vectors([row])[0]
+        if self.index is not None:
+            rows, scores = self.index.search(query, k, nprobe, allowed=allowed)
+        else:
+            rows, scores = self.store.search(query, k, np.flatnonzero(allowed))
+        return list(zip(self.cooccurrence.paper_ids[self.incidence_rows[rows]].tolist(), scores.tolist()))
+
+
+def fetch_paper_ids(conn, tagged_ids):
+    """Return the papers.id of each rowid in tagged_papers, -1 for papers missing from the papers table."""
+    rows = np.array(conn.execute("""
+        SELECT tp.rowid, p.id
+        FROM tagged_papers tp
+        JOIN papers p ON p.url = tp.url
+        ORDER BY tp.rowid
+    """).fetchall(), dtype=np.int64).reshape(-1, 2)
+    paper_ids = np.full(len(tagged_ids), -1, dtype=np.int64)
+    if len(rows):
+        positions = np.minimum(np.searchsorted(rows[:, 0], tagged_ids), len(rows) - 1)
+        found = rows[positions, 0] == tagged_ids
+        paper_ids[found] = rows[positions[found], 1]
+    return paper_ids
+
+
+# Loaded once per data version and shared by all sessions, read-only; a new version evicts the previous one
+@st.cache_resource(max_entries=1)
+def get_similar_papers(database_version=None):
+    """Return the similar paper search of the data version.
+
+    Args:
+        database_version (str): Version of the data.
+
+    Returns:
+        SimilarPapers: The search, or None if there are no paper embeddings or tagged papers.
+    """
+    store = open_embedding_store(PAPER_EMBEDDINGS_PATH)
+    cooccurrence = get_topic_cooccurrence(database_version)
+    if store is None or not len(store) or cooccurrence is None:
+        return None
+
+    conn = get_connection()
+    if conn is None:
+        return None
+    try:
+        paper_ids = fetch_paper_ids(conn, cooccurrence.paper_ids)
+    except sqlite3.Error as e:
+        st.error(f"Error fetching data from database: {e}")
+        return None
+    finally:
+        release_connection(conn)
+    index = IVFIndex.load(index_path(PAPER_EMBEDDINGS_PATH), store)
+    return SimilarPapers(store, index, cooccurrence, store.rows_of(paper_ids))
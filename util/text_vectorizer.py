@@ -0,0 +1,139 @@
+import hashlib
+import itertools
+import json
+import math
+import re
+from collections import Counter
+import numpy as np
+
+# Local text embeddings for tagging papers with topics, reproducible without any model download or service
+
+# Words of at least two letters or digits, lowercased before matching
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9\-]*[a-z0-9]")
+
+# Dimensions of the embeddings, and number of dimensions each word is hashed into
+EMBEDDING_DIM = 384
+HASHES_PER_TOKEN = 4
+
+
+def tokenize(text):
+    """Split a text into lowercase words."""
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+class HashingVectorizer:
+    """TF-IDF weighted bag of words, projected to a small dense embedding by feature hashing.
+
+    Every word is hashed (with a stable hash, not Python's salted one) to HASHES_PER_TOKEN dimensions with a random
+    sign each, a sparse random projection, so the cosine similarity of two embeddings approximates the cosine
+    similarity of their TF-IDF vectors without a vocabulary x dimensions matrix. The IDF weights are fitted on the
+    topic texts, so the words that tell topics apart weigh most; words no topic uses get the highest weight.
+
+    The same parameters and IDF table always give the same embeddings, version identifies them.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM, hashes=HASHES_PER_TOKEN, idf=None, documents=0):
+        """Create the vectorizer.
+
+        Args:
+            dim (int): Dimensions of the embeddings.
+            hashes (int): Dimensions each word is hashed into.
+            idf (dict): {word: IDF weight}, see fit.
+            documents (int): Number of documents the IDF weights were fitted on.
+        """
+        self.dim = dim
+        self.hashes = hashes
+        self.idf = idf or {}
+        self.documents = documents
+        self.default_idf = math.log(1 + documents) + 1
+        # Ids of the words seen so far, and their hashed dimensions, signs and IDF weights, one row per id
+        self._token_ids = {}
+        self._dims = np.zeros((0, hashes), dtype=np.int64)
+        self._signs = np.zeros((0, hashes), dtype=np.float32)
+        self._weights = np.zeros(0, dtype=np.float32)
+
+    def fit(self, texts):
+        """Fit the IDF weights on a list of texts (smooth IDF, as in scikit-learn's TfidfVectorizer)."""
+        texts = list(texts)
+        frequencies = Counter(token for text in texts for token in set(tokenize(text)))
+        self.documents = len(texts)
+        self.default_idf = math.log(1 + self.documents) + 1
+        self.idf = {token: math.log((1 + self.documents) / (1 + frequency)) + 1
+                    for token, frequency in frequencies.items()}
+        self._token_ids.clear()
+        self._dims, self._signs, self._weights = self._dims[:0], self._signs[:0], self._weights[:0]
+        return self
+
+    @property
+    def version(self):
+        """Fingerprint of the parameters and the IDF table, equal for vectorizers that give equal embeddings."""
+        digest = hashlib.blake2b(json.dumps([self.dim, self.hashes, self.documents, sorted(self.idf.items())])
+                                 .encode(), digest_size=8).hexdigest()
+        return f"hashing-{self.dim}x{self.hashes}-{digest}"
+
+    def _add_tokens(self, tokens):
+        """Hash the given new words to their dimensions and signs, in the order of their ids."""
+        dims = np.empty((len(tokens), self.hashes), dtype=np.int64)
+        signs = np.empty((len(tokens), self.hashes), dtype=np.float32)
+        for i, token in enumerate(tokens):
+            digest = np.frombuffer(hashlib.blake2b(token.encode(), digest_size=4 * self.hashes).digest(), dtype='<u4')
+            dims[i] = digest % self.dim
+            signs[i] = np.where(digest & (1 << 31), -1.0, 1.0)
+        self._dims = np.concatenate([self._dims, dims])
+        self._signs = np.concatenate([self._signs, signs])
+        self._weights = np.concatenate([self._weights, np.array(
+            [self.idf.get(token, self.default_idf) for token in tokens], dtype=np.float32)])
+
+    def transform(self, texts):
+        """Embed a list of texts.
+
+        Args:
+            texts (list): Texts, None counts as empty.
+
+        Returns:
+            np.ndarray: float32 embeddings of unit length, texts x dim; texts without words get a zero row.
+        """
+        texts = [tokenize(text) for text in texts]
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        if not lengths.sum():
+            return np.zeros((len(texts), self.dim), dtype=np.float32)
+
+        # Words get ids in order of appearance, the words not seen before are hashed once
+        known = len(self._token_ids)
+        token_ids = self._token_ids
+        ids = np.fromiter((token_ids.setdefault(token, len(token_ids)) for tokens in texts for token in tokens),
+                          dtype=np.int64, count=lengths.sum())
+        if len(token_ids) > known:
+            self._add_tokens(list(itertools.islice(token_ids, known, None)))
+
+        # Term frequency of every (text, word) pair
+        vocabulary = len(token_ids)
+        pairs, counts = np.unique(np.repeat(np.arange(len(texts)), lengths) * vocabulary + ids, return_counts=True)
+        rows, ids = np.divmod(pairs, vocabulary)
+
+        # Sublinear term frequency times IDF, spread over the hashed dimensions of each word
+        weights = (1 + np.log(counts.astype(np.float32))) * self._weights[ids]
+        cells = rows[:, None] * self.dim + self._dims[ids]
+        embeddings = np.bincount(cells.ravel(), weights=(weights[:, None] * self._signs[ids]).ravel(),
+                                 minlength=len(texts) * self.dim).reshape(len(texts), self.dim).astype(np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return np.divide(embeddings, norms, out=embeddings, where=norms > 0)
+
+    def to_dict(self):
+        """Return the parameters and IDF table, to store with the embeddings."""
+        return {'dim': self.dim, 'hashes': self.hashes, 'documents': self.documents, 'idf': self.idf}
+
+    @classmethod
+    def from_dict(cls, settings):
+        """Recreate a vectorizer from to_dict."""
+        return cls(settings['dim'], settings['hashes'], settings['idf'], settings['documents'])
+
+
+def topic_text(pref_label, alt_label, description):
+    """Text embedded for a topic: its label, alternative labels and description."""
+    return ' '.join(part for part in (pref_label, alt_label, description) if part)
+
+
+def paper_text(title, abstract):
+    """Text embedded for a paper: its title and abstract."""
+    return ' '.join(part for part in (title, abstract) if part)
@@ -0,0 +1,184 @@
+import streamlit as st
+import sqlite3
+import os
+import numpy as np
+import scipy.sparse as sp
+from util.analytics_core import top_k
+from util.database import get_connection, release_connection
+
+# Topics tagged together on the same papers, from a sparse papers x topics incidence matrix
+
+# Matrices prebuilt by data/build_topic_incidence.py, used while they match the version of the data
+ARTIFACT_PATH = 'data/artifacts/topic_incidence.npz'
+
+
+class TopicCooccurrence:
+    """Papers x topics incidence matrix with the topic x topic co-occurrence counts, in total and per year.
+
+    The incidence matrix is a CSR matrix with one row per tagged paper, sorted by date, and a 1 in the column of
+    every topic the paper is tagged with. The co-occurrence counts are its sparse product with itself: counts[i, j]
+    is the number of papers tagged with both topic i and topic j. The diagonal, the papers of each topic, is kept in
+    papers, so counts has no diagonal. The yearly counts are stacked into one CSR matrix whose row
+    year * topics + i holds the counts of topic i in that year, so a range of years is a handful of row slices.
+    """
+
+    def __init__(self, topics, paper_ids, days, incidence, years, counts, papers, year_counts, year_papers):
+        self.topics = topics
+        self.paper_ids = paper_ids
+        self.days = days
+        self.incidence = incidence
+        self.years = years
+        self.counts = counts
+        self.papers = papers
+        self.year_counts = year_counts
+        self.year_papers = year_papers
+        self.topic_index = {topic: i for i, topic in enumerate(topics)}
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build the incidence matrix and the co-occurrence counts.
+
+        Args:
+            rows (list): (paper_id, topic label, date 'YYYY-MM-DD') rows of the paper_topics table, in any order.
+
+        Returns:
+            TopicCooccurrence: The matrices.
+        """
+        paper_ids, labels, dates = (np.array(column) for column in zip(*rows))
+        days = dates.astype('datetime64[D]')
+
+        # Rows sorted by date, a paper has a single date so its topics end up next to each other
+        order = np.lexsort((paper_ids, days))
+        paper_ids, labels, days = paper_ids[order], labels[order], days[order]
+        new_paper = np.concatenate(([True], paper_ids[1:] != paper_ids[:-1]))
+        rows = np.cumsum(new_paper) - 1
+        topics, columns = np.unique(labels, return_inverse=True)
+        incidence = sp.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)),
+                                  shape=(int(rows[-1]) + 1, len(topics)))
+        # A topic in two slots of the same paper counts once
+        incidence.data[:] = 1
+
+        paper_days = days[new_paper]
+        paper_years = paper_days.astype('datetime64[Y]')
+        years = np.unique(paper_years)
+        bounds = np.searchsorted(paper_years, np.append(years, years[-1] + 1))
+        counts, papers = cls._cooccurrence(incidence)
+        yearly = [cls._cooccurrence(incidence[start:end]) for start, end in zip(bounds[:-1], bounds[1:])]
+        return cls(topics, paper_ids[new_paper], paper_days, incidence, years.astype(int) + 1970, counts, papers,
+                   sp.vstack([year_counts for year_counts, _ in yearly], format='csr'),
+                   np.stack([year_papers for _, year_papers in yearly]))
+
+    @staticmethod
+    def _cooccurrence(incidence):
+        """Return the topic x topic co-occurrence counts without the diagonal, and the diagonal."""
+        counts = (incidence.T @ incidence).tocsr()
+        papers = counts.diagonal().astype(np.int32)
+        counts.setdiag(0)
+        counts.eliminate_zeros()
+        counts.sort_indices()
+        return counts, papers
+
+    def related(self, topic, k=10, first_year=None, last_year=None):
+        """Return the topics most often tagged together with a topic.
+
+        Args:
+            topic (str): Topic label.
+            k (int): Number of related topics.
+            first_year (int): First year to count, from the first year with papers if None.
+            last_year (int): Last year to count, up to the last year with papers if None.
+
+        Returns:
+            list: (topic, papers tagged with both, share of the topic's papers) tuples, most papers first.
+        """
+        i = self.topic_index.get(topic)
+        if i is None:
+            return []
+        if first_year is None and last_year is None:
+            start, end = self.counts.indptr[i], self.counts.indptr[i + 1]
+            together = np.zeros(len(self.topics))
+            together[self.counts.indices[start:end]] = self.counts.data[start:end]
+            papers = self.papers[i]
+        else:
+            years = np.flatnonzero((self.years >= (first_year or self.years[0]))
+                                   & (self.years <= (last_year or self.years[-1])))
+            rows = years * len(self.topics) + i
+            starts, ends = self.year_counts.indptr[rows], self.year_counts.indptr[rows + 1]
+            entries = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)] or [[]]).astype(int)
+            together = np.bincount(self.year_counts.indices[entries], weights=self.year_counts.data[entries],
+                                   minlength=len(self.topics))
+            papers = self.year_papers[years, i].sum()
+        ranked = np.where(together > 0, together, -np.inf)
+        return [(self.topics[j], int(together[j]), together[j] / max(papers, 1)) for j in top_k(ranked, k)]
+
+    def save(self, path, database_version):
+        """Write the matrices to an .npz file, stamped with the version of the data they were built from."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrays = {'database_version': np.array(database_version), 'topics': self.topics.astype(str),
+                  'paper_ids': self.paper_ids, 'days': self.days, 'years': self.years, 'papers': self.papers,
+                  'year_papers': self.year_papers}
+        for name in ('incidence', 'counts', 'year_counts'):
+            matrix = getattr(self, name)
+            arrays.update({f'{name}_data': matrix.data, f'{name}_indices': matrix.indices,
+                           f'{name}_indptr': matrix.indptr, f'{name}_shape': np.array(matrix.shape)})
+        # Write to a temporary file and swap it in, so the app never reads a half written artifact
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, database_version):
+        """Read the matrices if they were built from the given version of the data, None otherwise."""
+        try:
+            with np.load(path, allow_pickle=False) as artifact:
+                if database_version is None or str(artifact['database_version']) != database_version:
+                    return None
+                matrices = {name: sp.csr_matrix((artifact[f'{name}_data'], artifact[f'{name}_indices'],
+                                                 artifact[f'{name}_indptr']), shape=tuple(artifact[f'{name}_shape']))
+                            for name in ('incidence', 'counts', 'year_counts')}
+                return cls(artifact['topics'].astype(object), artifact['paper_ids'], artifact['days'],
+                           years=artifact['years'], papers=artifact['papers'], year_papers=artifact['year_papers'],
+                           **matrices)
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+def fetch_paper_topic_rows(conn):
+    """Return the (paper_id, topic label, date) rows of the paper_topics table."""
+    return conn.execute("""
+        SELECT pt.paper_id, t.prefLabel, pt.date
+        FROM paper_topics pt
+        JOIN topics t ON t.rowid = pt.topic_id
+        WHERE pt.date IS NOT NULL
+    """).fetchall()
+
+
+# Loaded once per data version and shared by all sessions, read-only; a new version evicts the previous one
+@st.cache_resource(max_entries=1)
+def get_topic_cooccurrence(database_version=None):
+    """Return the co-occurrence matrices of the data version.
+
+    The prebuilt artifact is used when it matches the data, otherwise the matrices are built from the database.
+
+    Args:
+        database_version (str): Version of the data.
+
+    Returns:
+        TopicCooccurrence: The matrices, or None if there is no data.
+    """
+    prebuilt = TopicCooccurrence.load(ARTIFACT_PATH, database_version)
+    if prebuilt is not None:
+        return prebuilt
+
+    conn = get_connection()
+    if conn is None:
+        return None
+    try:
+        rows = fetch_paper_topic_rows(conn)
+    except sqlite3.Error as e:
+        st.error(f"Error fetching data from database: {e}")
+        return None
+    finally:
+        release_connection(conn)
+    if not rows:
+        return None
+    return TopicCooccurrence.from_rows(rows)
@@ -0,0 +1,225 @@
+import heapq
+import numpy as np
+import pandas as pd
+
+# Array index of the topic tree, used to cut sunburst charts out of the tree without walking it in pandas
+
+# The topic list has several top-level topics and no root, so a root node is added above them
+ROOT_ID = 'AI_Root'
+ROOT_LABEL = 'Innovation'
+
+
+class TopicHierarchy:
+    """Parent index of the topic tree with the children of every topic in one flat array.
+
+    Node 0 is the added root, node i > 0 is row i - 1 of the topics DataFrame. The children of node i are
+    child_order[child_start[i]:child_start[i + 1]], so subtrees are extracted one level at a time with array
+    operations. Topics whose broader topic isn't in the list hang below the root; topics on a cycle of broader
+    links are not reachable from the root and get depth -1.
+    """
+
+    def __init__(self, topics):
+        """Build the index.
+
+        Args:
+            topics (pd.DataFrame): The s, prefLabel and broader columns of the topics table.
+        """
+        self.ids = np.array([ROOT_ID] + topics['s'].tolist(), dtype=object)
+        self.labels = np.array([ROOT_LABEL] + topics['prefLabel'].tolist(), dtype=object)
+        self._position = {s: i for i, s in enumerate(self.ids)}
+        self.parent = np.array([-1] + [self._position.get(broader, 0) for broader in topics['broader']],
+                               dtype=np.int64)
+        # A topic that is its own broader topic hangs below the root
+        self_parent = self.parent == np.arange(len(self.parent))
+        self.parent[self_parent] = 0
+
+        # Children grouped by parent (counting sort, the root's own -1 entry excluded)
+        self.child_order = np.argsort(self.parent[1:], kind='stable') + 1
+        self.child_start = np.searchsorted(self.parent[self.child_order], np.arange(len(self.parent) + 1))
+
+        # Depth below the root, level by level
+        self.depth = np.full(len(self.parent), -1, dtype=np.int64)
+        self.levels = []
+        level = np.array([0])
+        while len(level):
+            self.depth[level] = len(self.levels)
+            self.levels.append(level)
+            level = self.children(level)
+            level = level[self.depth[level] < 0]
+
+        # Topics by label, the shallowest first where a label is used more than once
+        self._by_label = {}
+        for i in np.argsort(np.where(self.depth < 0, np.iinfo(np.int64).max, self.depth), kind='stable'):
+            self._by_label.setdefault(self.labels[i], int(i))
+        # Topics by label, the first row of the table where a label is used more than once (paper_topics.topic_id)
+        self._first_by_label = {}
+        for i, label in enumerate(self.labels[1:], start=1):
+            self._first_by_label.setdefault(label, i)
+
+    def __len__(self):
+        return len(self.parent)
+
+    def children(self, nodes):
+        """Return the children of all the given nodes, grouped by node.
+
+        Args:
+            nodes (np.ndarray): Node indexes.
+
+        Returns:
+            np.ndarray: Indexes of their children.
+        """
+        starts = self.child_start[nodes]
+        counts = self.child_start[nodes + 1] - starts
+        offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        return self.child_order[offsets + np.arange(counts.sum())]
+
+    def positions(self, ids):
+        """Return the nodes of the given topic ids (s URIs), -1 for ids that are not in the tree."""
+        return np.array([self._position.get(s, -1) for s in ids], dtype=np.int64)
+
+    def aggregate(self, direct):
+        """Sum per-topic values over every subtree in one bottom-up pass.
+
+        Each level adds its totals to its parents with one vectorized np.add.at, deepest level first, so the cost is
+        linear in the number of topics. Topics on a cycle of broader links keep their own values.
+
+        Args:
+            direct (np.ndarray): Values of each node itself, shape (nodes,) or (nodes, columns).
+
+        Returns:
+            np.ndarray: The value of each node plus those of all its descendants, same shape as direct.
+        """
+        totals = np.array(direct, copy=True)
+        for level in reversed(self.levels[1:]):
+            np.add.at(totals, self.parent[level], totals[level])
+        return totals
+
+    def label_positions(self, labels):
+        """Return the nodes the papers of the given topic labels are tagged with, -1 for unknown labels."""
+        return np.array([self._first_by_label.get(label, -1) for label in labels], dtype=np.int64)
+
+    def find(self, label):
+        """Return the node of a topic label (the shallowest one if the label is used more than once), or None."""
+        return self._by_label.get(label)
+
+    def subtree_nodes(self, root, max_depth=None):
+        """Return the nodes of a subtree in breadth-first order with their local parents.
+
+        Args:
+            root (int): Node at the center of the subtree.
+            max_depth (int): Number of levels below the root to include, all levels if None.
+
+        Returns:
+            tuple: (nodes, positions of their parents in nodes with -1 for the root, depth below the root).
+        """
+        nodes, parents, depths = [np.array([root])], [np.array([-1])], [np.array([0])]
+        visited = np.zeros(len(self.parent), dtype=bool)
+        visited[root] = True
+        level, offset, depth = nodes[0], 0, 0
+        while len(level) and (max_depth is None or depth < max_depth):
+            counts = self.child_start[level + 1] - self.child_start[level]
+            children = self.children(level)
+            local_parents = np.repeat(offset + np.arange(len(level)), counts)
+            # Guards against cycles when the subtree root is itself on a cycle of broader links
+            keep = ~visited[children]
+            children, local_parents = children[keep], local_parents[keep]
+            visited[children] = True
+            offset += len(level)
+            depth += 1
+            nodes.append(children)
+            parents.append(local_parents)
+            depths.append(np.full(len(children), depth))
+            level = children
+        return np.concatenate(nodes), np.concatenate(parents), np.concatenate(depths)
+
+    def subtree(self, root_label, max_depth=None, node_budget=None, measures=None):
+        """Extract the subtree of a topic, collapsing the smallest branches above a node budget.
+
+        Branches are kept largest first (by number of topics in the branch) for as long as the chart stays within
+        the budget. The children of a topic that didn't fit are collapsed into one "Other" node below it, so every
+        topic of the subtree is still accounted for.
+
+        Args:
+            root_label (str): Label of the topic at the center, or ROOT_LABEL for the whole tree.
+            max_depth (int): Number of levels below the root to include, all levels if None.
+            node_budget (int): Maximum number of nodes in the chart, including the "Other" nodes; no limit if None.
+            measures (dict): {column: array of subtree totals per node, see aggregate} to add to the chart, the
+                "Other" nodes get the sum over the branches they stand for.
+
+        Returns:
+            pd.DataFrame: id, topic, parent (the id of the parent, '' for the root), node (index in the hierarchy,
+                -1 for "Other" nodes), topics (number of topics the node stands for) and the measures; None if the
+                label is unknown.
+        """
+        root = self.find(root_label)
+        if root is None:
+            return None
+        nodes, local_parent, local_depth = self.subtree_nodes(root, max_depth)
+
+        # Number of topics in each branch, summed bottom-up one level at a time
+        sizes = np.ones(len(nodes), dtype=np.int64)
+        for depth in range(local_depth.max(), 0, -1):
+            level = local_depth == depth
+            np.add.at(sizes, local_parent[level], sizes[level])
+
+        if node_budget is None or len(nodes) <= node_budget:
+            kept = np.ones(len(nodes), dtype=bool)
+        else:
+            kept = self._prune(local_parent, sizes, node_budget)
+
+        # Children of kept nodes that were cut off become one "Other" node per parent
+        cut = ~kept & (local_parent >= 0)
+        cut[cut] = kept[local_parent[cut]]
+        other_topics = np.bincount(local_parent[cut], weights=sizes[cut], minlength=len(nodes)).astype(np.int64)
+
+        kept_nodes = nodes[kept]
+        parent_ids = np.where(local_parent >= 0, self.ids[nodes[np.maximum(local_parent, 0)]], '')
+        chart = pd.DataFrame({
+            'id': self.ids[kept_nodes],
+            'topic': self.labels[kept_nodes],
+            'parent': parent_ids[kept],
+            'node': kept_nodes,
+            'topics': sizes[kept],
+        })
+        for column, totals in (measures or {}).items():
+            chart[column] = totals[kept_nodes]
+        others = np.flatnonzero(other_topics)
+        if len(others):
+            other_chart = pd.DataFrame({
+                'id': [f"{self.ids[nodes[i]]}#other" for i in others],
+                'topic': [f"Other ({n} topics)" for n in other_topics[others]],
+                'parent': self.ids[nodes[others]],
+                'node': -1,
+                'topics': other_topics[others],
+            })
+            for column, totals in (measures or {}).items():
+                other_chart[column] = np.bincount(local_parent[cut], weights=totals[nodes[cut]],
+                                                  minlength=len(nodes))[others].astype(totals.dtype)
+            chart = pd.concat([chart, other_chart], ignore_index=True)
+        return chart
+
+    @staticmethod
+    def _prune(local_parent, sizes, node_budget):
+        """Choose the nodes to keep: the largest branches first, while the nodes plus "Other" nodes fit the budget."""
+        kept = np.zeros(len(local_parent), dtype=bool)
+        kept[0] = True
+        child_count = np.bincount(local_parent[1:], minlength=len(local_parent))
+        pending = child_count.copy()  # children of each kept node that are not kept (yet)
+        total = 1 + (pending[0] > 0)
+        candidates = [(-sizes[i], i) for i in np.flatnonzero(local_parent == 0)]
+        heapq.heapify(candidates)
+        children_of = np.argsort(local_parent, kind='stable')
+        first_child = np.searchsorted(local_parent[children_of], np.arange(len(local_parent) + 1))
+        while candidates:
+            _, i = heapq.heappop(candidates)
+            parent = local_parent[i]
+            # The node itself, minus its parent's "Other" node if it was the last one left out, plus its own
+            new_total = total + 1 - (pending[parent] == 1) + (child_count[i] > 0)
+            if new_total > node_budget:
+                break
+            kept[i] = True
+            pending[parent] -= 1
+            total = new_total
+            for child in children_of[first_child[i]:first_child[i + 1]]:
+                heapq.heappush(candidates, (-sizes[child], child))
+        return kept
@@ -0,0 +1,120 @@
+import streamlit as st
+import sqlite3
+import numpy as np
+from util.analytics_core import get_topic_month_matrix, top_k
+from util.database import get_connection, release_connection
+
+# Trend scores of all topics at once, computed with NumPy over the topics x months matrices of util/analytics_core.py
+
+# Ranking modes offered by the Top Trends page, with the axis title of their scores
+TREND_MODES = {
+    'Fastest growing': 'Growth against the previous period',
+    'Momentum': 'Smoothed monthly growth',
+    'Breakout': 'Z-score against the own history',
+}
+
+# Topics with fewer papers in the window are not ranked by growth, momentum or z-score, their ratios are noise
+MIN_WINDOW_PAPERS = 5
+
+# Months of history the z-score of a window is measured against
+HISTORY_MONTHS = 24
+
+# Weight of the latest month in the exponential smoothing of the momentum
+MOMENTUM_ALPHA = 0.5
+
+
+# Loaded once per data version, a new version evicts the previous one
+@st.cache_resource(max_entries=1)
+def load_topic_levels(database_version=None):
+    """Return {level: set of topic labels} from the level column of the topics table."""
+    conn = get_connection()
+    if conn is None:
+        return {}
+    try:
+        rows = conn.execute("SELECT DISTINCT level, prefLabel FROM topics WHERE level IS NOT NULL").fetchall()
+    except sqlite3.Error as e:
+        st.error(f"Error fetching data from database: {e}")
+        return {}
+    finally:
+        release_connection(conn)
+    levels = {}
+    for level, label in rows:
+        levels.setdefault(int(level), set()).add(label)
+    return levels
+
+
+def trend_scores(counts, start, end):
+    """Score every topic on growth, momentum and breakout for a window of months.
+
+    Args:
+        counts (np.ndarray): Papers per topic and month, topics x months.
+        start (int): Index of the first month of the window.
+        end (int): Index of the month after the window.
+
+    Returns:
+        dict: Arrays over the topics: 'papers' in the window, 'Fastest growing' (relative change against the
+            window before, scaled up to a full window where the data starts less than a window earlier, and -inf
+            for a window at the very start of the data), 'Momentum' (exponentially smoothed change of log counts
+            month over month, over the window) and 'Breakout' (z-score of the window's monthly mean against the
+            HISTORY_MONTHS before it).
+    """
+    counts = counts.astype(np.float64)
+    window = end - start
+    papers = counts[:, start:end].sum(axis=1)
+    # Near the start of the data the window before is cut short, its papers are scaled up to a full window so a
+    # partial period doesn't inflate the growth
+    covered = start - max(start - window, 0)
+    previous = counts[:, start - covered:start].sum(axis=1) * (window / max(covered, 1))
+    growth = (papers - previous) / np.maximum(previous, 1)
+    if not covered:
+        growth[:] = -np.inf
+
+    # Month over month change of log counts, the latest months weigh most
+    log_counts = np.log1p(counts[:, max(start - 1, 0):end])
+    changes = np.diff(log_counts, axis=1)
+    if changes.shape[1]:
+        weights = (1 - MOMENTUM_ALPHA) ** np.arange(changes.shape[1])[::-1]
+        momentum = changes @ weights / weights.sum()
+    else:
+        momentum = np.zeros(len(counts))
+
+    history = counts[:, max(start - HISTORY_MONTHS, 0):start]
+    if history.shape[1]:
+        mean, std = history.mean(axis=1), history.std(axis=1)
+    else:
+        mean, std = np.zeros(len(counts)), np.zeros(len(counts))
+    breakout = (papers / max(window, 1) - mean) / np.maximum(std, 1)
+
+    # Too few papers to tell a trend
+    thin = papers < MIN_WINDOW_PAPERS
+    scores = {'papers': papers, 'Fastest growing': growth, 'Momentum': momentum, 'Breakout': breakout}
+    for mode in TREND_MODES:
+        scores[mode][thin] = -np.inf
+    return scores
+
+
+def rank_topics(mode, start_month, end_month, number_topics, database_version=None, level=None):
+    """Rank the topics by a trend mode over a range of months.
+
+    Args:
+        mode (str): One of TREND_MODES, or 'papers' for the number of papers in the window.
+        start_month (str): First month of the window ('YYYY-MM').
+        end_month (str): Last month of the window ('YYYY-MM').
+        number_topics (int): Number of topics to return.
+        database_version (str): Version of the data.
+        level (int): Roll up to this level of the topic tree: only its topics are ranked, each by the papers of
+            its whole subtree (topic_month_counts.subtree_count, built from the topic_descendants closure).
+
+    Returns:
+        list: (topic, score, papers in the window) tuples, best first.
+    """
+    matrix = get_topic_month_matrix(database_version)
+    if matrix is None:
+        return []
+    window = matrix.month_slice(start_month, end_month)
+    scores = trend_scores(matrix.counts(subtree=level is not None), window.start, window.stop)
+    ranked = np.where(scores['papers'] > 0, scores[mode], -np.inf)
+    if level is not None:
+        ranked = np.where(matrix.candidate_mask(load_topic_levels(database_version).get(level, ())), ranked, -np.inf)
+    return [(matrix.topics[i], float(scores[mode][i]), int(scores['papers'][i]))
+            for i in top_k(ranked, number_topics)]